@@ -1,87 +1,61 @@
+from openai import RateLimitError
 from openai.types.shared.reasoning_effort import ReasoningEffort
 from pandas import read_sas
 import streamlit as st
-from openai import OpenAI
-from utils.mongodb import check_identifier, log_message, update_session_key
+from utils.access_codes import is_access_code_valid
+from utils.assets import figure_html
+from utils.circuit_breaker import get_breaker
+from utils.context_window import CONTEXT_MODE, BoundedContext, estimate_tokens
+from utils.message_store import CHAT_HISTORY_IN_MEMORY, ChatHistory
+from utils.rate_limit import AdmissionTimeout, call_with_backoff, get_admission_controller, limited_call
+from utils.prompts import DEFAULT_PROBLEM_ID, DEFAULT_PROMPT_VERSION, get_prompt_registry
+from utils.openai_client import get_openai_client
+from utils.mongodb import get_session_header, get_session_key, make_session_key, set_conversation_id
+from utils.prewarm import GREETING, adopt_prewarm, create_conversation, start_prewarm
+from utils.schema import bootstrap_indexes_once
+from utils.session_store import persist_session, rehydrate_session
+from utils.streaming import StreamError, StreamRenderer
+from utils.tracing import TRACE_TRANSCRIPTS, record_span, span, start_metrics_server, traced, turn_trace
+from utils.transcript_writer import enqueue_message, flush_transcripts
+from utils.usage import from_chat_usage, from_responses_usage, prompt_cache_key
 import os
+import time
+
+# Output limit for Rabbit's replies, also used when estimating a turn's tokens
+MAX_OUTPUT_TOKENS = 250
+
+# Messages rendered on each turn; older ones are loaded a page at a time on request
+CHAT_HISTORY_WINDOW = int(os.getenv("CHAT_HISTORY_WINDOW", "40"))
+CHAT_HISTORY_PAGE = int(os.getenv("CHAT_HISTORY_PAGE", "40"))
 
 def is_identifier_valid():
     identifier = st.session_state.get("user_identifier", "").strip()
     if not identifier:
         return False
-    return check_identifier(st.session_state["mongodb_uri"], identifier)
-
-def load_rabbit_v5_prompt():
-    """Load the rabbit_v5 prompt from the prompts directory"""
-    prompt_path = "./prompts/rabbit_v5.md"
-    
-    if os.path.exists(prompt_path):
-        with open(prompt_path, 'r') as file:
-            return file.read()
-    else:
-        st.error("Error: rabbit_v5.md prompt file not found!")
-        return ""
-
-def get_prompt_with_context():
-    """Get the rabbit_v5 prompt with the economics problem context"""
-    base_prompt = load_rabbit_v5_prompt()
-
-    # Add the same economics problem context for all prompt variations
-    economics_problem = """Assume that a perfectly competitive, constant-cost industry (with free entry and exit) is in along-run equilibrium with 40 firms. The market demand function is downward sloping. All firms have the same U-shaped average cost functions. Each firm produces 60 units of output, which it sells at a price of \$27 per unit; out of this amount, each firm pays a $3 tax per unit of output. Please refer to the graphs below, which depict the initial equilibrium.
-
-The government decides to decrease the tax so that firms will pay \$1 per unit in tax.
-
-a) Consider the graphs below, which depict the initial long-run (LR) equilibrium. What are the equilibrium price pA and output QA? What is the output qa? What is the profit ofeach firm? Why? How could we determine from the graphs that this industry is indeed in the LR equilibrium?
-
-b) Explain what would happen in the short run (SR) to the equilibrium price and industry output, the number of firms in the industry, output and profit of each firm. Illustrate on graphs for the market and a particular firm. Please label the market equilibrium point as B (price pB and output QB) and the firm’s point as b (output qb).
-
-c) Explain what would happen in the long run (LR) to the equilibrium price and industry output, the number of firms in the industry, and the output and profit of each firm. Illustrate on graphs for the market and a particular firm. Please label the market equilibrium point as C (price pC and output QC) and the firm’s point as c (output qc). Compare this new long-run equilibrium to the initial long-run equilibrium, described in part (a), and to the short-run equilibrium found in part (b).
-"""
-
-    economics_solution = """a) The initial long-run (LR) equilibrium. The initial market equilibrium is at point A, where market demand intersects the initial SR industry supply (which is upward sloping). At the same point, the demand intersects the LR industry supply (which is a horizontal line at the price pA). We know that the current LR equilibrium price is pA = \$27. This is the price consumers pay. Firms receive this price and then pay \$3 in tax to the government. Because there are 40 firms in the industry, and each firm produces output $qa = 60$ units, the market (industry) output is $QA = 40*60 = 2400$. The average cost curve (AC) of each firm takes into account the \$3 per unit tax. Each firm produces at the minimum of its AC, which is achieved at the output $qa= 60$. This is represented by point a on the graph for the firm below (on the right). To maximise its profit, each firm produces the output such that price equals MC. Here, the price also equals the minimum of the average cost AC. When price equals AC, a firm's profit is zero. Because firms make zero profits in equilibrium, we know that this industry is in the LR equilibrium.
-
-b) per unit tax decreased by $2, Short-Run (SR) equilibrium. 
-    
-After tax is reduced by \$2, the average cost (AC) and the marginal cost (MC) curves of each firm shift down by the amount of tax decrease, $Δt = \$2$ (because this is a per-unit tax, the reduction in AC and MC is equal to the reduction in tax, \$2). Therefore, the minimum of the new AC will be at \$25. The number of firms in the industry stays the same in SR because firms are not able to enter or exit the industry in SR. Therefore, the industry supply, which is the horizontal sum of the supplies of all firms, shifts down by $2 as well. We can also think of it as a shift of SR industry supply to the right.
-
-What would happen in the SR equilibrium? The demand function stays the same, but the supply function shifts down (or to the right); therefore, the new intersection point B, the new SR equilibrium, will correspond to a lower price pB and the higher output QB.
-
-Because the demand function is downward sloping, and the downward-sloping supply function shifts down by \$2, the price will decrease by less than \$2.
-
-SR equilibrium (summary): price is pB (decreases from the initial price of \$27 by less than \$2), market output is QB, higher than the initial quantity of 2400. The market SR equilibrium is at point B. The number of firms stays the same.
-
-At the new SR equilibrium price, pB, each firm produces output qb. At this output, the MC of the firm equals the price, which guarantees that the firm maximises its profit. The output qb is greater than $qa = 60$, because MC and AC shifts down by \$2, but the price decreases by less than \$2. The output qb is not at the minimum of the AC for tax = \$1, it is to the right. Therefore, at this output, MC (which is equal to price pb) is above the AC, and the firm will make a positive profit (represented by the green rectangle). 
+    return is_access_code_valid(st.session_state["mongodb_uri"], identifier)
 
-Each firm in the SR equilibrium (summary): output is $qb > qa = 60$; profit is positive.
-
-c) per unit tax decreased by \$2, Long Run (LR) equilibrium.
-
-What would happen in the long run? Because each firm makes a positive profit in SR, this could not be an LR equilibrium. Attracted by positive profits, new firms start entering the industry. As a result, the SR industry supply shifts even further to the right (because more firms can produce more output for any given price). As more firms keep entering, the industry supply shifts further and further. 
-
-As demand stays the same (does not shift), but supply increases (shifts to the right), the market price decreases. How long will this process of firms entering and price decreasing continue? The firms will enter as long as profits are positive. Because more firms result in a lower market price for their output, the profits in the industry decrease as the number of firms increases. Note that each firm will also decrease its output in response to a lower price. Firms will enter until the price reaches $pC = \$25$, the new minimum of the ACLR curve, when firms make zero profit.
-
-Therefore, in the LR, the price will decrease by exactly the amount of tax reduction, \$2.
-
-New LR equilibrium (summary): price $pC = \$25$, output QC (LR equilibrium is at point C); more firms in the industry; each firm produces output $qa= 60$ and makes zero profit.
-
-Compared to the initial LR equilibrium (described in part a): price down to \$25 (it decreases by the same amount as the tax decrease, \$2), market output Q is up, quantity produced by each firm is the same: $qa  = 60$, profits are the same (equal to zero), the number of firms N increased.
-
-Compared to the SR equilibrium (found in part b): price is down, market output is up, quantity produced by each firm is down, profits are down to 0, and the number of firms in the industry, N, increased.
-
-    
-    """
-
-    return base_prompt + "\n\n## The Economics Problem\n" + economics_problem + "\n\n## The Solution\n" + economics_solution
+def get_current_instructions():
+    """Return the shared, prebuilt instructions for this session's prompt version"""
+    try:
+        return get_prompt_registry().get_instructions(
+            st.session_state.get("prompt_version", DEFAULT_PROMPT_VERSION),
+            st.session_state.get("problem_id", DEFAULT_PROBLEM_ID)
+        )
+    except FileNotFoundError as e:
+        st.error(f"Error: prompt file not found! ({e.filename})")
+        st.stop()
 
 def setup():
     # Initialize current prompt if not set
     if "current_prompt" not in st.session_state:
         st.session_state["current_prompt"] = "rabbit_v5"  # Default to v5
 
-    # Load current prompt with context
-    if "current_prompt_content" not in st.session_state or st.session_state.get("prompt_version") != "rabbit_v5":
-        st.session_state["current_prompt_content"] = get_prompt_with_context()
+    # Reference the shared prompt by version; the text itself lives in the registry
+    if st.session_state.get("prompt_version") != "rabbit_v5":
         st.session_state["prompt_version"] = "rabbit_v5"
+    if "problem_id" not in st.session_state:
+        st.session_state["problem_id"] = DEFAULT_PROBLEM_ID
+    st.session_state["prompt_hash"] = get_current_instructions().sha256
 
     # Set up model
     if "model" not in st.session_state:
@@ -89,7 +63,7 @@ def setup():
 
     # Initialize chat history
     if "chat_history" not in st.session_state:
-        st.session_state["chat_history"] = []
+        st.session_state["chat_history"] = ChatHistory()
 
     # Initialize response counter
     if "response_counter" not in st.session_state:
@@ -107,6 +81,12 @@ def setup():
     if "mongodb_uri" not in st.session_state:
         st.session_state["mongodb_uri"] = st.secrets["MONGODB_CONNECTION_STRING"]
 
+    # Create any missing indexes once per process
+    bootstrap_indexes_once(st.session_state["mongodb_uri"])
+
+    # Expose span histograms and runtime counters on METRICS_PORT, once per process
+    start_metrics_server()
+
     # Session tracking - generate unique session ID if not exists
     if "session_id" not in st.session_state:
         import uuid
@@ -128,35 +108,65 @@ def setup():
     if "openai_conversation_id" not in st.session_state:
         st.session_state["openai_conversation_id"] = None
 
-    # Set up OpenAI API client
-    client = OpenAI(api_key=st.secrets["OPENAI_API_KEY"])
+    # Running summary and recent-message window for bounded-context mode
+    if "bounded_context" not in st.session_state:
+        st.session_state["bounded_context"] = BoundedContext()
+
+    # Shared OpenAI API client; keeps its connection pool across reruns and sessions
+    client = get_openai_client(st.secrets["OPENAI_API_KEY"])
 
     return client
 
+@traced("create_or_get_conversation")
 def create_or_get_conversation(client):
     """Create a new conversation thread or retrieve existing one"""
     if not st.session_state.get("openai_conversation_id"):
+        # Use the conversation prewarmed during login if it is ready
+        future = st.session_state.pop("prewarm_future", None)
+        conversation_id, saved = adopt_prewarm(future) if future is not None else (None, False)
+        if conversation_id:
+            st.session_state["openai_conversation_id"] = conversation_id
+            if saved:
+                return conversation_id
+        else:
+            try:
+                # Create new conversation
+                conversation = create_conversation(
+                    client,
+                    st.session_state.get("user_identifier", "unknown"),
+                    st.session_state["session_id"]
+                )
+                conversation_id = conversation.id
+                st.session_state["openai_conversation_id"] = conversation_id
+            except Exception as e:
+                st.error(f"Error creating conversation: {e}")
+                return None
+
+        # The session key is already fixed, so recording the conversation is a single $set
         try:
-            # Create new conversation
-            conversation = client.conversations.create(
-                items=[
-                    {
-                        "type": "message",
-                        "role": "assistant",
-                        "content": "Hi, I am Rabbit! What is your name?"
-                    }
-                ],
-                metadata={
-                    "user_identifier": st.session_state.get("user_identifier", "unknown"),
-                    "session_type": "economics_study"
-                }
+            set_conversation_id(
+                st.session_state["mongodb_uri"],
+                get_session_key(),
+                conversation_id,
+                header=get_session_header("rabbit_study")
             )
-            st.session_state["openai_conversation_id"] = conversation.id
         except Exception as e:
-            st.error(f"Error creating conversation: {e}")
-            return None
+            st.error(f"Error saving conversation ID: {e}")
     return st.session_state["openai_conversation_id"]
 
+def start_session_prewarm(client):
+    """Create the new session's conversation and transcript header in the background; adopted on the first turn"""
+    if CONTEXT_MODE == "bounded":
+        # Bounded mode sends its own context window and never uses a conversation
+        return
+    st.session_state["prewarm_future"] = start_prewarm(
+        client,
+        st.session_state["mongodb_uri"],
+        st.session_state["user_identifier"],
+        st.session_state["session_id"],
+        get_session_header("rabbit_study")
+    )
+
 def get_conversation_info(client, conversation_id):
     """Retrieve conversation information"""
     try:
@@ -169,65 +179,266 @@ def get_conversation_info(client, conversation_id):
 def clear_conversation():
     """Clear the current conversation"""
     st.session_state["openai_conversation_id"] = None
-    st.session_state["chat_history"] = []
+    st.session_state["chat_history"] = ChatHistory()
     st.session_state["response_counter"] = 0
     st.session_state["conversation_finished"] = False
     st.session_state["hint_index"] = 0  # Reset hint index when clearing conversation
     st.session_state["recent_hints"] = []  # Clear recent hints when clearing conversation
     st.session_state["message_counter"] = 0  # Reset message counter when clearing conversation
-    st.session_state["conversation_id_set"] = False  # Reset conversation ID flag
+    st.session_state["bounded_context"] = BoundedContext()  # Drop the running summary
+    # A prewarmed conversation belongs to the session being replaced
+    st.session_state.pop("prewarm_future", None)
+    st.session_state.pop("history_shown", None)  # Back to the default history window
+    st.session_state.pop("history_rendered", None)
     # Generate new session ID for new conversation
     import uuid
     st.session_state["session_id"] = str(uuid.uuid4())
+    # Fix the transcript key for the whole session up front
+    st.session_state["session_key"] = make_session_key(
+        st.session_state.get("user_identifier", "anonymous"),
+        st.session_state["session_id"]
+    )
 
 def get_next_hint():
-    """Get the next hint from solution.md"""
+    """Get the next hint for this session's problem from the shared hint index"""
     try:
-        with open("prompts/solution.md", 'r') as file:
-            lines = file.readlines()
-            current_index = st.session_state.get("hint_index", 0)
-
-            # Keep looking for the next non-empty line
-            while current_index < len(lines):
-                hint_line = lines[current_index].strip()
-                if hint_line:  # Found a non-empty line
-                    return hint_line, current_index
-                current_index += 1
-
-            return None, -1  # No more hints available
+        hints = get_prompt_registry().get_hints(st.session_state.get("problem_id", DEFAULT_PROBLEM_ID))
     except FileNotFoundError:
         return None, -1
+    hint = hints.get(st.session_state.get("hint_index", 0))
+    if hint is None:
+        return None, -1  # No more hints available
+    return hint.text, hint.index
 
 def show_next_hint():
     """Add the next hint to chat history"""
-    hint, hint_line_index = get_next_hint()
+    hint, hint_position = get_next_hint()
     if hint is not None:
         hint_message = f"Let's read a hint: {hint}"
         hint_message_obj = {"role": "assistant", "content": hint_message}
-        st.session_state.chat_history.append(hint_message_obj)
+        entry = st.session_state.chat_history.append(hint_message_obj)
         
         # Save hint message to database in real-time
         try:
-            log_message(
+            enqueue_message(
                 st.session_state["mongodb_uri"],
                 "rabbit_study",
                 hint_message_obj,
                 st.session_state["message_counter"]
             )
+            entry.message_index = st.session_state["message_counter"]
             st.session_state["message_counter"] += 1
         except Exception as e:
             st.error(f"Error saving message: {e}")
         
         # Add hint to recent hints for conversation context
         st.session_state.recent_hints.append(hint_message)
-        # Update hint_index to point to the next line to check
-        st.session_state.hint_index = hint_line_index + 1
+        # Update hint_index to point to the next hint
+        st.session_state.hint_index = hint_position + 1
         st.rerun()
 
 # Function removed - no longer needed since we only use rabbit_v5
 
+def get_context_messages(summary_role):
+    """Running summary plus recent messages for bounded-context mode"""
+    context = st.session_state["bounded_context"]
+    context.collect()
+    summary = context.summary_message(summary_role)
+    return ([summary] if summary else []) + context.window(st.session_state.chat_history)
+
+def stream_responses_api(client, container, conversation_id, combined_input, started):
+    """Stream a reply from the Responses API, continuing the server-side conversation.
+
+    ``started`` is when the attempt began, so time to first token includes
+    connecting and any rate-limit back-off. Returns the renderer and the
+    reply's token usage from the final stream event.
+    """
+    if CONTEXT_MODE == "bounded":
+        # Send a bounded window instead of growing the server-side conversation
+        conversation_args = {"input": get_context_messages("developer")}
+    else:
+        conversation_args = {
+            "conversation": conversation_id,  # Use conversation ID, not messages array
+            "input": combined_input  # Pass combined input with recent hints
+        }
+
+    # The shared instructions come first and never vary within a prompt version,
+    # so every turn starts with the same cacheable prefix; per-turn content
+    # (hints, summary, new messages) only ever follows it
+    instructions = get_current_instructions()
+    # 429s are retried by call_with_backoff, which also pauses other sessions' requests
+    stream = call_with_backoff(lambda: client.with_options(max_retries=0).responses.create(
+        model=st.session_state["model"],
+        instructions=instructions.text,
+        prompt_cache_key=prompt_cache_key(instructions),
+        stream=True,
+        max_output_tokens=MAX_OUTPUT_TOKENS,
+        reasoning={"effort": "minimal"},
+        **conversation_args
+    ))
+
+    renderer = StreamRenderer(container, started_at=started)
+    usage = None
+    for chunk in stream:
+        # Handle different chunk types from OpenAI Responses API
+        if hasattr(chunk, 'type'):
+            # Handle text delta events
+            if chunk.type == 'response.output_text.delta':
+                if hasattr(chunk, 'delta') and chunk.delta:
+                    renderer.append(chunk.delta)
+            # The final event carries the token usage for the whole response
+            elif chunk.type == 'response.completed':
+                usage = from_responses_usage(chunk.response.usage)
+            elif chunk.type == 'response.incomplete':
+                usage = from_responses_usage(chunk.response.usage)
+                details = getattr(chunk.response, 'incomplete_details', None)
+                reason = getattr(details, 'reason', None)
+                # A reply cut off at the output limit is still a reply; anything else is a failure
+                if reason != 'max_output_tokens' or not renderer.text:
+                    raise StreamError(f"Response incomplete: {reason or 'unknown reason'}")
+            # Failure events do not raise in the SDK, so raise here to let the breaker and fallback see them
+            elif chunk.type == 'response.failed':
+                error = getattr(chunk.response, 'error', None)
+                raise StreamError(f"Response failed: {getattr(error, 'message', None) or 'unknown error'}")
+            elif chunk.type == 'error':
+                raise StreamError(f"Response stream error: {getattr(chunk, 'message', None) or 'unknown error'}")
+        else:
+            # Fallback for any other format
+            if hasattr(chunk, 'content') and chunk.content:
+                renderer.append(chunk.content)
+    renderer.finish()
+    return renderer, usage
+
+def stream_chat_completions(client, container, started):
+    """Stream a reply from the chat completions API using the chat history; returns the renderer and usage"""
+    if CONTEXT_MODE == "bounded":
+        history = get_context_messages("system")
+    else:
+        # Only the messages still in memory; reading spilled ones would reload
+        # the transcript on every fallback turn
+        chat_history = st.session_state.chat_history
+        history = [{"role": m["role"], "content": m["content"]} for m in chat_history.recent()]
+        if chat_history.spilled:
+            history.insert(0, {"role": "system",
+                               "content": f"The {chat_history.spilled} earliest messages of this conversation are not included."})
+    instructions = get_current_instructions()
+    messages = [
+        {"role": "system", "content": instructions.text}
+    ] + history
+
+    stream = call_with_backoff(lambda: client.with_options(max_retries=0).chat.completions.create(
+        model=st.session_state["model"],
+        messages=messages,
+        prompt_cache_key=prompt_cache_key(instructions),
+        stream=True,
+        stream_options={"include_usage": True},
+        max_completion_tokens=MAX_OUTPUT_TOKENS
+    ))
+
+    renderer = StreamRenderer(container, started_at=started)
+    usage = None
+    for chunk in stream:
+        if chunk.choices and chunk.choices[0].delta.content is not None:
+            renderer.append(chunk.choices[0].delta.content)
+        # With include_usage the last chunk has no choices, only usage
+        if chunk.usage is not None:
+            usage = from_chat_usage(chunk.usage)
+    renderer.finish()
+    return renderer, usage
+
+def probe_responses_api(client, model):
+    """Cheap Responses API call used to check whether the backend has recovered"""
+    limited_call("breaker-probe", 32, lambda: client.responses.create(
+        model=model, input="ping", max_output_tokens=16, reasoning={"effort": "minimal"}
+    ))
+
+def estimate_turn_tokens(combined_input):
+    """Rough token estimate for one reply, used to reserve rate-limit budget"""
+    if CONTEXT_MODE == "bounded":
+        context = st.session_state["bounded_context"]
+        tokens = estimate_tokens(context.summary)
+        tokens += sum(estimate_tokens(m["content"]) for m in context.window(st.session_state.chat_history))
+    else:
+        # The server-side conversation holds every earlier message; the running
+        # estimate covers them without reloading spilled ones
+        tokens = estimate_tokens(combined_input) + st.session_state.chat_history.token_estimate
+    return tokens + estimate_tokens(get_current_instructions().text) + MAX_OUTPUT_TOKENS
+
+def usage_record(usage, renderer, started, backend):
+    """Token usage plus latency for one reply, as stored alongside the message"""
+    record = dict(usage or {})
+    record["latency_ms"] = round((time.perf_counter() - started) * 1000, 1)
+    if renderer.time_to_first_delta is not None:
+        record["ttft_ms"] = round(renderer.time_to_first_delta * 1000, 1)
+        record_span("openai.time_to_first_token", renderer.time_to_first_delta, renderer.started_at)
+    record["backend"] = backend
+    record["model"] = st.session_state["model"]
+    return record
+
+def generate_response(client, conversation_id, combined_input):
+    """Stream Rabbit's reply once the admission controller lets the request through.
+
+    Returns the reply text and its usage record (None if no reply was generated).
+    """
+    container = st.empty()
+    try:
+        permit = get_admission_controller().acquire(
+            st.session_state["session_id"],
+            estimate_turn_tokens(combined_input),
+            on_queued=lambda: container.markdown("*Rabbit is thinking (queued)...*")
+        )
+    except AdmissionTimeout:
+        container.empty()
+        st.error("Rabbit is helping a lot of students right now. Please try again in a moment.")
+        return "", None
+    record_span("openai.admission_wait", permit.waited)
+    with permit, span("openai.stream"):
+        response, usage = stream_with_fallback(client, container, conversation_id, combined_input)
+        if usage and "input_tokens" in usage:
+            permit.actual_tokens = usage["input_tokens"] + usage["output_tokens"]
+    return response, usage
+
+def stream_with_fallback(client, container, conversation_id, combined_input):
+    """Stream Rabbit's reply, skipping any backend whose circuit breaker is open"""
+    model = st.session_state["model"]
+
+    responses_breaker = get_breaker("responses", probe=lambda: probe_responses_api(client, model))
+    if responses_breaker.allow_request():
+        started = time.perf_counter()
+        try:
+            renderer, usage = stream_responses_api(client, container, conversation_id, combined_input, started)
+            responses_breaker.record_success(renderer.time_to_first_delta)
+            return renderer.text, usage_record(usage, renderer, started, "responses")
+        except RateLimitError:
+            # The backend is up but out of capacity; the fallback shares the same limits
+            responses_breaker.record_success()
+            st.error("Rabbit is helping a lot of students right now. Please try again in a moment.")
+            return "", None
+        except Exception as e:
+            responses_breaker.record_failure(e, time.perf_counter() - started)
+            st.error(f"Error generating response: {e}")
+
+    # Fallback to chat completions API
+    completions_breaker = get_breaker("chat_completions")
+    if not completions_breaker.allow_request():
+        st.error("Rabbit can't answer right now. Please try again in a moment.")
+        return "", None
+    started = time.perf_counter()
+    try:
+        renderer, usage = stream_chat_completions(client, container, started)
+        completions_breaker.record_success(renderer.time_to_first_delta)
+        return renderer.text, usage_record(usage, renderer, started, "chat_completions")
+    except RateLimitError:
+        completions_breaker.record_success()
+        st.error("Rabbit is helping a lot of students right now. Please try again in a moment.")
+        return "", None
+    except Exception as e:
+        completions_breaker.record_failure(e, time.perf_counter() - started)
+        st.error(f"Error generating response: {e}")
+        return "", None
+
 def login_page():
-    setup()
+    client = setup()
     st.title("🐰 Rabbit - Economics Study Buddy")
     st.markdown(
         "Welcome! You'll be helping Rabbit, a second-year university student who studies Intermediate Microeconomics. "
@@ -253,12 +464,19 @@ def login_page():
     )
 
     if identifier:
-        if check_identifier(st.session_state["mongodb_uri"], identifier):
+        if is_access_code_valid(st.session_state["mongodb_uri"], identifier):
             st.session_state["user_identifier"] = identifier
+            # Pick up a session started on another replica or before a reconnect,
+            # now that the student has proven it is theirs
+            if resume_session(identifier):
+                st.rerun()
             st.success("✅ Access code validated successfully! You can now start your study session with Rabbit.")
             if st.button("Start Study Session", type="primary"):
                 # Clear any existing conversation for new user
                 clear_conversation()
+                # Get the conversation ready while the student reads the greeting;
+                # starting it here, not on code entry, leaves no unused conversations
+                start_session_prewarm(client)
                 st.session_state["show_chat"] = True
                 st.rerun()
         else:
@@ -272,30 +490,38 @@ def chat_page():
 
     st.title("🐰 Study Session with Rabbit")
 
+    # Keep the session ID in the URL so a reconnect to any replica can resume it
+    if st.query_params.get("session") != st.session_state["session_id"]:
+        st.query_params["session"] = st.session_state["session_id"]
+
     # Sidebar with conversation management
     with st.sidebar:
 
         # Conversation management
         conversation_id = st.session_state.get("openai_conversation_id")
-        if conversation_id:
+        if conversation_id or "prewarm_future" in st.session_state or CONTEXT_MODE == "bounded":
             if st.button("🔄 New Conversation", help="Start a fresh conversation"):
                 clear_conversation()
                 st.rerun()
         else:
             st.info("No active conversation")
-    st.markdown("*Help Rabbit understand Intermediate Microeconomics concepts*")
-    st.markdown("### Problem: Tax in a Perfectly Competitive Industry")
-    st.markdown("""Assume that a perfectly competitive, constant-cost industry (with free entry and exit) is in along-run equilibrium with 40 firms. The market demand function is downward sloping. All firms have the same U-shaped average cost functions. Each firm produces 60 units of output, which it sells at a price of \$27 per unit; out of this amount, each firm pays a $3 tax per unit of output. Please refer to the graphs below, which depict the initial equilibrium.
-
-The government decides to decrease the tax so that firms will pay \$1 per unit in tax.
-
-a) Consider the graphs below, which depict the initial long-run (LR) equilibrium. What are the equilibrium price pA and output QA? What is the output qa? What is the profit ofeach firm? Why? How could we determine from the graphs that this industry is indeed in the LR equilibrium?
 
-b) Explain what would happen in the short run (SR) to the equilibrium price and industry output, the number of firms in the industry, output and profit of each firm. Illustrate on graphs for the market and a particular firm. Please label the market equilibrium point as B (price pB and output QB) and the firm’s point as b (output qb).
+    problem_panel()
+    render_history()
+    chat_area(client)
 
-c) Explain what would happen in the long run (LR) to the equilibrium price and industry output, the number of firms in the industry, and the output and profit of each firm. Illustrate on graphs for the market and a particular firm. Please label the market equilibrium point as C (price pC and output QC) and the firm’s point as c (output qc). Compare this new long-run equilibrium to the initial long-run equilibrium, described in part (a), and to the short-run equilibrium found in part (b).
-""")
-    st.image("prompts/tax_in_a_perfectly_competitive_industry.png", output_format="auto", channels="RGB", caption=None)
+def problem_panel():
+    """Problem statement and figure; outside the chat fragment, so chat turns never re-render it"""
+    st.markdown("*Help Rabbit understand Intermediate Microeconomics concepts*")
+    problem = get_prompt_registry().get_problem(st.session_state["problem_id"])
+    st.markdown(f"### Problem: {problem.title}")
+    st.markdown(problem.problem)
+    # Prefer the prebuilt, content-hashed static figure the browser can cache
+    figure = figure_html(problem.figure, alt=problem.title)
+    if figure:
+        st.markdown(figure, unsafe_allow_html=True)
+    else:
+        st.image(problem.figure, output_format="auto", channels="RGB", caption=None)
     st.markdown(
         """
         <style>
@@ -306,50 +532,78 @@ c) Explain what would happen in the long run (LR) to the equilibrium price and i
         """,
         unsafe_allow_html=True,
     )
+
+def show_earlier_messages():
+    st.session_state["history_shown"] = st.session_state.get("history_shown", CHAT_HISTORY_WINDOW) + CHAT_HISTORY_PAGE
+
+def render_history():
+    """Render the most recent messages, keeping older ones behind a "show earlier" button.
+
+    Called outside the chat fragment, so a chat turn does not re-render them;
+    the fragment only shows what was added after this ran.
+    """
+    history = st.session_state.chat_history
+    st.session_state["history_rendered"] = len(history)
+    hidden = max(0, len(history) - st.session_state.get("history_shown", CHAT_HISTORY_WINDOW))
+    if hidden:
+        st.button(
+            f"Show {min(CHAT_HISTORY_PAGE, hidden)} earlier messages ({hidden} not shown)",
+            key="show_earlier_messages",
+            on_click=show_earlier_messages
+        )
+    for message in history[hidden:]:
+        with st.chat_message(message["role"]):
+            st.markdown(message["content"])
+
+@st.fragment
+def chat_area(client):
+    """Chat history, input and actions; a message submit reruns only this fragment"""
     # Add initial Rabbit message if chat history is empty
     if not st.session_state.chat_history:
-        # Ensure we have a conversation ID before the first message
-        conversation_id = create_or_get_conversation(client)
-        if not conversation_id:
-            st.error("Failed to create conversation. Please try again.")
-            return
-        
-        # If this is the first time we got a conversation ID, update the session key
-        if conversation_id and not st.session_state.get("conversation_id_set"):
-            user_identifier = st.session_state.get("user_identifier", "anonymous")
-            session_id = st.session_state.get("session_id", "unknown_session")
-            old_session_key = f"{user_identifier}_{session_id}"
-            new_session_key = f"{user_identifier}_{conversation_id}"
-            
-            try:
-                update_session_key(
-                    st.session_state["mongodb_uri"],
-                    old_session_key,
-                    new_session_key,
-                    "rabbit_study"
-                )
-                st.session_state["conversation_id_set"] = True
-            except Exception as e:
-                st.error(f"Error updating session key: {e}")
-        
-        initial_message = "Hi, I am Rabbit! What is your name?"
+        # Ensure we have a conversation ID before the first message; a prewarmed
+        # one is adopted on the first turn, so the greeting does not wait for it.
+        # Bounded mode sends its own context window and needs no conversation
+        if CONTEXT_MODE != "bounded" and "prewarm_future" not in st.session_state:
+            conversation_id = create_or_get_conversation(client)
+            if not conversation_id:
+                st.error("Failed to create conversation. Please try again.")
+                return
+
+        initial_message = GREETING
         message_obj = {"role": "assistant", "content": initial_message}
-        st.session_state.chat_history.append(message_obj)
+        entry = st.session_state.chat_history.append(message_obj)
         
         # Save initial message to database in real-time
         try:
-            log_message(
+            enqueue_message(
                 st.session_state["mongodb_uri"],
                 "rabbit_study",
                 message_obj,
                 st.session_state["message_counter"]
             )
+            entry.message_index = st.session_state["message_counter"]
             st.session_state["message_counter"] += 1
         except Exception as e:
             st.error(f"Error saving message: {e}")
 
-    # Display chat history
-    for message in st.session_state.chat_history:
+    # Messages added since render_history() last ran, i.e. this fragment's earlier turns
+    rendered = st.session_state.get("history_rendered", 0)
+    new_messages = len(st.session_state.chat_history) - rendered
+
+    # Keep only recent turns in memory, never fewer than are on screen; older
+    # ones are reloaded from the transcript when the student asks for them
+    if CHAT_HISTORY_IN_MEMORY:
+        keep = max(CHAT_HISTORY_IN_MEMORY, st.session_state.get("history_shown", CHAT_HISTORY_WINDOW) + new_messages)
+        if CONTEXT_MODE == "bounded":
+            # Messages not yet folded into the summary are still sent every turn
+            unsummarised = len(st.session_state.chat_history) - st.session_state["bounded_context"].summarised_upto
+            keep = max(keep, unsummarised)
+        try:
+            st.session_state.chat_history.spill(st.session_state["mongodb_uri"], get_session_key(), keep)
+        except Exception as e:
+            st.warning(f"Could not trim chat history: {e}")
+
+    for message in st.session_state.chat_history[rendered:]:
         with st.chat_message(message["role"]):
             st.markdown(message["content"])
 
@@ -360,169 +614,104 @@ c) Explain what would happen in the long run (LR) to the equilibrium price and i
         "Type your message to Rabbit here...",
         disabled=st.session_state.conversation_finished or st.session_state.response_counter >= MAXIMUM_RESPONSES
     ):
-        # Add user message to history
-        user_message = {"role": "user", "content": prompt}
-        st.session_state.chat_history.append(user_message)
+        with turn_trace() as trace:
+            # Add user message to history
+            user_message = {"role": "user", "content": prompt}
+            entry = st.session_state.chat_history.append(user_message)
         
-        # Save user message to database in real-time
-        try:
-            log_message(
-                st.session_state["mongodb_uri"],
-                "rabbit_study",
-                user_message,
-                st.session_state["message_counter"]
-            )
-            st.session_state["message_counter"] += 1
-        except Exception as e:
-            st.error(f"Error saving message: {e}")
-
-        # Display user message
-        with st.chat_message("user"):
-            st.markdown(prompt)
-
-        # Generate Rabbit's response
-        if st.session_state.response_counter < MAXIMUM_RESPONSES:
-            with st.chat_message("assistant"):
-                # Get or create conversation ID
-                conversation_id = create_or_get_conversation(client)
-                if not conversation_id:
-                    st.error("Failed to create conversation. Please try again.")
-                    return
-
-                # Get streaming response from OpenAI using Responses API
-                response = ""  # Initialize response variable
-
-                # Combine recent hints with current user input
-                recent_hints_text = "\n".join(st.session_state.recent_hints) if st.session_state.recent_hints else ""
-                combined_input = f"{recent_hints_text}\n\nUser: {prompt}".strip()
-
-                try:
-                    stream = client.responses.create(
-                        model=st.session_state["model"],
-                        conversation=conversation_id,  # Use conversation ID, not messages array
-                        input=combined_input,  # Pass combined input with recent hints
-                        instructions=st.session_state["current_prompt_content"],
-                        stream=True,
-                        max_output_tokens=250,
-                        reasoning={"effort": "minimal"}
-                    )
-
-                    # Handle streaming response
-                    response_container = st.empty()
-                    response_text = ""
-
-                    for chunk in stream:
-                        # Handle different chunk types from OpenAI Responses API
-                        if hasattr(chunk, 'type'):
-                            chunk_type = chunk.type
-
-                            # Handle text delta events
-                            if chunk_type == 'response.output_text.delta':
-                                if hasattr(chunk, 'delta') and chunk.delta:
-                                    response_text += chunk.delta
-                                    response_container.markdown(response_text)
-                        else:
-                            # Fallback for any other format
-                            if hasattr(chunk, 'content') and chunk.content:
-                                response_text += chunk.content
-                                response_container.markdown(response_text)
-
-                    response = response_text
-
-                except Exception as e:
-                    st.error(f"Error generating response: {e}")
-                    response = ""  # Ensure response is set even on error
-                    # Fallback to chat completions API
-                    messages = [
-                        {"role": "system", "content": st.session_state["current_prompt_content"]}
-                    ] + [
-                        {"role": m["role"], "content": m["content"]}
-                        for m in st.session_state.chat_history
-                    ]
-
-                    fallback_stream = client.chat.completions.create(
-                        model=st.session_state["model"],
-                        messages=messages,
-                        stream=True,
-                        max_tokens=250
-                    )
-
-                    response_container = st.empty()
-                    response_text = ""
-                    for chunk in fallback_stream:
-                        if chunk.choices[0].delta.content is not None:
-                            response_text += chunk.choices[0].delta.content
-                            response_container.markdown(response_text)
-
-                    response = response_text
-
-                except Exception as e:
-                    st.error(f"Error generating response: {e}")
-                    response = ""  # Ensure response is set even on error
-                    # Fallback to chat completions API
-                    messages = [
-                        {"role": "system", "content": st.session_state["current_prompt_content"]}
-                    ] + [
-                        {"role": m["role"], "content": m["content"]}
-                        for m in st.session_state.chat_history
-                    ]
-
-                    fallback_stream = client.chat.completions.create(
-                        model=st.session_state["model"],
-                        messages=messages,
-                        stream=True,
-                        max_tokens=250
-                    )
-
-                    response_container = st.empty()
-                    response_text = ""
-                    for chunk in fallback_stream:
-                        if chunk.choices[0].delta.content is not None:
-                            response_text += chunk.choices[0].delta.content
-                            response_container.markdown(response_text)
-
-                    response = response_text
-
-            # Update counters and history
-            st.session_state.response_counter += 1
-            assistant_message = {"role": "assistant", "content": response}
-            st.session_state.chat_history.append(assistant_message)
-            
-            # Save assistant message to database in real-time
+            # Save user message to database in real-time
             try:
-                log_message(
-                    st.session_state["mongodb_uri"],
-                    "rabbit_study",
-                    assistant_message,
-                    st.session_state["message_counter"]
-                )
+                with span("log_message.user"):
+                    enqueue_message(
+                        st.session_state["mongodb_uri"],
+                        "rabbit_study",
+                        user_message,
+                        st.session_state["message_counter"]
+                    )
+                entry.message_index = st.session_state["message_counter"]
                 st.session_state["message_counter"] += 1
             except Exception as e:
                 st.error(f"Error saving message: {e}")
+
+            # Display user message
+            with st.chat_message("user"):
+                st.markdown(prompt)
+
+            # Generate Rabbit's response
+            if st.session_state.response_counter < MAXIMUM_RESPONSES:
+                with st.chat_message("assistant"):
+                    # Get or create conversation ID; bounded mode does not use one
+                    conversation_id = None
+                    if CONTEXT_MODE != "bounded":
+                        conversation_id = create_or_get_conversation(client)
+                        if not conversation_id:
+                            trace.aborted = True
+                            st.error("Failed to create conversation. Please try again.")
+                            return
+
+                    # Combine recent hints with current user input
+                    recent_hints_text = "\n".join(st.session_state.recent_hints) if st.session_state.recent_hints else ""
+                    combined_input = f"{recent_hints_text}\n\nUser: {prompt}".strip()
+
+                    response, usage = generate_response(client, conversation_id, combined_input)
+
+                # Update counters and history
+                st.session_state.response_counter += 1
+                assistant_message = {"role": "assistant", "content": response}
+                entry = st.session_state.chat_history.append(assistant_message)
             
-            # Clear recent hints after each response to prevent accumulation
-            st.session_state.recent_hints = []
-        else:
-            # Maximum responses reached
-            with st.chat_message("assistant"):
-                st.markdown("Thanks for helping me study! I think I understand this topic much better now. 🐰")
+                # Save assistant message to database in real-time, with the turn's token usage
+                if not response:
+                    trace.aborted = True
+                if TRACE_TRANSCRIPTS:
+                    usage = dict(usage or {}, trace=trace.as_dict())
+                try:
+                    with span("log_message.assistant"):
+                        enqueue_message(
+                            st.session_state["mongodb_uri"],
+                            "rabbit_study",
+                            assistant_message,
+                            st.session_state["message_counter"],
+                            usage=usage
+                        )
+                    entry.message_index = st.session_state["message_counter"]
+                    st.session_state["message_counter"] += 1
+                except Exception as e:
+                    st.error(f"Error saving message: {e}")
             
-            final_message = {"role": "assistant", "content": "Thanks for helping me study! I think I understand this topic much better now. 🐰"}
-            st.session_state.chat_history.append(final_message)
+                # Clear recent hints after each response to prevent accumulation
+                st.session_state.recent_hints = []
+
+                # Fold older turns into the running summary in the background
+                if CONTEXT_MODE == "bounded":
+                    st.session_state["bounded_context"].schedule_summary(client, st.session_state.chat_history)
+            else:
+                # Maximum responses reached
+                with st.chat_message("assistant"):
+                    st.markdown("Thanks for helping me study! I think I understand this topic much better now. 🐰")
             
-            # Save final message to database in real-time
-            try:
-                log_message(
-                    st.session_state["mongodb_uri"],
-                    "rabbit_study",
-                    final_message,
-                    st.session_state["message_counter"]
-                )
-                st.session_state["message_counter"] += 1
-            except Exception as e:
-                st.error(f"Error saving message: {e}")
+                final_message = {"role": "assistant", "content": "Thanks for helping me study! I think I understand this topic much better now. 🐰"}
+                entry = st.session_state.chat_history.append(final_message)
             
-            st.session_state.conversation_finished = True
+                # Save final message to database in real-time
+                try:
+                    enqueue_message(
+                        st.session_state["mongodb_uri"],
+                        "rabbit_study",
+                        final_message,
+                        st.session_state["message_counter"]
+                    )
+                    entry.message_index = st.session_state["message_counter"]
+                    st.session_state["message_counter"] += 1
+                except Exception as e:
+                    st.error(f"Error saving message: {e}")
+            
+                st.session_state.conversation_finished = True
+
+        # Once a page of turns has built up here, hand them to render_history()
+        # with a full rerun, so each turn re-renders at most a page of messages
+        if len(st.session_state.chat_history) - rendered > CHAT_HISTORY_PAGE:
+            st.rerun()
 
     # Action buttons
     col1, col2, col3, col4 = st.columns([1, 1.5, 1.5, 1])
@@ -537,20 +726,49 @@ c) Explain what would happen in the long run (LR) to the equilibrium price and i
         if not st.session_state.conversation_finished and st.session_state.chat_history:
             if st.button("End Study Session", key="finish_chat", use_container_width=True, type="primary"):
                 st.session_state.conversation_finished = True
+                # Write any queued messages before marking the transcript complete
+                flushed = flush_transcripts(st.session_state["mongodb_uri"])
                 # Log the conversation
                 from utils.mongodb import log_transcript
-                session_id = log_transcript(
-                    st.session_state["mongodb_uri"],
-                    "rabbit_study",
-                    st.session_state.chat_history
-                )
-                st.session_state.session_id = session_id
-                st.success("Study session completed! Your conversation has been saved.")
-                st.rerun()
+                try:
+                    st.session_state["transcript_id"] = log_transcript(
+                        st.session_state["mongodb_uri"],
+                        "rabbit_study",
+                        st.session_state.chat_history,
+                        flushed=flushed
+                    )
+                except Exception as e:
+                    # The messages are safe in the journal; only the completion mark is missing
+                    st.error(f"Error marking the study session complete: {e}")
+                else:
+                    st.success("Study session completed! Your conversation has been saved.")
+                    st.rerun()
+
+    # Snapshot the session's progress so any replica can resume it
+    try:
+        with span("persist_session"):
+            persist_session(st.session_state["mongodb_uri"])
+    except Exception as e:
+        st.error(f"Error saving session state: {e}")
+
+def resume_session(identifier):
+    """Restore the saved session whose ID is in the URL if it belongs to this access code; returns True if restored"""
+    session_id = st.query_params.get("session")
+    if not session_id or session_id == st.session_state.get("session_id"):
+        return False
+    try:
+        if rehydrate_session(st.session_state["mongodb_uri"], session_id, identifier):
+            return True
+        del st.query_params["session"]
+    except Exception as e:
+        st.warning(f"Could not restore your previous session: {e}")
+    return False
 
 def main():
     # Check if user is logged in and should see chat
-    if st.session_state.get("show_chat", False) and is_identifier_valid():
+    with span("check_identifier"):
+        logged_in = st.session_state.get("show_chat", False) and is_identifier_valid()
+    if logged_in:
         chat_page()
     else:
         login_page()
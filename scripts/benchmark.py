@@ -0,0 +1,188 @@
+import os
+import sys
+import json
+import argparse
+import logging
+import tempfile
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+# Settings are read when the utils modules are imported, so point them at the
+# stand-ins before anything from utils is loaded
+os.environ.setdefault("TRANSCRIPT_JOURNAL_PATH", os.path.join(tempfile.mkdtemp(prefix="rabbit-bench-"), "journal.sqlite3"))
+os.environ.setdefault("OPENAI_HTTP2", "false")
+
+from scripts.fake_openai import FakeOpenAIConfig, FakeOpenAIServer
+from scripts.mongo_standin import MongoStandIn
+
+# Setup logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s'
+)
+logging.getLogger("httpx").setLevel(logging.WARNING)
+
+APP_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "Home.py"))
+MONGODB_URI = "mongodb://standin"
+ACCESS_CODE_PREFIX = "BENCH"
+
+def percentile(values, p):
+    """Nearest-rank percentile of a list of numbers (None for an empty list)"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, -(-len(ordered) * p // 100))
+    return ordered[int(rank) - 1]
+
+def summarise(rows, metrics):
+    """p50/p95/p99/max for each metric across rows"""
+    summary = {}
+    for metric in metrics:
+        values = [row[metric] for row in rows if row.get(metric) is not None]
+        summary[metric] = {
+            "n": len(values),
+            "p50": percentile(values, 50),
+            "p95": percentile(values, 95),
+            "p99": percentile(values, 99),
+            "max": max(values) if values else None,
+        }
+    return summary
+
+def start_environment(openai_config, mongo_latency=0.0, access_codes=1):
+    """Start the fake OpenAI server and Mongo stand-in and seed access codes; returns both"""
+    server = FakeOpenAIServer(openai_config).start()
+    os.environ["OPENAI_BASE_URL"] = server.base_url
+    standin = MongoStandIn(latency=mongo_latency).install()
+    standin.rabbitbot.valid_identifiers.insert_many([
+        {"identifier": f"{ACCESS_CODE_PREFIX}{i:05d}", "type": "rabbit_study"} for i in range(access_codes)
+    ])
+    return server, standin
+
+def new_app(timeout=60):
+    from streamlit.testing.v1 import AppTest
+
+    app = AppTest.from_file(APP_PATH, default_timeout=timeout)
+    app.secrets["MONGODB_CONNECTION_STRING"] = MONGODB_URI
+    app.secrets["OPENAI_API_KEY"] = "sk-benchmark"
+    return app
+
+def last_reply_usage(standin, session_key):
+    transcript = standin.rabbitbot.transcripts.find_one({"session_key": session_key}) or {}
+    for message in reversed(transcript.get("messages", [])):
+        if message.get("usage"):
+            return message["usage"]
+    return {}
+
+def run_session(standin, access_code, turns, timeout=60):
+    """Log in, start a session and send ``turns`` messages; returns one row per phase/turn"""
+    from utils.streaming import get_stream_stats
+    from utils.transcript_writer import flush_transcripts
+
+    rows = []
+    app = new_app(timeout)
+
+    started = time.perf_counter()
+    app.run()
+    app.text_input[0].input(access_code).run()
+    rows.append({"phase": "login", "wall_ms": (time.perf_counter() - started) * 1000})
+
+    trips = standin.counter.total
+    started = time.perf_counter()
+    app.button[0].click().run()
+    rows.append({"phase": "start", "wall_ms": (time.perf_counter() - started) * 1000,
+                 "mongo_round_trips": standin.counter.total - trips})
+    if app.exception:
+        raise RuntimeError(f"App raised: {app.exception[0].value}")
+
+    for turn in range(turns):
+        trips = standin.counter.total
+        renders = get_stream_stats()["renders_emitted"]
+        started = time.perf_counter()
+        app.chat_input[0].set_value(f"Benchmark message {turn}: the price falls by less than the tax cut").run()
+        input_ready_ms = (time.perf_counter() - started) * 1000
+        if app.exception:
+            raise RuntimeError(f"App raised: {app.exception[0].value}")
+        flush_transcripts(MONGODB_URI)
+        row = {
+            "phase": "turn",
+            "turn": turn,
+            "input_ready_ms": input_ready_ms,
+            "mongo_round_trips": standin.counter.total - trips,
+            "renders": get_stream_stats()["renders_emitted"] - renders,
+        }
+        usage = last_reply_usage(standin, app.session_state["session_key"])
+        row["ttft_ms"] = usage.get("ttft_ms")
+        row["cached_tokens"] = usage.get("cached_tokens")
+        rows.append(row)
+    return rows
+
+def print_summary(summary):
+    print(f"{'metric':20} {'n':>5} {'p50':>10} {'p95':>10} {'p99':>10} {'max':>10}")
+    for metric, stats in summary.items():
+        cells = [f"{stats[k]:>10.1f}" if stats[k] is not None else f"{'-':>10}" for k in ("p50", "p95", "p99", "max")]
+        print(f"{metric:20} {stats['n']:>5} {' '.join(cells)}")
+
+def check_budgets(summary, budgets):
+    """Names of the budgets whose p95 was exceeded"""
+    return [
+        f"{metric} p95 {summary[metric]['p95']:.1f} > {limit}"
+        for metric, limit in budgets.items()
+        if limit is not None and summary[metric]["p95"] is not None and summary[metric]["p95"] > limit
+    ]
+
+def benchmark(args):
+    """
+    1. Start the fake OpenAI API and the Mongo stand-in
+    2. Drive Home.py through AppTest: login, start, then N chat turns
+    3. Report time to first token, time until the input is ready again,
+       Mongo round trips and stream renders per turn
+    """
+    server, standin = start_environment(FakeOpenAIConfig(
+        first_token_latency=args.first_token_latency,
+        tokens_per_second=args.tokens_per_second,
+        reply_tokens=args.reply_tokens,
+    ), mongo_latency=args.mongo_latency_ms / 1000)
+    try:
+        rows = []
+        for session in range(args.sessions):
+            rows.extend(run_session(standin, f"{ACCESS_CODE_PREFIX}00000", args.turns))
+        turn_rows = [row for row in rows if row["phase"] == "turn"]
+        summary = summarise(turn_rows, ("ttft_ms", "input_ready_ms", "mongo_round_trips", "renders"))
+        summary["start_ms"] = summarise([r for r in rows if r["phase"] == "start"], ("wall_ms",))["wall_ms"]
+
+        print_summary(summary)
+        logging.info(f"OpenAI requests: {server.stats()}")
+        logging.info(f"Mongo round trips: {standin.counter.snapshot()}")
+        if args.json:
+            with open(args.json, "w") as file:
+                json.dump({"rows": rows, "summary": summary}, file, indent=2)
+            logging.info(f"Wrote {args.json}")
+
+        return check_budgets(summary, {
+            "ttft_ms": args.max_ttft_ms,
+            "input_ready_ms": args.max_input_ready_ms,
+            "mongo_round_trips": args.max_round_trips,
+            "renders": args.max_renders,
+        })
+    finally:
+        standin.uninstall()
+        server.stop()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="End-to-end latency benchmark for Home.py against local stand-ins")
+    parser.add_argument("--sessions", type=int, default=1)
+    parser.add_argument("--turns", type=int, default=10)
+    parser.add_argument("--first-token-latency", type=float, default=0.3, help="Fake API seconds to first delta")
+    parser.add_argument("--tokens-per-second", type=float, default=60.0)
+    parser.add_argument("--reply-tokens", type=int, default=60)
+    parser.add_argument("--mongo-latency-ms", type=float, default=2.0, help="Simulated round-trip time")
+    parser.add_argument("--json", help="Also write all measurements to this file")
+    parser.add_argument("--max-ttft-ms", type=float, help="Fail if p95 time to first token exceeds this")
+    parser.add_argument("--max-input-ready-ms", type=float, help="Fail if p95 time until the input is ready exceeds this")
+    parser.add_argument("--max-round-trips", type=float, help="Fail if p95 Mongo round trips per turn exceed this")
+    parser.add_argument("--max-renders", type=float, help="Fail if p95 stream renders per turn exceed this")
+    failures = benchmark(parser.parse_args())
+    for failure in failures:
+        logging.error(f"Budget exceeded: {failure}")
+    sys.exit(1 if failures else 0)
@@ -0,0 +1,53 @@
+import os
+import sys
+import json
+import logging
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from utils.assets import ASSET_MANIFEST, STATIC_DIR, build_figure_assets
+from utils.prompts import get_prompt_registry
+
+# Setup logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s'
+)
+
+def build_assets(output_dir=STATIC_DIR, manifest_path=ASSET_MANIFEST):
+    """
+    1. Encode every problem figure as content-hashed AVIF/WebP width variants
+    2. Write the manifest the app uses to find them
+    3. Remove built files that the new manifest no longer references
+    """
+    try:
+        registry = get_prompt_registry()
+        sources = sorted({registry.get_problem(p).figure for p in registry.problem_ids()} - {None})
+
+        manifest = {}
+        for source in sources:
+            entry = build_figure_assets(source, output_dir)
+            manifest[source] = entry
+            built = [v for variants in entry["variants"].values() for v in variants]
+            smallest = min((v["bytes"] for v in built), default=entry["bytes"])
+            logging.info(f"{source}: {len(built)} variants, {entry['bytes']} bytes -> {smallest} bytes smallest")
+
+        with open(manifest_path, "w") as file:
+            json.dump(manifest, file, indent=2, sort_keys=True)
+        logging.info(f"Wrote {manifest_path}")
+
+        referenced = {entry["fallback"] for entry in manifest.values()}
+        referenced |= {v["file"] for entry in manifest.values() for variants in entry["variants"].values() for v in variants}
+        figures_dir = os.path.join(output_dir, "figures")
+        for name in sorted(os.listdir(figures_dir)) if os.path.isdir(figures_dir) else []:
+            if f"figures/{name}" not in referenced:
+                os.remove(os.path.join(figures_dir, name))
+                logging.info(f"Removed stale asset figures/{name}")
+        return manifest
+
+    except Exception as e:
+        logging.error(f"Error building assets: {str(e)}")
+        raise
+
+if __name__ == "__main__":
+    build_assets()
@@ -0,0 +1,59 @@
+import os
+import sys
+import logging
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from utils.mongodb import set_mongo_client_options
+from utils.schema import ensure_indexes, explain_hot_queries
+
+# Setup logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s'
+)
+
+def bootstrap(connection_string):
+    """
+    1. Create any missing indexes on the rabbitbot collections
+    2. Report the explain() plan for each hot query
+    Returns False if any hot query still needs a collection scan.
+    """
+    try:
+        for index in ensure_indexes(connection_string):
+            logging.info(f"Index ready: {index}")
+
+        all_indexed = True
+        for entry in explain_hot_queries(connection_string):
+            status = "OK" if entry["uses_index"] and not entry["collection_scan"] else "COLLSCAN"
+            all_indexed = all_indexed and status == "OK"
+            logging.info(f"{status:8} {entry['collection']}.{entry['query']}: {' <- '.join(entry['stages'])}")
+        return all_indexed
+
+    except Exception as e:
+        logging.error(f"Error bootstrapping indexes: {str(e)}")
+        raise
+
+if __name__ == "__main__":
+    # Get MongoDB connection string from environment or secrets
+    connection_string = os.getenv("MONGODB_CONNECTION_STRING")
+    if not connection_string:
+        # Try to read from secrets.toml
+        try:
+            import toml
+            secrets = toml.load(".streamlit/secrets.toml")
+            connection_string = secrets.get("MONGODB_CONNECTION_STRING")
+        except:
+            pass
+
+    if not connection_string:
+        connection_string = input("Enter MongoDB connection string: ").strip()
+
+    if not connection_string:
+        raise ValueError("MongoDB connection string is required")
+
+    # Long-running operations: don't apply the app's per-operation socket timeout
+    set_mongo_client_options(socketTimeoutMS=None)
+
+    if not bootstrap(connection_string):
+        sys.exit(1)
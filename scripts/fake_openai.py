@@ -0,0 +1,247 @@
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import argparse
+import hashlib
+import json
+import random
+import threading
+import time
+import uuid
+
+REPLY_WORDS = (
+    "Hmm, so if the tax goes down by two dollars, does the price also drop by exactly two dollars "
+    "in the short run? I thought the supply curve shifts but the demand stays the same, right?"
+).split()
+
+
+@dataclass
+class FakeOpenAIConfig:
+    """Timing and behaviour of the fake API; every reply is deterministic for a given config"""
+    first_token_latency: float = 0.3   # seconds before the first delta
+    tokens_per_second: float = 60.0    # streaming rate after the first delta
+    reply_tokens: int = 60             # deltas per reply, one word each
+    rate_limit_rate: float = 0.0       # share of requests answered with a 429
+    retry_after: float = 1.0           # Retry-After sent with those 429s
+    seed: int = 0
+
+
+class FakeOpenAIServer:
+    """Local HTTP server speaking enough of the OpenAI API for Home.py.
+
+    Serves ``POST /v1/conversations``, ``/v1/responses`` and
+    ``/v1/chat/completions``, streaming server-sent events when ``stream`` is
+    set. Usage reports a cache hit for every request whose instructions were
+    seen before, like the real prompt cache.
+    """
+
+    def __init__(self, config=None, host="127.0.0.1", port=0):
+        self.config = config or FakeOpenAIConfig()
+        self._random = random.Random(self.config.seed)
+        self._lock = threading.Lock()
+        self._seen_prefixes = set()
+        self.requests = {}
+        self.connections = {"open": 0, "peak_open": 0, "opened": 0}
+        self._server = ThreadingHTTPServer((host, port), self._handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name="fake-openai", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def stats(self):
+        with self._lock:
+            return dict(self.requests)
+
+    def connection_stats(self):
+        """Client connections open now, the most ever open at once and the total opened"""
+        with self._lock:
+            return dict(self.connections)
+
+    def _connection_opened(self):
+        with self._lock:
+            self.connections["open"] += 1
+            self.connections["opened"] += 1
+            self.connections["peak_open"] = max(self.connections["peak_open"], self.connections["open"])
+
+    def _connection_closed(self):
+        with self._lock:
+            self.connections["open"] -= 1
+
+    def _count(self, endpoint):
+        with self._lock:
+            self.requests[endpoint] = self.requests.get(endpoint, 0) + 1
+            return self._random.random() < self.config.rate_limit_rate
+
+    def _usage(self, body, prefix):
+        input_tokens = len(json.dumps(body)) // 4
+        key = hashlib.sha256(prefix.encode("utf-8")).hexdigest()
+        with self._lock:
+            hit = key in self._seen_prefixes
+            self._seen_prefixes.add(key)
+        # Cached prefixes are counted in 128-token blocks
+        cached = (len(prefix) // 4) // 128 * 128 if hit else 0
+        return input_tokens, min(cached, input_tokens), self.config.reply_tokens
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def setup(self):
+                super().setup()
+                server._connection_opened()
+
+            def finish(self):
+                try:
+                    super().finish()
+                finally:
+                    server._connection_closed()
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                endpoint = self.path.split("?")[0].removeprefix("/v1")
+                if server._count(endpoint):
+                    return self._json(429, {"error": {"message": "Rate limit reached (fake)", "type": "requests",
+                                                      "code": "rate_limit_exceeded"}},
+                                      {"retry-after": str(server.config.retry_after)})
+                if endpoint == "/conversations":
+                    return self._json(200, {"id": f"conv_{uuid.uuid4().hex}", "object": "conversation",
+                                            "created_at": int(time.time()), "metadata": body.get("metadata", {})})
+                if endpoint == "/responses":
+                    return self._responses(body)
+                if endpoint == "/chat/completions":
+                    return self._chat_completions(body)
+                self._json(404, {"error": {"message": f"Unknown endpoint {endpoint}", "type": "invalid_request_error"}})
+
+            def _json(self, status, payload, headers=None):
+                data = json.dumps(payload).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _start_stream(self):
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+
+            def _send_event(self, data, event=None):
+                text = (f"event: {event}\n" if event else "") + f"data: {data}\n\n"
+                chunk = text.encode("utf-8")
+                self.wfile.write(f"{len(chunk):x}\r\n".encode() + chunk + b"\r\n")
+                self.wfile.flush()
+
+            def _end_stream(self):
+                self.wfile.write(b"0\r\n\r\n")
+                self.wfile.flush()
+
+            def _words(self):
+                config = server.config
+                time.sleep(config.first_token_latency)
+                for i in range(config.reply_tokens):
+                    if i and config.tokens_per_second:
+                        time.sleep(1 / config.tokens_per_second)
+                    yield REPLY_WORDS[i % len(REPLY_WORDS)] + " "
+
+            def _responses(self, body):
+                response_id = f"resp_{uuid.uuid4().hex}"
+                input_tokens, cached, output_tokens = server._usage(body, body.get("instructions") or "")
+                usage = {"input_tokens": input_tokens, "input_tokens_details": {"cached_tokens": cached},
+                         "output_tokens": output_tokens, "output_tokens_details": {"reasoning_tokens": 0},
+                         "total_tokens": input_tokens + output_tokens}
+                response = {"id": response_id, "object": "response", "created_at": int(time.time()),
+                            "model": body.get("model"), "status": "completed", "output": [], "usage": None,
+                            "parallel_tool_calls": False, "tool_choice": "auto", "tools": []}
+
+                def completed(text):
+                    return dict(response, usage=usage, output=[{
+                        "type": "message", "id": "msg_fake", "role": "assistant", "status": "completed",
+                        "content": [{"type": "output_text", "text": text, "annotations": []}]
+                    }])
+
+                if not body.get("stream"):
+                    return self._json(200, completed("".join(self._words()).strip()))
+
+                self._start_stream()
+                sequence = 0
+                self._send_event(json.dumps({"type": "response.created", "sequence_number": sequence,
+                                             "response": dict(response, status="in_progress")}), "response.created")
+                parts = []
+                for word in self._words():
+                    sequence += 1
+                    parts.append(word)
+                    self._send_event(json.dumps({"type": "response.output_text.delta", "sequence_number": sequence,
+                                                 "item_id": "msg_fake", "output_index": 0, "content_index": 0,
+                                                 "delta": word, "logprobs": []}), "response.output_text.delta")
+                self._send_event(json.dumps({"type": "response.completed", "sequence_number": sequence + 1,
+                                             "response": completed("".join(parts))}), "response.completed")
+                self._end_stream()
+
+            def _chat_completions(self, body):
+                messages = body.get("messages") or [{}]
+                system = messages[0].get("content", "") if messages[0].get("role") == "system" else ""
+                input_tokens, cached, output_tokens = server._usage(body, system)
+                usage = {"prompt_tokens": input_tokens, "completion_tokens": output_tokens,
+                         "total_tokens": input_tokens + output_tokens,
+                         "prompt_tokens_details": {"cached_tokens": cached},
+                         "completion_tokens_details": {"reasoning_tokens": 0}}
+                base = {"id": f"chatcmpl-{uuid.uuid4().hex}", "created": int(time.time()), "model": body.get("model")}
+
+                if not body.get("stream"):
+                    text = "".join(self._words()).strip()
+                    return self._json(200, dict(base, object="chat.completion", usage=usage, choices=[
+                        {"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": text}}
+                    ]))
+
+                self._start_stream()
+                for word in self._words():
+                    self._send_event(json.dumps(dict(base, object="chat.completion.chunk", choices=[
+                        {"index": 0, "finish_reason": None, "delta": {"role": "assistant", "content": word}}
+                    ])))
+                if (body.get("stream_options") or {}).get("include_usage"):
+                    self._send_event(json.dumps(dict(base, object="chat.completion.chunk", choices=[], usage=usage)))
+                self._send_event("[DONE]")
+                self._end_stream()
+
+        return Handler
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a local fake OpenAI API for benchmarks")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--first-token-latency", type=float, default=0.3)
+    parser.add_argument("--tokens-per-second", type=float, default=60.0)
+    parser.add_argument("--reply-tokens", type=int, default=60)
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0)
+    args = parser.parse_args()
+
+    server = FakeOpenAIServer(FakeOpenAIConfig(
+        first_token_latency=args.first_token_latency,
+        tokens_per_second=args.tokens_per_second,
+        reply_tokens=args.reply_tokens,
+        rate_limit_rate=args.rate_limit_rate,
+    ), port=args.port)
+    print(f"Fake OpenAI API listening on {server.base_url} (set OPENAI_BASE_URL to this)")
+    try:
+        server._server.serve_forever()
+    except KeyboardInterrupt:
+        server.stop()
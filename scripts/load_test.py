@@ -0,0 +1,285 @@
+import os
+import sys
+import json
+import argparse
+import logging
+import resource
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from scripts.benchmark import (
+    ACCESS_CODE_PREFIX,
+    APP_PATH,
+    MONGODB_URI,
+    print_summary,
+    start_environment,
+    summarise,
+)
+from scripts.fake_openai import FakeOpenAIConfig
+from utils.message_store import session_memory_report
+
+# Setup logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s'
+)
+
+PHASES = ("login", "start", "turn", "end")
+
+
+def current_rss_mb():
+    """Resident memory of this process in MB, or None where /proc is not available"""
+    try:
+        with open("/proc/self/statm") as file:
+            pages = int(file.read().split()[1])
+        return pages * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except (OSError, ValueError, IndexError):
+        return None
+
+def peak_rss_mb():
+    # ru_maxrss is in KB on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+class ResourceSampler:
+    """Samples RSS, active students and OpenAI admission state in the background"""
+
+    def __init__(self, interval=0.5):
+        self.interval = interval
+        self.samples = []
+        self.active = 0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="load-test-sampler", daemon=True)
+
+    def student_started(self):
+        with self._lock:
+            self.active += 1
+
+    def student_finished(self):
+        with self._lock:
+            self.active -= 1
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        self._sample()
+
+    def _sample(self):
+        from utils.rate_limit import get_admission_controller
+
+        admission = get_admission_controller().snapshot()
+        with self._lock:
+            active = self.active
+        self.samples.append({
+            "t": time.perf_counter(),
+            "rss_mb": current_rss_mb(),
+            "active_students": active,
+            "openai_in_flight": admission["in_flight"],
+            "openai_waiting": admission["waiting"],
+            "threads": threading.active_count(),
+        })
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self._sample()
+
+    def peak(self, key):
+        values = [sample[key] for sample in self.samples if sample[key] is not None]
+        return max(values) if values else None
+
+
+def share_app_test_runtime():
+    """Let many AppTests run at once in this process.
+
+    Each AppTest run installs its own mock Runtime and secrets and removes
+    them when it finishes, which breaks every other run still in progress.
+    Keep one runtime, one set of secrets, one compiled-script cache and the
+    app-test config in place for the whole load test instead, like the single
+    server process they stand in for.
+    """
+    from unittest.mock import MagicMock
+
+    import streamlit as st
+    from streamlit import config
+    from streamlit.runtime import Runtime
+    from streamlit.runtime.caching.storage.dummy_cache_storage import MemoryCacheStorageManager
+    from streamlit.runtime.media_file_manager import MediaFileManager
+    from streamlit.runtime.memory_media_file_storage import MemoryMediaFileStorage
+    from streamlit.runtime.scriptrunner.script_cache import ScriptCache
+    from streamlit.runtime.secrets import Secrets
+    from streamlit.testing.v1 import app_test, local_script_runner
+
+    runtime = MagicMock(spec=Runtime)
+    runtime.media_file_mgr = MediaFileManager(MemoryMediaFileStorage("/mock/media"))
+    runtime.cache_storage_manager = MemoryCacheStorageManager()
+    Runtime.instance = classmethod(lambda cls: cls._instance or runtime)
+    Runtime.exists = classmethod(lambda cls: True)
+    # Compile Home.py once up front; concurrent compiles can fail on Python 3.11
+    script_cache = ScriptCache()
+    script_cache.get_bytecode(APP_PATH)
+    app_test.ScriptCache = local_script_runner.ScriptCache = lambda: script_cache
+
+    secrets = Secrets()
+    secrets._secrets = {"MONGODB_CONNECTION_STRING": MONGODB_URI, "OPENAI_API_KEY": "sk-load-test"}
+    st.secrets = secrets
+    config.set_option("global.appTest", True)
+
+def new_student_app(timeout):
+    from streamlit.testing.v1 import AppTest
+
+    # No per-test secrets: those are swapped in and out around every run
+    return AppTest.from_file(APP_PATH, default_timeout=timeout)
+
+def timed(rows, student, phase, action, **extra):
+    started = time.perf_counter()
+    app = action()
+    rows.append({"student": student, "phase": phase, "wall_ms": (time.perf_counter() - started) * 1000, **extra})
+    if app.exception:
+        raise RuntimeError(f"{phase}: {app.exception[0].value}")
+    return app
+
+def simulate_student(student, access_code, turns, think_time, sampler, timeout):
+    """One student: login, Start Study Session, ``turns`` messages, End Study Session"""
+    rows = []
+    sampler.student_started()
+    try:
+        app = new_student_app(timeout)
+
+        def login():
+            app.run()
+            return app.text_input[0].input(access_code).run()
+
+        timed(rows, student, "login", login)
+        timed(rows, student, "start", lambda: app.button[0].click().run())
+        for turn in range(turns):
+            if think_time:
+                time.sleep(think_time)
+            message = f"Student {student}, message {turn}: the price falls by less than the tax cut"
+            timed(rows, student, "turn", lambda: app.chat_input[0].set_value(message).run(), turn=turn)
+        timed(rows, student, "end", lambda: app.button(key="finish_chat").click().run())
+        if not app.session_state["conversation_finished"]:
+            raise RuntimeError("end: session was not marked finished")
+        memory = session_memory_report(app.session_state)
+        rows.append({"student": student, "phase": "memory", "session_bytes": memory["total"],
+                     "chat_history_bytes": memory.get("chat_history", 0)})
+        return rows, None
+    except Exception as e:
+        return rows, f"{type(e).__name__}: {e}"
+    finally:
+        sampler.student_finished()
+
+def load_test(args):
+    """
+    1. Start the fake OpenAI API and the Mongo stand-in with one access code per student
+    2. Start ``concurrency`` simulated students at a time, spread over the ramp-up
+    3. Report throughput, per-phase latency percentiles, connections and memory
+    """
+    server, standin = start_environment(FakeOpenAIConfig(
+        first_token_latency=args.first_token_latency,
+        tokens_per_second=args.tokens_per_second,
+        reply_tokens=args.reply_tokens,
+        rate_limit_rate=args.rate_limit_rate,
+    ), mongo_latency=args.mongo_latency_ms / 1000, access_codes=args.students)
+    from utils.openai_client import get_connection_stats
+    from utils.rate_limit import get_admission_controller
+    from utils.transcript_writer import flush_transcripts
+
+    share_app_test_runtime()
+    baseline_rss = current_rss_mb()
+    sampler = ResourceSampler().start()
+    rows, errors = [], []
+    started = time.perf_counter()
+    try:
+        concurrency = args.concurrency or args.students
+        stagger = args.ramp_up / args.students if args.students else 0
+        with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="student") as pool:
+            futures = []
+            for student in range(args.students):
+                futures.append(pool.submit(
+                    simulate_student, student, f"{ACCESS_CODE_PREFIX}{student:05d}",
+                    args.turns, args.think_time, sampler, args.timeout
+                ))
+                if stagger:
+                    time.sleep(stagger)
+            for future in as_completed(futures):
+                student_rows, error = future.result()
+                rows.extend(student_rows)
+                if error:
+                    errors.append(error)
+        elapsed = time.perf_counter() - started
+        flush_transcripts(MONGODB_URI)
+    finally:
+        sampler.stop()
+
+    try:
+        summary = {}
+        for phase in PHASES:
+            summary[f"{phase}_ms"] = summarise([r for r in rows if r["phase"] == phase], ("wall_ms",))["wall_ms"]
+        summary.update(summarise([r for r in rows if r["phase"] == "memory"], ("session_bytes", "chat_history_bytes")))
+        turns = sum(1 for row in rows if row["phase"] == "turn")
+        completed = sum(1 for row in rows if row["phase"] == "end")
+        report = {
+            "students": args.students,
+            "concurrency": args.concurrency or args.students,
+            "completed_sessions": completed,
+            "errors": len(errors),
+            "elapsed_s": elapsed,
+            "turns_per_second": turns / elapsed if elapsed else 0.0,
+            "sessions_per_minute": completed * 60 / elapsed if elapsed else 0.0,
+            "peak_active_students": sampler.peak("active_students"),
+            "peak_threads": sampler.peak("threads"),
+            "openai_peak_in_flight": sampler.peak("openai_in_flight"),
+            "openai_peak_waiting": sampler.peak("openai_waiting"),
+            "openai_admission": get_admission_controller().snapshot(),
+            "openai_client": get_connection_stats(),
+            "openai_server_connections": server.connection_stats(),
+            "openai_requests": server.stats(),
+            "mongo_round_trips": standin.counter.total,
+            "mongo_peak_concurrent_operations": standin.counter.peak_in_flight,
+            "rss_baseline_mb": baseline_rss,
+            "rss_peak_mb": max(filter(None, (sampler.peak("rss_mb"), peak_rss_mb()))),
+        }
+        peak_active = report["peak_active_students"] or 0
+        if baseline_rss is not None and peak_active:
+            report["rss_per_active_student_mb"] = (report["rss_peak_mb"] - baseline_rss) / peak_active
+
+        print_summary(summary)
+        for key, value in report.items():
+            print(f"{key:34} {value:.2f}" if isinstance(value, float) else f"{key:34} {value}")
+        for error in errors[:10]:
+            logging.error(f"Student failed: {error}")
+        if args.json:
+            with open(args.json, "w") as file:
+                json.dump({"rows": rows, "summary": summary, "report": report,
+                           "samples": sampler.samples, "errors": errors}, file, indent=2, default=str)
+            logging.info(f"Wrote {args.json}")
+        return errors
+    finally:
+        standin.uninstall()
+        server.stop()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Simulate a tutorial cohort logging in and chatting at once")
+    parser.add_argument("--students", type=int, default=100, help="Simulated students, one access code each")
+    parser.add_argument("--concurrency", type=int, help="Students active at once (default: all of them)")
+    parser.add_argument("--ramp-up", type=float, default=60.0, help="Seconds over which students arrive")
+    parser.add_argument("--turns", type=int, default=5, help="Chat messages per student")
+    parser.add_argument("--think-time", type=float, default=2.0, help="Seconds a student waits before each message")
+    parser.add_argument("--timeout", type=float, default=120.0, help="Seconds allowed for one page run")
+    parser.add_argument("--first-token-latency", type=float, default=0.5, help="Fake API seconds to first delta")
+    parser.add_argument("--tokens-per-second", type=float, default=60.0)
+    parser.add_argument("--reply-tokens", type=int, default=60)
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="Share of fake API requests answered with a 429")
+    parser.add_argument("--mongo-latency-ms", type=float, default=2.0, help="Simulated round-trip time")
+    parser.add_argument("--json", help="Also write all measurements and resource samples to this file")
+    errors = load_test(parser.parse_args())
+    sys.exit(1 if errors else 0)
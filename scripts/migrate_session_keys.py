@@ -0,0 +1,111 @@
+import os
+import sys
+import logging
+from pymongo import UpdateOne
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from utils.mongodb import get_mongo_client, set_mongo_client_options
+
+# Setup logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s'
+)
+
+# OpenAI conversation IDs all carry this prefix
+CONVERSATION_ID_PREFIX = "conv_"
+
+def plan_migration(document):
+    """
+    Work out the fields a legacy transcript needs so that, like new ones,
+    session_key == f"{identifier}_{session_id}" and the OpenAI conversation
+    ID lives in its own attribute. Returns None if nothing needs changing.
+    """
+    session_key = document.get("session_key", "")
+    identifier = document.get("identifier", "anonymous")
+    prefix = f"{identifier}_"
+    if document.get("session_id") or not session_key.startswith(prefix):
+        return None
+
+    suffix = session_key[len(prefix):]
+    update = {"session_id": suffix}
+    if suffix.startswith(CONVERSATION_ID_PREFIX) and not document.get("openai_conversation_id"):
+        update["openai_conversation_id"] = suffix
+    return update
+
+def migrate_collection(collection, dry_run=True, batch_size=500):
+    """Backfill session_id / openai_conversation_id on every legacy document in a collection."""
+    operations = []
+    migrated = 0
+    unlinked = 0
+    cursor = collection.find(
+        {"session_id": {"$exists": False}},
+        {"session_key": 1, "identifier": 1, "openai_conversation_id": 1}
+    )
+    for document in cursor:
+        update = plan_migration(document)
+        if update is None:
+            continue
+        if "openai_conversation_id" not in update and not document.get("openai_conversation_id"):
+            # Logged before the conversation existed and never merged by the old rename path
+            unlinked += 1
+        operations.append(UpdateOne({"_id": document["_id"]}, {"$set": update}))
+        if len(operations) >= batch_size:
+            if not dry_run:
+                collection.bulk_write(operations, ordered=False)
+            migrated += len(operations)
+            operations = []
+
+    if operations:
+        if not dry_run:
+            collection.bulk_write(operations, ordered=False)
+        migrated += len(operations)
+    return migrated, unlinked
+
+def migrate_session_keys(connection_string, dry_run=True):
+    """Migrate transcripts (and bucketed session headers) to the stable session key scheme."""
+    try:
+        client = get_mongo_client(connection_string)
+        db = client.rabbitbot
+
+        for name in ("transcripts", "sessions"):
+            if name not in db.list_collection_names():
+                continue
+            migrated, unlinked = migrate_collection(db[name], dry_run)
+            action = "Would migrate" if dry_run else "Migrated"
+            logging.info(f"{action} {migrated} documents in {name}")
+            if unlinked:
+                logging.warning(
+                    f"{unlinked} documents in {name} have no OpenAI conversation ID; "
+                    "they were logged before one existed and are kept as separate sessions"
+                )
+
+    except Exception as e:
+        logging.error(f"Error migrating session keys: {str(e)}")
+        raise
+
+if __name__ == "__main__":
+    # Get MongoDB connection string from environment or secrets
+    connection_string = os.getenv("MONGODB_CONNECTION_STRING")
+    if not connection_string:
+        # Try to read from secrets.toml
+        try:
+            import toml
+            secrets = toml.load(".streamlit/secrets.toml")
+            connection_string = secrets.get("MONGODB_CONNECTION_STRING")
+        except:
+            pass
+
+    if not connection_string:
+        connection_string = input("Enter MongoDB connection string: ").strip()
+
+    if not connection_string:
+        raise ValueError("MongoDB connection string is required")
+
+    # Long-running operations: don't apply the app's per-operation socket timeout
+    set_mongo_client_options(socketTimeoutMS=None)
+
+    migrate_session_keys(connection_string, dry_run=True)
+    if input("Apply these changes? (y/n): ").lower() == 'y':
+        migrate_session_keys(connection_string, dry_run=False)
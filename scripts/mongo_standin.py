@@ -0,0 +1,147 @@
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from utils.mongodb import set_mongo_client_factory
+
+# Collection methods that cost one round trip to a real server
+ROUND_TRIP_METHODS = {
+    "find_one", "find", "find_one_and_update", "update_one", "update_many", "insert_one", "insert_many",
+    "delete_one", "delete_many", "replace_one", "bulk_write", "aggregate", "count_documents", "distinct",
+    "create_index", "index_information",
+}
+
+# mongomock is not thread-safe; operations run one at a time once their
+# simulated latency has passed
+_store_lock = threading.RLock()
+
+
+class RoundTripCounter:
+    """Thread-safe count of simulated round trips, in total and per collection.method"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.total = 0
+        self.by_operation = {}
+        # Operations running at once; a real client needs this many pooled connections
+        self.in_flight = 0
+        self.peak_in_flight = 0
+
+    def record(self, operation):
+        with self._lock:
+            self.total += 1
+            self.by_operation[operation] = self.by_operation.get(operation, 0) + 1
+
+    def started(self):
+        with self._lock:
+            self.in_flight += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+
+    def finished(self):
+        with self._lock:
+            self.in_flight -= 1
+
+    def snapshot(self):
+        with self._lock:
+            return {"total": self.total, **self.by_operation}
+
+
+class CountingCollection:
+    """mongomock collection that counts round trips and adds a fixed latency to each one"""
+
+    def __init__(self, collection, counter, latency):
+        self._collection = collection
+        self._counter = counter
+        self._latency = latency
+
+    def __getattr__(self, name):
+        attribute = getattr(self._collection, name)
+        if name not in ROUND_TRIP_METHODS or not callable(attribute):
+            return attribute
+
+        def call(*args, **kwargs):
+            self._counter.record(f"{self._collection.name}.{name}")
+            self._counter.started()
+            try:
+                if self._latency:
+                    time.sleep(self._latency)
+                with _store_lock:
+                    return attribute(*args, **kwargs)
+            finally:
+                self._counter.finished()
+
+        return call
+
+    def bulk_write(self, requests, ordered=True, **kwargs):
+        # One round trip for the whole batch, like the real driver
+        self._counter.record(f"{self._collection.name}.bulk_write")
+        self._counter.started()
+        try:
+            if self._latency:
+                time.sleep(self._latency)
+            with _store_lock:
+                for request in requests:
+                    self._collection.update_one(request._filter, request._doc, upsert=request._upsert)
+        finally:
+            self._counter.finished()
+
+
+class CountingDatabase:
+    def __init__(self, database, counter, latency):
+        self._database = database
+        self._counter = counter
+        self._latency = latency
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return self[name]
+
+    def __getitem__(self, name):
+        return CountingCollection(self._database[name], self._counter, self._latency)
+
+
+class MongoStandIn:
+    """In-process stand-in for a MongoDB deployment, built on mongomock.
+
+    Every client the app creates shares one in-memory database, so all
+    Streamlit sessions in the process see the same data. ``latency`` adds
+    a simulated network round trip, in seconds, to every operation.
+    """
+
+    def __init__(self, latency=0.0):
+        import mongomock
+
+        self.latency = latency
+        self.counter = RoundTripCounter()
+        self._client = mongomock.MongoClient()
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return self[name]
+
+    def __getitem__(self, name):
+        return CountingDatabase(self._client[name], self.counter, self.latency)
+
+    def close(self):
+        pass
+
+    def install(self):
+        """Make utils.mongodb hand out this stand-in instead of real clients"""
+        set_mongo_client_factory(lambda connection_string, **options: self)
+        return self
+
+    def uninstall(self):
+        set_mongo_client_factory(None)
+
+
+if __name__ == "__main__":
+    standin = MongoStandIn().install()
+    from utils.mongodb import append_message, load_transcript
+    append_message("mongodb://standin", "demo_session", {"role": "user", "content": "hello"}, 0)
+    print(load_transcript("mongodb://standin", "demo_session"))
+    print(standin.counter.snapshot())
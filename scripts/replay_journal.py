@@ -0,0 +1,59 @@
+import os
+import sys
+import logging
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from utils.journal import JOURNAL_PATH, TranscriptJournal, drain_journal
+
+# Setup logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s'
+)
+
+def replay_journal(journal_path, connection_string, purge=False):
+    """
+    Replay all pending transcript events from a local journal into MongoDB.
+    Replays are idempotent, so running this while the app is up is safe.
+    """
+    if not os.path.exists(journal_path):
+        raise FileNotFoundError(f"Journal not found: {journal_path}")
+
+    journal = TranscriptJournal(journal_path)
+    try:
+        logging.info(f"{journal.backlog()} events pending in {journal_path}")
+        replayed = drain_journal(connection_string, journal)
+        logging.info(f"Replayed {replayed} events into the transcripts collection")
+
+        if purge:
+            removed = journal.purge_replayed()
+            logging.info(f"Purged {removed} replayed events from the journal")
+    except Exception as e:
+        logging.error(f"Error replaying journal: {str(e)}")
+        raise
+    finally:
+        journal.close()
+
+if __name__ == "__main__":
+    # Get MongoDB connection string from environment or secrets
+    connection_string = os.getenv("MONGODB_CONNECTION_STRING")
+    if not connection_string:
+        # Try to read from secrets.toml
+        try:
+            import toml
+            secrets = toml.load(".streamlit/secrets.toml")
+            connection_string = secrets.get("MONGODB_CONNECTION_STRING")
+        except:
+            pass
+
+    if not connection_string:
+        connection_string = input("Enter MongoDB connection string: ").strip()
+
+    if not connection_string:
+        raise ValueError("MongoDB connection string is required")
+
+    journal_path = input(f"Enter path to journal file [{JOURNAL_PATH}]: ").strip() or JOURNAL_PATH
+    purge = input("Purge replayed events afterwards? (y/n): ").lower() == 'y'
+
+    replay_journal(journal_path, connection_string, purge)
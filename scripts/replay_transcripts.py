@@ -0,0 +1,344 @@
+import os
+import sys
+import csv
+import json
+import argparse
+import hashlib
+import logging
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from itertools import islice
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from utils.mongodb import TRANSCRIPT_LAYOUT, get_mongo_client, load_transcript
+from utils.openai_client import get_openai_client
+from utils.prompts import DEFAULT_PROBLEM_ID, get_prompt_registry
+from utils.rate_limit import limited_call
+from utils.usage import TOKEN_FIELDS, cache_hit_rate, estimate_cost, from_responses_usage, prompt_cache_key
+
+# Setup logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s'
+)
+logging.getLogger("httpx").setLevel(logging.WARNING)
+
+DEFAULT_CACHE_PATH = os.path.join(".replay", "cache.sqlite3")
+# Same output limit as Rabbit's live replies in Home.py
+MAX_OUTPUT_TOKENS = 250
+# Session keys fetched per query while streaming transcripts
+KEY_PAGE_SIZE = 200
+
+
+class ReplayCache:
+    """Replies already generated, keyed by (prompt hash, history hash), in a local SQLite file"""
+
+    def __init__(self, path=DEFAULT_CACHE_PATH):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS replies ("
+            " prompt_hash TEXT NOT NULL, history_hash TEXT NOT NULL, reply TEXT NOT NULL,"
+            " usage TEXT NOT NULL, created_at REAL NOT NULL, PRIMARY KEY (prompt_hash, history_hash))"
+        )
+
+    def get(self, prompt_hash, history_hash):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT reply, usage FROM replies WHERE prompt_hash = ? AND history_hash = ?",
+                (prompt_hash, history_hash)
+            ).fetchone()
+        return (row[0], json.loads(row[1])) if row else None
+
+    def put(self, prompt_hash, history_hash, reply, usage):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO replies VALUES (?, ?, ?, ?, ?)",
+                (prompt_hash, history_hash, reply, json.dumps(usage), time.time())
+            )
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def history_hash(model, messages):
+    """Stable hash of everything besides the instructions that shapes a reply"""
+    payload = json.dumps({"model": model, "max_output_tokens": MAX_OUTPUT_TOKENS, "messages": messages},
+                         sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+def iter_transcripts(connection_string, prompt_version=None, session_keys=None, limit=0):
+    """Stored rabbit_study transcripts, in either layout, optionally filtered by prompt version or key"""
+    query = {"conversation_type": "rabbit_study"}
+    if prompt_version:
+        query["prompt_version"] = prompt_version
+    if session_keys:
+        query["session_key"] = {"$in": list(session_keys)}
+    db = get_mongo_client(connection_string).rabbitbot
+    collection = db.sessions if TRANSCRIPT_LAYOUT == "bucketed" else db.transcripts
+    # Page through session keys instead of holding one cursor open while a
+    # chunk is replayed, which can take longer than the server keeps idle
+    # cursors; transcripts are still loaded one at a time
+    last_key, remaining = None, limit
+    while True:
+        page_size = min(KEY_PAGE_SIZE, remaining) if limit else KEY_PAGE_SIZE
+        page_query = dict(query)
+        if last_key is not None:
+            page_query["session_key"] = {**query.get("session_key", {}), "$gt": last_key}
+        keys = [document["session_key"] for document in
+                collection.find(page_query, {"session_key": 1, "_id": 0}).sort("session_key", 1).limit(page_size)]
+        for session_key in keys:
+            transcript = load_transcript(connection_string, session_key)
+            if transcript:
+                yield transcript
+        if limit:
+            remaining -= len(keys)
+            if remaining <= 0:
+                return
+        if len(keys) < page_size:
+            return
+        last_key = keys[-1]
+
+def student_turns(transcript, max_history=0):
+    """One item per student message: the messages up to and including it, and the reply it got"""
+    stored = sorted(transcript.get("messages", []), key=lambda m: m.get("message_index") or 0)
+    messages = [{"role": m["message"]["role"], "content": m["message"]["content"]} for m in stored]
+    turn = 0
+    for position, message in enumerate(messages):
+        if message["role"] != "user":
+            continue
+        following = messages[position + 1] if position + 1 < len(messages) else None
+        history = messages[:position + 1]
+        yield {
+            "session_key": transcript.get("session_key"),
+            "source_version": transcript.get("prompt_version"),
+            "turn": turn,
+            "student": message["content"],
+            "original": following["content"] if following and following["role"] == "assistant" else None,
+            # The replayed request starts from the original conversation, so every turn is independent
+            "messages": history[-max_history:] if max_history else history,
+        }
+        turn += 1
+
+def replay_turn(client, cache, instructions, model, turn, key, refresh=False):
+    """Rabbit's reply to one student turn under ``instructions``, from the cache when possible"""
+    if not refresh:
+        cached = cache.get(instructions.sha256, key)
+        if cached is not None:
+            reply, usage = cached
+            return reply, usage, True
+
+    started = time.perf_counter()
+    tokens = sum(len(m["content"]) // 4 + 4 for m in turn["messages"]) + len(instructions.text) // 4 + MAX_OUTPUT_TOKENS
+    # Replays share the admission controller, so 429s pause every worker at once
+    response = limited_call(f"replay:{instructions.version}", tokens, lambda: client.with_options(max_retries=0).responses.create(
+        model=model,
+        instructions=instructions.text,
+        prompt_cache_key=prompt_cache_key(instructions),
+        input=turn["messages"],
+        max_output_tokens=MAX_OUTPUT_TOKENS,
+        reasoning={"effort": "minimal"},
+        store=False
+    ))
+    usage = from_responses_usage(response.usage) or {}
+    usage["latency_ms"] = round((time.perf_counter() - started) * 1000, 1)
+    reply = response.output_text.strip()
+    cache.put(instructions.sha256, key, reply, usage)
+    return reply, usage, False
+
+def percentile(values, p):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[max(1, -(-len(ordered) * p // 100)) - 1]
+
+def print_stats(stats):
+    print(f"{'prompt_version':16} {'turns':>6} {'cached':>6} {'errors':>6} {'p50 ms':>8} {'p95 ms':>8} "
+          f"{'input':>10} {'hit rate':>8} {'output':>9} {'cost $':>9}")
+    for version, totals in stats.items():
+        latencies = totals["latencies"]
+        p50, p95 = percentile(latencies, 50), percentile(latencies, 95)
+        print(f"{version:16} {totals['turns']:>6} {totals['cache_hits']:>6} {totals['errors']:>6} "
+              f"{p50 or 0:>8.0f} {p95 or 0:>8.0f} {totals['input_tokens']:>10} {cache_hit_rate(totals):>8.1%} "
+              f"{totals['output_tokens']:>9} {estimate_cost(totals):>9.4f}")
+
+class ReplayOutput:
+    """Side-by-side results as JSON lines plus a CSV with one column per prompt version, written chunk by chunk"""
+
+    def __init__(self, versions, output):
+        self.versions = list(versions)
+        self.output = output
+        self._jsonl = open(f"{output}.jsonl", "w")
+        self._csv_file = open(f"{output}.csv", "w", newline="")
+        self._csv = csv.writer(self._csv_file)
+        self._csv.writerow(["session_key", "turn", "source_version", "student", "original"] + self.versions)
+
+    def write(self, rows):
+        for row in rows:
+            self._jsonl.write(json.dumps(row, ensure_ascii=False, default=str) + "\n")
+            self._csv.writerow([row["session_key"], row["turn"], row["source_version"], row["student"], row["original"]]
+                               + [row["replies"].get(version, {}).get("reply") for version in self.versions])
+        self._jsonl.flush()
+        self._csv_file.flush()
+
+    def close(self):
+        self._jsonl.close()
+        self._csv_file.close()
+        logging.info(f"Wrote {self.output}.jsonl and {self.output}.csv")
+
+def iter_chunks(items, size):
+    """Lists of up to ``size`` items from an iterator"""
+    iterator = iter(items)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+def replay_chunk(pool, client, cache, instructions, model, turns, stats, refresh=False):
+    """Replay one chunk of turns against every version; returns one result row per turn"""
+    rows = [{key: turn[key] for key in ("session_key", "turn", "source_version", "student", "original")} | {"replies": {}}
+            for turn in turns]
+
+    # Turns with identical histories (e.g. the same opening message) need one request per version
+    unique = {}
+    for index, turn in enumerate(turns):
+        key = history_hash(model, turn["messages"])
+        for version in instructions:
+            unique.setdefault((version, key), (turn, []))[1].append(index)
+
+    futures = {
+        pool.submit(replay_turn, client, cache, instructions[version], model, turn, key, refresh): (version, indexes)
+        for (version, key), (turn, indexes) in unique.items()
+    }
+    for future in as_completed(futures):
+        version, indexes = futures[future]
+        totals = stats[version]
+        totals["turns"] += len(indexes)
+        totals["requests"] += 1
+        try:
+            reply, usage, cached = future.result()
+        except Exception as e:
+            totals["errors"] += len(indexes)
+            for index in indexes:
+                rows[index]["replies"][version] = {"error": str(e)}
+            continue
+        for position, index in enumerate(indexes):
+            rows[index]["replies"][version] = {"reply": reply, "usage": usage, "cached": cached or position > 0}
+        totals["cache_hits"] += len(indexes) if cached else len(indexes) - 1
+        if not cached:
+            totals["latencies"].append(usage.get("latency_ms") or 0)
+            for field in TOKEN_FIELDS:
+                totals[field] += usage.get(field) or 0
+    return rows
+
+def replay(connection_string, client, versions, problem_id=DEFAULT_PROBLEM_ID, model="gpt-5", workers=8,
+           source_version=None, session_keys=None, limit=0, max_history=0, cache_path=DEFAULT_CACHE_PATH,
+           refresh=False, output=None, chunk_size=500):
+    """
+    1. Stream stored transcripts and split them into student turns, ``chunk_size`` turns at a time
+    2. Replay each chunk against every prompt version on a bounded worker pool,
+       reusing cached replies for unchanged (prompt, history) pairs
+    3. Append the chunk's side-by-side replies to the output, then drop them, so
+       memory is bounded by the chunk size rather than the number of transcripts
+    4. Print latency and token stats per version; returns them
+    """
+    registry = get_prompt_registry()
+    instructions = {version: registry.get_instructions(version, problem_id) for version in versions}
+    cache = ReplayCache(cache_path)
+    stats = {version: {"turns": 0, "requests": 0, "cache_hits": 0, "errors": 0, "latencies": [],
+                       **dict.fromkeys(TOKEN_FIELDS, 0)}
+             for version in versions}
+    writer = ReplayOutput(versions, output) if output else None
+    try:
+        logging.info(f"Replaying turns against {', '.join(versions)} with {workers} workers, {chunk_size} turns at a time")
+        turns = (turn for transcript in iter_transcripts(connection_string, source_version, session_keys, limit)
+                 for turn in student_turns(transcript, max_history))
+        started = time.perf_counter()
+        replayed = 0
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="replay") as pool:
+            for chunk in iter_chunks(turns, chunk_size):
+                rows = replay_chunk(pool, client, cache, instructions, model, chunk, stats, refresh)
+                if writer is not None:
+                    writer.write(rows)
+                replayed += len(chunk)
+                logging.info(f"{replayed} turns replayed")
+        requests = sum(totals["requests"] for totals in stats.values())
+        logging.info(f"Replayed {replayed * len(versions)} replies with {requests} requests "
+                     f"in {time.perf_counter() - started:.1f}s")
+
+        print_stats(stats)
+        return stats
+    finally:
+        if writer is not None:
+            writer.close()
+        cache.close()
+
+def read_secret(name):
+    value = os.getenv(name)
+    if not value:
+        # Try to read from secrets.toml
+        try:
+            import toml
+            secrets = toml.load(".streamlit/secrets.toml")
+            value = secrets.get(name)
+        except:
+            pass
+    return value
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay stored student turns against prompt versions and compare the replies")
+    parser.add_argument("--versions", nargs="+", help="Prompt versions to replay (default: all of prompts/rabbit*.md)")
+    parser.add_argument("--problem-id", default=DEFAULT_PROBLEM_ID)
+    parser.add_argument("--model", default="gpt-5")
+    parser.add_argument("--workers", type=int, default=8, help="Requests in flight at once")
+    parser.add_argument("--chunk-size", type=int, default=500, help="Turns loaded and replayed at a time")
+    parser.add_argument("--source-version", help="Only replay transcripts recorded with this prompt version")
+    parser.add_argument("--session-key", action="append", dest="session_keys", help="Only replay this session (repeatable)")
+    parser.add_argument("--limit", type=int, default=0, help="At most this many transcripts")
+    parser.add_argument("--max-history", type=int, default=0, help="Send at most this many earlier messages per turn")
+    parser.add_argument("--cache", default=DEFAULT_CACHE_PATH, help="SQLite file of cached replies")
+    parser.add_argument("--refresh", action="store_true", help="Ignore cached replies and regenerate them")
+    parser.add_argument("--output", default="replay", help="Write <output>.jsonl and <output>.csv")
+    parser.add_argument("--fake", action="store_true", help="Use the local fake OpenAI API instead of the real one")
+    args = parser.parse_args()
+
+    connection_string = read_secret("MONGODB_CONNECTION_STRING")
+    if not connection_string:
+        connection_string = input("Enter MongoDB connection string: ").strip()
+    if not connection_string:
+        raise ValueError("MongoDB connection string is required")
+
+    if args.fake:
+        from scripts.fake_openai import FakeOpenAIServer
+        server = FakeOpenAIServer().start()
+        client = get_openai_client("sk-replay", base_url=server.base_url)
+    else:
+        api_key = read_secret("OPENAI_API_KEY")
+        if not api_key:
+            raise ValueError("OPENAI_API_KEY is required (or pass --fake)")
+        client = get_openai_client(api_key, base_url=os.getenv("OPENAI_BASE_URL"))
+
+    replay(
+        connection_string,
+        client,
+        args.versions or get_prompt_registry().versions(),
+        problem_id=args.problem_id,
+        model=args.model,
+        workers=args.workers,
+        source_version=args.source_version,
+        session_keys=args.session_keys,
+        limit=args.limit,
+        max_history=args.max_history,
+        cache_path=args.cache,
+        refresh=args.refresh,
+        output=args.output,
+        chunk_size=args.chunk_size,
+    )
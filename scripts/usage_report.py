@@ -0,0 +1,124 @@
+import os
+import sys
+import logging
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from utils.mongodb import TRANSCRIPT_LAYOUT, get_mongo_client, set_mongo_client_options
+from utils.usage import TOKEN_FIELDS, cache_hit_rate, estimate_cost
+
+# Setup logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s'
+)
+
+TOTAL_FIELDS = TOKEN_FIELDS + ("turns", "latency_ms")
+
+def session_usage(connection_string):
+    """Usage totals per session as dicts with session_key, identifier and prompt_version"""
+    db = get_mongo_client(connection_string).rabbitbot
+    if TRANSCRIPT_LAYOUT == "bucketed":
+        # Totals live on the bucket documents; add them up per session and join the header
+        pipeline = [
+            {"$match": {"usage_totals": {"$exists": True}}},
+            {"$group": {
+                "_id": {"session_key": "$session_key", "conversation_type": "$conversation_type"},
+                **{field: {"$sum": f"$usage_totals.{field}"} for field in TOTAL_FIELDS}
+            }},
+            {"$lookup": {
+                "from": "sessions",
+                "let": {"key": "$_id.session_key", "type": "$_id.conversation_type"},
+                "pipeline": [
+                    {"$match": {"$expr": {"$and": [
+                        {"$eq": ["$session_key", "$$key"]},
+                        {"$eq": ["$conversation_type", "$$type"]}
+                    ]}}},
+                    {"$project": {"identifier": 1, "prompt_version": 1, "_id": 0}}
+                ],
+                "as": "header"
+            }},
+        ]
+        for row in db.transcript_buckets.aggregate(pipeline):
+            header = row["header"][0] if row["header"] else {}
+            yield {
+                "session_key": row["_id"]["session_key"],
+                "identifier": header.get("identifier"),
+                "prompt_version": header.get("prompt_version"),
+                **{field: row.get(field) or 0 for field in TOTAL_FIELDS}
+            }
+        return
+
+    cursor = db.transcripts.find(
+        {"usage_totals": {"$exists": True}},
+        {"session_key": 1, "identifier": 1, "prompt_version": 1, "usage_totals": 1, "_id": 0}
+    )
+    for document in cursor:
+        totals = document.get("usage_totals", {})
+        yield {
+            "session_key": document.get("session_key"),
+            "identifier": document.get("identifier"),
+            "prompt_version": document.get("prompt_version"),
+            **{field: totals.get(field) or 0 for field in TOTAL_FIELDS}
+        }
+
+def report(connection_string, show_sessions=False):
+    """
+    1. Add up token usage per session
+    2. Print cache hit rate, average latency and estimated cost per prompt version
+    """
+    try:
+        versions = {}
+        sessions = list(session_usage(connection_string))
+        for session in sessions:
+            totals = versions.setdefault(session["prompt_version"] or "unknown", dict.fromkeys(TOTAL_FIELDS, 0))
+            totals["sessions"] = totals.get("sessions", 0) + 1
+            for field in TOTAL_FIELDS:
+                totals[field] += session[field]
+
+        if not sessions:
+            logging.info("No usage recorded yet")
+            return
+
+        print(f"{'prompt_version':16} {'sessions':>8} {'turns':>7} {'input':>10} {'cached':>10} {'hit rate':>8} "
+              f"{'output':>9} {'reasoning':>9} {'avg ms':>8} {'cost $':>9} {'$/session':>9}")
+        for version, totals in sorted(versions.items()):
+            cost = estimate_cost(totals)
+            avg_latency = totals["latency_ms"] / totals["turns"] if totals["turns"] else 0
+            print(f"{version:16} {totals['sessions']:>8} {totals['turns']:>7} {totals['input_tokens']:>10} "
+                  f"{totals['cached_tokens']:>10} {cache_hit_rate(totals):>8.1%} {totals['output_tokens']:>9} "
+                  f"{totals['reasoning_tokens']:>9} {avg_latency:>8.0f} {cost:>9.4f} {cost / totals['sessions']:>9.4f}")
+
+        if show_sessions:
+            print()
+            print(f"{'session_key':50} {'prompt_version':16} {'turns':>6} {'hit rate':>8} {'cost $':>9}")
+            for session in sorted(sessions, key=lambda s: s["session_key"] or ""):
+                print(f"{session['session_key'] or '':50} {session['prompt_version'] or 'unknown':16} "
+                      f"{session['turns']:>6} {cache_hit_rate(session):>8.1%} {estimate_cost(session):>9.4f}")
+
+    except Exception as e:
+        logging.error(f"Error building usage report: {str(e)}")
+        raise
+
+if __name__ == "__main__":
+    # Get MongoDB connection string from environment or secrets
+    connection_string = os.getenv("MONGODB_CONNECTION_STRING")
+    if not connection_string:
+        # Try to read from secrets.toml
+        try:
+            import toml
+            secrets = toml.load(".streamlit/secrets.toml")
+            connection_string = secrets.get("MONGODB_CONNECTION_STRING")
+        except:
+            pass
+
+    if not connection_string:
+        connection_string = input("Enter MongoDB connection string: ").strip()
+
+    if not connection_string:
+        raise ValueError("MongoDB connection string is required")
+
+    # Long-running operations: don't apply the app's per-operation socket timeout
+    set_mongo_client_options(socketTimeoutMS=None)
+
+    report(connection_string, show_sessions="--sessions" in sys.argv)
@@ -0,0 +1,57 @@
+import os
+import sys
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from scripts.mongo_standin import MongoStandIn
+from utils import transcript_writer
+from utils.journal import TranscriptJournal
+from utils.mongodb import load_transcript
+from utils.transcript_writer import TranscriptWriter
+
+MONGODB_URI = "mongodb://standin"
+
+
+def wait_until(predicate, timeout=5.0, interval=0.01):
+    """Poll ``predicate`` until it returns something truthy or ``timeout`` seconds pass; returns its last result"""
+    deadline = time.monotonic() + timeout
+    while True:
+        result = predicate()
+        if result or time.monotonic() >= deadline:
+            return result
+        time.sleep(interval)
+
+
+def stored_indexes(session_key):
+    """message_index of every message stored for a session, in stored order"""
+    transcript = load_transcript(MONGODB_URI, session_key) or {}
+    return [m["message_index"] for m in transcript.get("messages", [])]
+
+
+@pytest.fixture
+def mongo():
+    """In-process MongoDB stand-in that every get_mongo_client() call returns"""
+    standin = MongoStandIn().install()
+    yield standin
+    standin.uninstall()
+
+
+@pytest.fixture
+def journal(tmp_path):
+    """Transcript journal in a fresh temporary directory"""
+    journal = TranscriptJournal(str(tmp_path / "transcripts.sqlite3"))
+    yield journal
+    journal.close()
+
+
+@pytest.fixture
+def writer(mongo, journal, monkeypatch):
+    """Running transcript writer with short flush and replay intervals"""
+    monkeypatch.setattr(transcript_writer, "WRITER_DRAIN_INTERVAL", 0.05)
+    writer = TranscriptWriter(MONGODB_URI, journal=journal, flush_interval=0.05)
+    writer.start()
+    yield writer
+    writer.stop()
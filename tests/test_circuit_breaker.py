@@ -0,0 +1,86 @@
+import time
+
+from conftest import wait_until
+from utils.circuit_breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker
+
+
+def opened(breaker, failures=3):
+    for _ in range(failures):
+        breaker.record_failure(RuntimeError("boom"))
+    return breaker
+
+
+def test_opens_after_threshold_failures_in_window():
+    breaker = CircuitBreaker("test", failure_threshold=3, cooldown=60)
+    opened(breaker, failures=2)
+    assert breaker.state == CLOSED
+    assert breaker.allow_request()
+
+    breaker.record_failure(RuntimeError("boom"))
+    assert breaker.state == OPEN
+    assert not breaker.allow_request()
+    snapshot = breaker.snapshot()
+    assert snapshot["opened"] == 1
+    assert snapshot["rejected"] == 1
+    assert "boom" in snapshot["last_error"]
+
+
+def test_failures_outside_the_window_do_not_count():
+    breaker = CircuitBreaker("test", failure_threshold=2, window=0.05, cooldown=60)
+    breaker.record_failure(RuntimeError("boom"))
+    time.sleep(0.1)
+    breaker.record_failure(RuntimeError("boom"))
+    assert breaker.state == CLOSED
+
+
+def test_slow_successes_count_as_failures():
+    breaker = CircuitBreaker("test", failure_threshold=2, slow_call_seconds=1, cooldown=60)
+    breaker.record_success(latency=5)
+    breaker.record_success(latency=0.1)
+    assert breaker.state == CLOSED
+    breaker.record_success(latency=5)
+    assert breaker.state == OPEN
+
+
+def test_half_open_lets_one_trial_through_and_closes_on_success():
+    breaker = opened(CircuitBreaker("test", failure_threshold=3, cooldown=0.05))
+    time.sleep(0.1)
+    assert breaker.allow_request()
+    assert breaker.state == HALF_OPEN
+    # Only one trial at a time
+    assert not breaker.allow_request()
+
+    breaker.record_success(latency=0.1)
+    assert breaker.state == CLOSED
+    assert breaker.allow_request()
+    assert breaker.snapshot()["recent_failures"] == 0
+
+
+def test_failed_trial_reopens():
+    breaker = opened(CircuitBreaker("test", failure_threshold=3, cooldown=0.05))
+    time.sleep(0.1)
+    assert breaker.allow_request()
+    breaker.record_failure(RuntimeError("still down"))
+    assert breaker.state == OPEN
+    assert not breaker.allow_request()
+    assert breaker.snapshot()["opened"] == 2
+
+
+def test_probe_decides_instead_of_a_real_request():
+    healthy = {"up": False}
+
+    def probe():
+        if not healthy["up"]:
+            raise RuntimeError("still down")
+
+    breaker = opened(CircuitBreaker("test", failure_threshold=3, cooldown=0.05, probe=probe))
+    time.sleep(0.1)
+    # The probe runs in the background; callers keep using the fallback
+    assert not breaker.allow_request()
+    assert wait_until(lambda: breaker.snapshot()["probes"] == 1 and breaker.state == OPEN)
+
+    healthy["up"] = True
+    time.sleep(0.1)
+    assert not breaker.allow_request()
+    assert wait_until(lambda: breaker.state == CLOSED)
+    assert breaker.allow_request()
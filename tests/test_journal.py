@@ -0,0 +1,104 @@
+import threading
+from datetime import datetime
+
+import pytest
+
+from conftest import MONGODB_URI, stored_indexes, wait_until
+from utils import journal as journal_module
+from utils.journal import drain_journal, replay_events
+from utils.mongodb import get_mongo_client, load_transcript
+from utils.transcript_writer import TranscriptWriter
+
+
+def event(session_key, i, usage=None):
+    message = {"message": {"role": "assistant", "content": f"reply {i}"}, "timestamp": datetime.utcnow(), "message_index": i}
+    if usage:
+        message["usage"] = usage
+    return {"session_key": session_key, "conversation_type": "rabbit_study", "header": {"identifier": "a"}, "message": message}
+
+
+@pytest.fixture
+def mongo_down(monkeypatch):
+    """Make journal replays fail until the returned event is set"""
+    up = threading.Event()
+
+    def client(connection_string):
+        if not up.is_set():
+            raise ConnectionError("MongoDB unavailable")
+        return get_mongo_client(connection_string)
+
+    monkeypatch.setattr(journal_module, "get_mongo_client", client)
+    return up
+
+
+def test_replaying_an_event_twice_stores_it_once(mongo):
+    events = [event("a_1", 0), event("a_1", 1, usage={"input_tokens": 10, "output_tokens": 5})]
+    replay_events(MONGODB_URI, events)
+    replay_events(MONGODB_URI, events)
+
+    transcript = load_transcript(MONGODB_URI, "a_1")
+    assert stored_indexes("a_1") == [0, 1]
+    assert transcript["message_count"] == 2
+    assert transcript["usage_totals"]["input_tokens"] == 10
+    assert transcript["usage_totals"]["turns"] == 1
+
+
+def test_drain_replays_pending_events_once(mongo, journal):
+    for i in range(5):
+        journal.append(event("a_1", i))
+    seen = []
+
+    assert drain_journal(MONGODB_URI, journal, batch_size=2, on_replayed=seen.extend) == 5
+    assert [e["message"]["message_index"] for e in seen] == list(range(5))
+    assert journal.backlog() == 0
+    assert drain_journal(MONGODB_URI, journal) == 0
+    assert stored_indexes("a_1") == list(range(5))
+
+
+def test_failed_drain_leaves_events_pending(mongo, journal, mongo_down):
+    journal.append(event("a_1", 0))
+    with pytest.raises(ConnectionError):
+        drain_journal(MONGODB_URI, journal)
+    assert journal.backlog() == 1
+
+    mongo_down.set()
+    assert drain_journal(MONGODB_URI, journal) == 1
+    assert stored_indexes("a_1") == [0]
+
+
+def test_writer_holds_new_messages_behind_a_pending_replay(writer, mongo_down):
+    for i in range(2):
+        writer.submit("a_1", {"role": "user", "content": f"message {i}"}, i)
+    assert not writer.flush()
+    assert writer.journal.backlog() == 2
+
+    # Back up: the next message must not overtake the two waiting in the journal
+    mongo_down.set()
+    writer.submit("a_1", {"role": "user", "content": "message 2"}, 2)
+    assert wait_until(lambda: writer.journal.backlog() == 0)
+    assert stored_indexes("a_1") == [0, 1, 2]
+    assert writer.acked_index("a_1") == 2
+    assert writer.metrics()["events_replayed"] >= 2
+
+
+def test_messages_deferred_on_a_full_queue_are_replayed_in_order(mongo, journal, monkeypatch):
+    # Block the writer thread inside its first write so the one-slot queue fills up
+    released = threading.Event()
+
+    def slow_client(connection_string):
+        released.wait(5)
+        return get_mongo_client(connection_string)
+
+    monkeypatch.setattr(journal_module, "get_mongo_client", slow_client)
+    writer = TranscriptWriter(MONGODB_URI, journal=journal, max_queue=1, flush_interval=0.05)
+    try:
+        results = [writer.submit("a_1", {"role": "user", "content": f"message {i}"}, i) for i in range(5)]
+        assert not all(results)
+        assert writer.metrics()["events_deferred"] == results.count(False)
+
+        released.set()
+        assert wait_until(lambda: journal.backlog() == 0 and writer.acked_index("a_1") == 4)
+        assert stored_indexes("a_1") == list(range(5))
+    finally:
+        released.set()
+        writer.stop()
@@ -0,0 +1,118 @@
+import pytest
+
+from conftest import MONGODB_URI
+from utils import transcript_writer
+from utils.message_store import ChatHistory, ChatMessage
+from utils.mongodb import get_mongo_client
+
+
+@pytest.fixture
+def history_writer(writer, monkeypatch):
+    """The test writer, registered as the process-wide writer that spill() consults"""
+    monkeypatch.setitem(transcript_writer._writers, MONGODB_URI, writer)
+    return writer
+
+
+def store(history, writer, session_key, messages, indexes):
+    """Append messages to the history and hand them to the writer under the given indexes"""
+    for message, index in zip(messages, indexes):
+        entry = history.append(message)
+        if index is not None:
+            writer.submit(session_key, message, index)
+            entry.message_index = index
+    assert writer.flush()
+
+
+def messages(count):
+    return [{"role": "user" if i % 2 else "assistant", "content": f"message {i}"} for i in range(count)]
+
+
+def test_chat_message_behaves_like_a_dict():
+    message = ChatMessage.from_dict({"role": "user", "content": "hi"})
+    assert message["role"] == "user"
+    assert message.get("content") == "hi"
+    assert message.get("message_index") is None
+    assert message == {"role": "user", "content": "hi"}
+    assert dict(message) == message.to_dict()
+    with pytest.raises(KeyError):
+        message["message_index"]
+
+
+def test_spilled_messages_reload_in_place(history_writer):
+    history = ChatHistory()
+    originals = messages(6)
+    store(history, history_writer, "a_1", originals, range(6))
+
+    assert history.spill(MONGODB_URI, "a_1", keep=2) == 4
+    assert (history.in_memory, history.spilled, len(history)) == (2, 4, 6)
+    assert list(history) == originals
+    assert history[1] == originals[1]
+    assert history[-1] == originals[5]
+    assert history[2:5] == originals[2:5]
+    assert history.recent() == originals[4:]
+
+
+def test_unsaved_message_stops_the_spill(history_writer):
+    # A message whose save failed never got an index and cannot be reloaded
+    history = ChatHistory()
+    originals = messages(5)
+    store(history, history_writer, "a_1", originals[:2], [0, 1])
+    history.append(originals[2])
+    store(history, history_writer, "a_1", originals[3:], [3, 4])
+
+    # The unsaved message stops the spill, so nothing after it is dropped either
+    assert history.spill(MONGODB_URI, "a_1", keep=1) == 2
+    assert list(history) == originals
+
+
+def test_reload_is_aligned_by_message_index_not_position(history_writer):
+    # Indexes skipped by failed saves or aborted turns leave gaps in the transcript
+    history = ChatHistory()
+    originals = messages(4)
+    store(history, history_writer, "a_1", originals, [0, 2, 5, 6])
+
+    assert history.spill(MONGODB_URI, "a_1", keep=1) == 3
+    assert list(history) == originals
+    assert [m.message_index for m in history] == [0, 2, 5, 6]
+
+
+def test_only_stored_messages_are_spilled(history_writer):
+    history = ChatHistory()
+    originals = messages(4)
+    # Nothing acknowledged for this session yet
+    for message in originals:
+        history.append(message).message_index = len(history) - 1
+    assert history.spill(MONGODB_URI, "a_1", keep=1) == 0
+    assert history.in_memory == 4
+
+
+def test_missing_transcript_messages_keep_positions(history_writer):
+    history = ChatHistory()
+    originals = messages(4)
+    store(history, history_writer, "a_1", originals, range(4))
+    assert history.spill(MONGODB_URI, "a_1", keep=1) == 3
+
+    get_mongo_client(MONGODB_URI).rabbitbot.transcripts.update_one({"session_key": "a_1"}, {"$pull": {"messages": {"message_index": 1}}})
+    reloaded = list(history)
+    assert len(reloaded) == 4
+    assert reloaded[0] == originals[0]
+    assert reloaded[1].content == ""
+    assert reloaded[2:] == originals[2:]
+
+
+def test_token_estimate_covers_spilled_messages(history_writer):
+    history = ChatHistory()
+    store(history, history_writer, "a_1", messages(6), range(6))
+    before = history.token_estimate
+    history.spill(MONGODB_URI, "a_1", keep=2)
+    assert history.token_estimate == before > 0
+
+
+def test_from_transcript_carries_message_indexes():
+    transcript = {"messages": [
+        {"message": {"role": "user", "content": "second"}, "message_index": 3},
+        {"message": {"role": "assistant", "content": "first"}, "message_index": 0},
+    ]}
+    history = ChatHistory.from_transcript(transcript)
+    assert [m.content for m in history] == ["first", "second"]
+    assert [m.message_index for m in history] == [0, 3]
@@ -0,0 +1,96 @@
+import threading
+
+import pytest
+
+from conftest import wait_until
+from utils.rate_limit import AdmissionController, AdmissionTimeout
+
+
+def queue_request(controller, session, name, admitted):
+    """Start a request on its own thread and wait until it is queued"""
+    waiting = controller.snapshot()["waiting"]
+
+    def run():
+        with controller.acquire(session):
+            admitted.append(name)
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    assert wait_until(lambda: controller.snapshot()["waiting"] == waiting + 1)
+    return thread
+
+
+def test_waiting_sessions_are_served_round_robin():
+    controller = AdmissionController(max_in_flight=1, tokens_per_minute=0, timeout=5)
+    blocker = controller.acquire("other")
+    admitted = []
+    threads = [queue_request(controller, session, name, admitted)
+               for session, name in [("a", "a1"), ("a", "a2"), ("a", "a3"), ("b", "b1")]]
+
+    blocker.release()
+    for thread in threads:
+        thread.join(5)
+    # Session a's backlog does not hold b back behind all of it
+    assert admitted == ["a1", "b1", "a2", "a3"]
+    snapshot = controller.snapshot()
+    assert snapshot["in_flight"] == 0
+    assert snapshot["queued"] == 4
+
+
+def test_in_flight_limit_and_queued_callback():
+    controller = AdmissionController(max_in_flight=2, tokens_per_minute=0, timeout=5)
+    first, second = controller.acquire("a"), controller.acquire("b")
+    assert controller.snapshot()["in_flight"] == 2
+
+    calls = []
+    releaser = threading.Timer(0.05, first.release)
+    releaser.start()
+    with controller.acquire("c", on_queued=lambda: calls.append(1)) as permit:
+        assert permit.waited > 0
+    assert calls == [1]
+    second.release()
+    assert controller.snapshot()["in_flight"] == 0
+
+
+def test_timeout_leaves_no_ticket_behind():
+    controller = AdmissionController(max_in_flight=1, tokens_per_minute=0, timeout=5)
+    held = controller.acquire("a")
+    with pytest.raises(AdmissionTimeout):
+        controller.acquire("b", timeout=0.05)
+    snapshot = controller.snapshot()
+    assert snapshot["timeouts"] == 1
+    assert snapshot["waiting"] == 0
+
+    held.release()
+    controller.acquire("c", timeout=0.05).release()
+
+
+def test_token_budget_is_corrected_by_actual_usage():
+    controller = AdmissionController(max_in_flight=4, tokens_per_minute=600, timeout=5)
+    permit = controller.acquire("a", tokens=500)
+    assert controller.snapshot()["tokens_available"] < 120
+
+    permit.actual_tokens = 100
+    permit.release()
+    # The 400 tokens reserved but not used go back to the bucket
+    assert 490 <= controller.snapshot()["tokens_available"] <= 600
+
+
+def test_request_waits_for_the_token_bucket_to_refill():
+    controller = AdmissionController(max_in_flight=4, tokens_per_minute=6000, timeout=5)
+    controller.acquire("a", tokens=5950).release()
+    # 100 tokens per second: a 60-token deficit is about 0.6 seconds away
+    with pytest.raises(AdmissionTimeout):
+        controller.acquire("b", tokens=110, timeout=0.05)
+    permit = controller.acquire("b", tokens=110, timeout=5)
+    assert permit.waited > 0.3
+    permit.release()
+
+
+def test_pause_holds_back_new_admissions():
+    controller = AdmissionController(max_in_flight=4, tokens_per_minute=0, timeout=5)
+    controller.pause(0.2)
+    permit = controller.acquire("a")
+    assert permit.waited >= 0.15
+    permit.release()
+    assert controller.snapshot()["rate_limited"] == 1
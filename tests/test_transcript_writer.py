@@ -0,0 +1,55 @@
+from conftest import MONGODB_URI, stored_indexes
+from utils.mongodb import load_transcript
+
+
+def message(i):
+    return {"role": "user" if i % 2 else "assistant", "content": f"message {i}"}
+
+
+def test_messages_are_written_in_order_per_session(writer):
+    for i in range(6):
+        assert writer.submit("a_1", message(i), i, header={"identifier": "a"})
+        assert writer.submit("b_1", message(i), i, header={"identifier": "b"})
+    assert writer.flush()
+
+    for session_key in ("a_1", "b_1"):
+        transcript = load_transcript(MONGODB_URI, session_key)
+        assert [m["message_index"] for m in transcript["messages"]] == list(range(6))
+        assert [m["message"] for m in transcript["messages"]] == [message(i) for i in range(6)]
+        assert transcript["message_count"] == 6
+    assert writer.metrics()["events_written"] == 12
+
+
+def test_queued_messages_are_coalesced_into_batches(writer):
+    for i in range(20):
+        writer.submit("a_1", message(i), i)
+    assert writer.flush()
+
+    metrics = writer.metrics()
+    assert metrics["events_written"] == 20
+    assert metrics["batches_flushed"] < 20
+    assert metrics["queue_depth"] == 0
+    assert metrics["journal_backlog"] == 0
+
+
+def test_header_is_only_written_when_the_transcript_is_created(writer):
+    writer.submit("a_1", message(0), 0, header={"identifier": "a", "prompt_version": "rabbit_v1"})
+    assert writer.flush()
+    writer.submit("a_1", message(1), 1, header={"identifier": "a", "prompt_version": "rabbit_v2"})
+    assert writer.flush()
+
+    transcript = load_transcript(MONGODB_URI, "a_1")
+    assert transcript["prompt_version"] == "rabbit_v1"
+    assert stored_indexes("a_1") == [0, 1]
+
+
+def test_acked_index_follows_stored_messages(writer):
+    assert writer.acked_index("a_1") is None
+    for i in range(3):
+        writer.submit("a_1", message(i), i)
+    writer.submit("a_1", message(3))
+    assert writer.flush()
+
+    # A message without an index is stored but says nothing about how far the session got
+    assert writer.acked_index("a_1") == 2
+    assert writer.acked_index("b_1") is None
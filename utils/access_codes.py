@@ -0,0 +1,139 @@
+from collections import OrderedDict
+import logging
+import os
+import threading
+import time
+
+from utils.mongodb import check_identifier, get_mongo_client
+
+logger = logging.getLogger(__name__)
+
+# Cache settings, overridable through the environment
+ACCESS_CODE_POSITIVE_TTL = float(os.getenv("ACCESS_CODE_POSITIVE_TTL", "300"))
+ACCESS_CODE_NEGATIVE_TTL = float(os.getenv("ACCESS_CODE_NEGATIVE_TTL", "10"))
+ACCESS_CODE_PRELOAD = os.getenv("ACCESS_CODE_PRELOAD", "true").lower() in ("1", "true", "yes")
+ACCESS_CODE_REFRESH_INTERVAL = float(os.getenv("ACCESS_CODE_REFRESH_INTERVAL", "300"))
+ACCESS_CODE_CACHE_MAX_ENTRIES = int(os.getenv("ACCESS_CODE_CACHE_MAX_ENTRIES", "10000"))
+
+
+class AccessCodeCache:
+    """Process-wide cache in front of the valid_identifiers collection.
+
+    Lookups are answered from, in order: the preloaded set of all codes
+    (refreshed in the background), the per-code positive cache, and the
+    short-lived negative cache. Only a miss in all three goes to MongoDB.
+    The per-code entries are least-recently-used first and capped at
+    ``max_entries``, so guessed codes cannot grow the cache without bound.
+    """
+
+    def __init__(self, connection_string, positive_ttl=ACCESS_CODE_POSITIVE_TTL, negative_ttl=ACCESS_CODE_NEGATIVE_TTL,
+                 preload=ACCESS_CODE_PRELOAD, refresh_interval=ACCESS_CODE_REFRESH_INTERVAL,
+                 max_entries=ACCESS_CODE_CACHE_MAX_ENTRIES):
+        self.connection_string = connection_string
+        self.positive_ttl = positive_ttl
+        self.negative_ttl = negative_ttl
+        self.refresh_interval = refresh_interval
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._all_codes = None
+        self._stats = {"hits": 0, "misses": 0, "preload_hits": 0, "refreshes": 0, "evictions": 0}
+        if preload:
+            threading.Thread(target=self._refresh_loop, name="access-code-refresh", daemon=True).start()
+
+    def is_valid(self, identifier):
+        """Return True if the access code exists, using the database only on a cache miss"""
+        identifier = (identifier or "").strip()
+        if not identifier:
+            return False
+
+        now = time.monotonic()
+        with self._lock:
+            if self._all_codes is not None and identifier in self._all_codes:
+                self._stats["preload_hits"] += 1
+                return True
+            entry = self._entries.get(identifier)
+            if entry is not None and entry[1] > now:
+                self._entries.move_to_end(identifier)
+                self._stats["hits"] += 1
+                return entry[0]
+            self._stats["misses"] += 1
+
+        valid = check_identifier(self.connection_string, identifier)
+        ttl = self.positive_ttl if valid else self.negative_ttl
+        with self._lock:
+            self._entries[identifier] = (valid, time.monotonic() + ttl)
+            self._entries.move_to_end(identifier)
+            self._evict()
+        return valid
+
+    def _evict(self):
+        # Expired entries go first, then the least recently used ones
+        if len(self._entries) <= self.max_entries:
+            return
+        now = time.monotonic()
+        for identifier in [i for i, (_, expires) in self._entries.items() if expires <= now]:
+            del self._entries[identifier]
+            self._stats["evictions"] += 1
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self._stats["evictions"] += 1
+
+    def invalidate(self, identifier=None):
+        """Forget one cached code, or everything when no code is given"""
+        with self._lock:
+            if identifier is None:
+                self._entries.clear()
+                self._all_codes = None
+            else:
+                self._entries.pop(identifier, None)
+                if self._all_codes is not None:
+                    self._all_codes = self._all_codes - {identifier}
+
+    def refresh(self):
+        """Reload the full set of access codes from MongoDB"""
+        collection = get_mongo_client(self.connection_string).rabbitbot.valid_identifiers
+        codes = frozenset(doc["identifier"] for doc in collection.find({}, {"identifier": 1, "_id": 0}) if "identifier" in doc)
+        with self._lock:
+            self._all_codes = codes
+            # Drop entries the reload contradicts: negative ones for codes that
+            # have since been added, positive ones for codes that were revoked
+            for identifier in [i for i, (valid, _) in self._entries.items() if valid != (i in codes)]:
+                del self._entries[identifier]
+            self._stats["refreshes"] += 1
+        return len(codes)
+
+    def stats(self):
+        """Hit/miss counters and the size of the preloaded code set"""
+        with self._lock:
+            snapshot = dict(self._stats)
+            snapshot["cached_entries"] = len(self._entries)
+            snapshot["preloaded_codes"] = len(self._all_codes) if self._all_codes is not None else 0
+        return snapshot
+
+    def _refresh_loop(self):
+        while True:
+            try:
+                self.refresh()
+            except Exception as e:
+                logger.warning(f"Access code refresh failed: {e}")
+            time.sleep(self.refresh_interval)
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+def get_access_code_cache(connection_string):
+    """Return the process-wide access code cache for this connection string"""
+    cache = _caches.get(connection_string)
+    if cache is None:
+        with _caches_lock:
+            cache = _caches.get(connection_string)
+            if cache is None:
+                cache = AccessCodeCache(connection_string)
+                _caches[connection_string] = cache
+    return cache
+
+def is_access_code_valid(connection_string, identifier):
+    """Cached replacement for check_identifier()"""
+    return get_access_code_cache(connection_string).is_valid(identifier)
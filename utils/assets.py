@@ -0,0 +1,118 @@
+from html import escape
+import hashlib
+import json
+import os
+import threading
+
+import streamlit as st
+
+# Streamlit serves ./static next to the main script at app/static when
+# server.enableStaticServing is on (see .streamlit/config.toml)
+STATIC_DIR = "static"
+STATIC_URL = os.getenv("STATIC_URL", "app/static")
+ASSET_MANIFEST = os.path.join(STATIC_DIR, "manifest.json")
+
+# Widths generated for each figure, capped at the source width
+FIGURE_WIDTHS = (480, 720, 1080)
+# Preferred first; browsers pick the first <source> type they support
+FIGURE_FORMATS = (("avif", "AVIF", {"quality": 60}), ("webp", "WEBP", {"quality": 82, "method": 6}))
+
+
+def _hashed_name(stem, data, suffix):
+    return f"{stem}.{hashlib.sha256(data).hexdigest()[:12]}{suffix}"
+
+def _encode(image, format_name, options):
+    from io import BytesIO
+    buffer = BytesIO()
+    image.save(buffer, format_name, **options)
+    return buffer.getvalue()
+
+def build_figure_assets(source, output_dir=STATIC_DIR, widths=FIGURE_WIDTHS):
+    """Write content-hashed width variants of an image and return its manifest entry.
+
+    Needs Pillow; formats the installed Pillow cannot encode are skipped.
+    """
+    from PIL import Image, features
+
+    with open(source, "rb") as file:
+        original = file.read()
+    figures_dir = os.path.join(output_dir, "figures")
+    os.makedirs(figures_dir, exist_ok=True)
+    stem = os.path.splitext(os.path.basename(source))[0]
+
+    def write(name, data):
+        with open(os.path.join(figures_dir, name), "wb") as file:
+            file.write(data)
+        return f"figures/{name}"
+
+    fallback = write(_hashed_name(stem, original, os.path.splitext(source)[1]), original)
+    with Image.open(source) as image:
+        image.load()
+        width, height = image.size
+        variants = {}
+        for extension, format_name, options in FIGURE_FORMATS:
+            if not features.check(extension):
+                continue
+            variants[extension] = []
+            for target in sorted({w for w in widths if w < width} | {width}):
+                resized = image if target == width else image.resize(
+                    (target, round(height * target / width)), Image.LANCZOS
+                )
+                data = _encode(resized, format_name, options)
+                variants[extension].append({
+                    "width": target,
+                    "file": write(_hashed_name(f"{stem}-{target}w", data, f".{extension}"), data),
+                    "bytes": len(data),
+                })
+
+    return {
+        "sha256": hashlib.sha256(original).hexdigest(),
+        "width": width,
+        "height": height,
+        "fallback": fallback,
+        "bytes": len(original),
+        "variants": variants,
+    }
+
+
+_manifest = {"signature": None, "entries": {}}
+_manifest_lock = threading.Lock()
+
+def get_asset_manifest(path=ASSET_MANIFEST):
+    """Built assets keyed by source path; re-read only when the manifest file changes"""
+    try:
+        stat = os.stat(path)
+        signature = (path, stat.st_mtime_ns, stat.st_size)
+    except FileNotFoundError:
+        return {}
+    if _manifest["signature"] != signature:
+        with _manifest_lock:
+            if _manifest["signature"] != signature:
+                with open(path, "r") as file:
+                    _manifest["entries"] = json.load(file)
+                _manifest["signature"] = signature
+    return _manifest["entries"]
+
+def static_url(relative_path):
+    return f"{STATIC_URL}/{relative_path}"
+
+def figure_html(source, alt=""):
+    """A responsive <picture> for a built figure, or None if it has not been built or static serving is off"""
+    if not st.get_option("server.enableStaticServing"):
+        return None
+    entry = get_asset_manifest().get(source)
+    if entry is None:
+        return None
+    sizes = f"(max-width: {entry['width']}px) 100vw, {entry['width']}px"
+    sources = "".join(
+        f'<source type="image/{extension}" sizes="{sizes}" srcset="'
+        + ", ".join(f"{static_url(v['file'])} {v['width']}w" for v in variants)
+        + '">'
+        for extension, variants in entry["variants"].items() if variants
+    )
+    return (
+        f"<picture>{sources}"
+        f'<img src="{static_url(entry["fallback"])}" alt="{escape(alt)}" width="{entry["width"]}" '
+        f'height="{entry["height"]}" style="max-width: 100%; height: auto;" decoding="async">'
+        f"</picture>"
+    )
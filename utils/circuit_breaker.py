@@ -0,0 +1,167 @@
+from collections import deque
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Breaker settings, overridable through the environment
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("BREAKER_FAILURE_THRESHOLD", "3"))
+BREAKER_WINDOW = float(os.getenv("BREAKER_WINDOW", "60"))
+BREAKER_COOLDOWN = float(os.getenv("BREAKER_COOLDOWN", "30"))
+BREAKER_SLOW_CALL_SECONDS = float(os.getenv("BREAKER_SLOW_CALL_SECONDS", "20"))
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitBreaker:
+    """Tracks recent outcomes for one model backend and stops routing to it while it is failing.
+
+    The breaker opens once ``failure_threshold`` failures (or calls slower
+    than ``slow_call_seconds``) happen within ``window`` seconds. While open,
+    ``allow_request()`` returns False so callers go straight to their
+    fallback. After ``cooldown`` seconds the breaker goes half-open: if a
+    ``probe`` callable was given it is run on a background thread and its
+    result closes or re-opens the breaker; otherwise the next real request
+    is let through as the trial.
+    """
+
+    def __init__(self, name, failure_threshold=BREAKER_FAILURE_THRESHOLD, window=BREAKER_WINDOW,
+                 cooldown=BREAKER_COOLDOWN, slow_call_seconds=BREAKER_SLOW_CALL_SECONDS, probe=None):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.window = window
+        self.cooldown = cooldown
+        self.slow_call_seconds = slow_call_seconds
+        self.probe = probe
+        self._lock = threading.Lock()
+        self._state = CLOSED
+        self._opened_at = 0.0
+        self._trial_in_flight = False
+        self._events = deque()
+        self._counters = {"successes": 0, "failures": 0, "rejected": 0, "opened": 0, "probes": 0}
+        self._last_error = None
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._state
+
+    def allow_request(self):
+        """Return True if the caller should try this backend now"""
+        start_probe = False
+        with self._lock:
+            if self._state == CLOSED:
+                return True
+            if self._state == OPEN and time.monotonic() - self._opened_at >= self.cooldown:
+                self._state = HALF_OPEN
+            if self._state == HALF_OPEN and not self._trial_in_flight:
+                self._trial_in_flight = True
+                if self.probe is None:
+                    # No probe configured: this request is the trial
+                    return True
+                start_probe = True
+            self._counters["rejected"] += 1
+        if start_probe:
+            threading.Thread(target=self._run_probe, name=f"breaker-probe-{self.name}", daemon=True).start()
+        return False
+
+    def record_success(self, latency=None):
+        """Record a completed call; latency in seconds"""
+        with self._lock:
+            self._counters["successes"] += 1
+            slow = latency is not None and self.slow_call_seconds and latency > self.slow_call_seconds
+            self._record(now=time.monotonic(), ok=not slow, latency=latency)
+            if self._state == HALF_OPEN:
+                self._close()
+            elif slow:
+                self._maybe_open()
+
+    def record_failure(self, error=None, latency=None):
+        """Record a failed call"""
+        with self._lock:
+            self._counters["failures"] += 1
+            self._last_error = repr(error) if error is not None else None
+            self._record(now=time.monotonic(), ok=False, latency=latency)
+            if self._state == HALF_OPEN:
+                self._open()
+            else:
+                self._maybe_open()
+
+    def snapshot(self):
+        """State, counters and recent latency for monitoring"""
+        with self._lock:
+            self._trim(time.monotonic())
+            latencies = [latency for _, _, latency in self._events if latency is not None]
+            return {
+                "name": self.name,
+                "state": self._state,
+                "recent_failures": sum(1 for _, ok, _ in self._events if not ok),
+                "recent_calls": len(self._events),
+                "avg_latency": sum(latencies) / len(latencies) if latencies else None,
+                "max_latency": max(latencies) if latencies else None,
+                "last_error": self._last_error,
+                **self._counters,
+            }
+
+    def _record(self, now, ok, latency):
+        self._events.append((now, ok, latency))
+        self._trim(now)
+
+    def _trim(self, now):
+        while self._events and now - self._events[0][0] > self.window:
+            self._events.popleft()
+
+    def _maybe_open(self):
+        failures = sum(1 for _, ok, _ in self._events if not ok)
+        if self._state == CLOSED and failures >= self.failure_threshold:
+            self._open()
+
+    def _open(self):
+        if self._state != OPEN:
+            self._counters["opened"] += 1
+            logger.warning(f"Circuit breaker '{self.name}' opened: {self._last_error}")
+        self._state = OPEN
+        self._opened_at = time.monotonic()
+        self._trial_in_flight = False
+
+    def _close(self):
+        logger.info(f"Circuit breaker '{self.name}' closed")
+        self._state = CLOSED
+        self._trial_in_flight = False
+        self._events.clear()
+
+    def _run_probe(self):
+        with self._lock:
+            self._counters["probes"] += 1
+        started = time.monotonic()
+        try:
+            self.probe()
+        except Exception as e:
+            self.record_failure(e, latency=time.monotonic() - started)
+            return
+        self.record_success(latency=time.monotonic() - started)
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+def get_breaker(name, **kwargs):
+    """Return the process-wide breaker for a backend; kwargs only apply when it is first created"""
+    breaker = _breakers.get(name)
+    if breaker is None:
+        with _breakers_lock:
+            breaker = _breakers.get(name)
+            if breaker is None:
+                breaker = CircuitBreaker(name, **kwargs)
+                _breakers[name] = breaker
+    return breaker
+
+def get_breaker_states():
+    """Snapshot of every breaker, keyed by backend name"""
+    with _breakers_lock:
+        breakers = list(_breakers.values())
+    return {breaker.name: breaker.snapshot() for breaker in breakers}
@@ -0,0 +1,117 @@
+from concurrent.futures import ThreadPoolExecutor
+import logging
+import os
+
+from utils.rate_limit import limited_call
+
+logger = logging.getLogger(__name__)
+
+# "conversation" keeps the full server-side OpenAI conversation; "bounded"
+# sends a running summary plus a window of recent messages instead
+CONTEXT_MODE = os.getenv("CONTEXT_MODE", "conversation")
+CONTEXT_RECENT_MESSAGES = int(os.getenv("CONTEXT_RECENT_MESSAGES", "12"))
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "3000"))
+CONTEXT_SUMMARY_BATCH = int(os.getenv("CONTEXT_SUMMARY_BATCH", "8"))
+CONTEXT_SUMMARY_MODEL = os.getenv("CONTEXT_SUMMARY_MODEL", "gpt-5-mini")
+CONTEXT_SUMMARY_MAX_TOKENS = int(os.getenv("CONTEXT_SUMMARY_MAX_TOKENS", "400"))
+
+SUMMARY_INSTRUCTIONS = (
+    "You maintain a running summary of a tutoring conversation between a student and Rabbit, "
+    "a study partner working through an economics problem. Update the summary with the new messages. "
+    "Keep: the student's name, which parts of the problem have been covered, conclusions reached, "
+    "Rabbit's remaining misconceptions and any hints shown. Be concise; use at most 200 words."
+)
+
+# Summaries run off the chat path on a small shared pool
+_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="context-summary")
+
+
+def estimate_tokens(text):
+    """Rough token count (about four characters per token plus message overhead)"""
+    return len(text or "") // 4 + 4
+
+def summarise(client, previous_summary, messages, model=CONTEXT_SUMMARY_MODEL):
+    """Fold messages into the previous summary and return the new summary text"""
+    transcript = "\n".join(f"{m['role']}: {m['content']}" for m in messages)
+    prompt = f"Current summary:\n{previous_summary or '(none)'}\n\nNew messages:\n{transcript}"
+    # Summaries share the process-wide OpenAI budget with chat turns
+    response = limited_call(
+        "context-summary",
+        estimate_tokens(SUMMARY_INSTRUCTIONS) + estimate_tokens(prompt) + CONTEXT_SUMMARY_MAX_TOKENS,
+        lambda: client.responses.create(
+            model=model,
+            instructions=SUMMARY_INSTRUCTIONS,
+            input=prompt,
+            max_output_tokens=CONTEXT_SUMMARY_MAX_TOKENS,
+            reasoning={"effort": "minimal"}
+        )
+    )
+    return response.output_text.strip()
+
+
+class BoundedContext:
+    """Per-session running summary plus a recent-message window under a token budget.
+
+    ``summarised_upto`` is the number of chat history messages already folded
+    into ``summary``. Once enough older messages fall outside the recent
+    window, ``schedule_summary()`` folds them in on a background thread; the
+    result is picked up by ``collect()`` on a later turn, so the chat path
+    never waits for summarisation.
+    """
+
+    def __init__(self, recent_messages=CONTEXT_RECENT_MESSAGES, token_budget=CONTEXT_TOKEN_BUDGET,
+                 summary_batch=CONTEXT_SUMMARY_BATCH):
+        self.recent_messages = recent_messages
+        self.token_budget = token_budget
+        self.summary_batch = summary_batch
+        self.summary = ""
+        self.summarised_upto = 0
+        self._future = None
+
+    def collect(self):
+        """Adopt a finished background summary, if there is one"""
+        if self._future is None or not self._future.done():
+            return
+        future, self._future = self._future, None
+        try:
+            self.summary, self.summarised_upto = future.result()
+        except Exception as e:
+            logger.warning(f"Context summary failed, keeping the previous one: {e}")
+
+    def window(self, history):
+        """Most recent unsummarised messages that fit the message and token limits"""
+        budget = self.token_budget - estimate_tokens(self.summary)
+        selected = []
+        # Never more than recent_messages are picked, so only read that many from the end
+        start = max(self.summarised_upto, len(history) - self.recent_messages)
+        for message in reversed(history[start:]):
+            cost = estimate_tokens(message["content"])
+            if selected and (len(selected) >= self.recent_messages or cost > budget):
+                break
+            selected.append({"role": message["role"], "content": message["content"]})
+            budget -= cost
+        selected.reverse()
+        return selected
+
+    def summary_message(self, role="developer"):
+        """The running summary as a message, or None before the first summary"""
+        if not self.summary:
+            return None
+        return {"role": role, "content": f"Summary of the conversation so far:\n{self.summary}"}
+
+    def schedule_summary(self, client, history):
+        """Start folding older messages into the summary once a full batch has left the window"""
+        self.collect()
+        if self._future is not None:
+            return False
+        fold_until = len(history) - self.recent_messages
+        if fold_until - self.summarised_upto < self.summary_batch:
+            return False
+        messages = [{"role": m["role"], "content": m["content"]} for m in history[self.summarised_upto:fold_until]]
+        previous = self.summary
+
+        def run():
+            return summarise(client, previous, messages), fold_until
+
+        self._future = _executor.submit(run)
+        return True
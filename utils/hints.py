@@ -0,0 +1,55 @@
+from dataclasses import dataclass
+import re
+
+# A line such as "a)  The initial market equilibrium ..." starts part a
+_PART_PATTERN = re.compile(r"^([a-z])\)\s")
+
+
+@dataclass(frozen=True)
+class Hint:
+    """One hint line and the problem part it belongs to"""
+    index: int
+    part: str
+    text: str
+
+
+@dataclass(frozen=True)
+class HintIndex:
+    """Ordered, immutable hints for one problem with the position where each part starts"""
+    problem_id: str
+    source: str
+    hints: tuple = ()
+    part_starts: tuple = ()
+
+    def __len__(self):
+        return len(self.hints)
+
+    def get(self, index):
+        """The hint at ``index``, or None once the hints are used up"""
+        if 0 <= index < len(self.hints):
+            return self.hints[index]
+        return None
+
+    @property
+    def parts(self):
+        return tuple(part for part, _ in self.part_starts)
+
+    def part_start(self, part):
+        """Index of the first hint of a part, e.g. ``part_start("b")``"""
+        return dict(self.part_starts).get(part)
+
+
+def parse_hints(text, problem_id, source=None):
+    """Split a hint file into non-empty lines, tagging each with its part (a, b, c, ...)"""
+    hints, part_starts = [], []
+    part = ""
+    for line in text.splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        match = _PART_PATTERN.match(line)
+        if match:
+            part = match.group(1)
+            part_starts.append((part, len(hints)))
+        hints.append(Hint(index=len(hints), part=part, text=line))
+    return HintIndex(problem_id=problem_id, source=source, hints=tuple(hints), part_starts=tuple(part_starts))
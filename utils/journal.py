@@ -0,0 +1,192 @@
+from collections import OrderedDict
+from datetime import datetime
+from pymongo import UpdateOne
+import json
+import os
+import sqlite3
+import threading
+
+from utils.mongodb import TRANSCRIPT_LAYOUT, get_mongo_client
+from utils.transcript_buckets import replay_bucketed_events
+from utils.usage import usage_increments
+
+# Journal location, overridable through the environment
+JOURNAL_PATH = os.getenv("TRANSCRIPT_JOURNAL_PATH", ".journal/transcripts.sqlite3")
+
+
+def _encode(value):
+    if isinstance(value, datetime):
+        return {"$date": value.isoformat()}
+    raise TypeError(f"Cannot serialise {type(value).__name__}")
+
+def _decode(obj):
+    if set(obj) == {"$date"}:
+        return datetime.fromisoformat(obj["$date"])
+    return obj
+
+
+class TranscriptJournal:
+    """Append-only SQLite journal that every transcript event hits before MongoDB.
+
+    Rows are committed with ``synchronous=FULL`` so an event is on disk before
+    ``append()`` returns. Rows stay pending until ``mark_replayed()`` records
+    that they reached the ``transcripts`` collection.
+    """
+
+    def __init__(self, path=JOURNAL_PATH):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=FULL")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS events (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                session_key TEXT NOT NULL,
+                conversation_type TEXT NOT NULL,
+                message_index INTEGER,
+                payload TEXT NOT NULL,
+                created_at TEXT NOT NULL,
+                replayed_at TEXT
+            )"""
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS events_pending ON events (replayed_at, id)")
+
+    def append(self, event):
+        """Durably record an event and return its journal id"""
+        payload = json.dumps({"header": event["header"], "message": event["message"]}, default=_encode)
+        with self._lock:
+            cursor = self._conn.execute(
+                "INSERT INTO events (session_key, conversation_type, message_index, payload, created_at) VALUES (?, ?, ?, ?, ?)",
+                (event["session_key"], event["conversation_type"], event["message"].get("message_index"),
+                 payload, datetime.utcnow().isoformat())
+            )
+            return cursor.lastrowid
+
+    def pending(self, limit=500):
+        """Return up to ``limit`` events that have not been replayed yet, oldest first"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id, session_key, conversation_type, payload FROM events WHERE replayed_at IS NULL ORDER BY id LIMIT ?",
+                (limit,)
+            ).fetchall()
+        events = []
+        for row_id, session_key, conversation_type, payload in rows:
+            data = json.loads(payload, object_hook=_decode)
+            events.append({
+                "journal_id": row_id,
+                "session_key": session_key,
+                "conversation_type": conversation_type,
+                "header": data["header"],
+                "message": data["message"]
+            })
+        return events
+
+    def mark_replayed(self, journal_ids):
+        """Record that these events are now stored in MongoDB"""
+        journal_ids = [i for i in journal_ids if i is not None]
+        if not journal_ids:
+            return
+        now = datetime.utcnow().isoformat()
+        with self._lock:
+            self._conn.executemany("UPDATE events SET replayed_at = ? WHERE id = ?", [(now, i) for i in journal_ids])
+
+    def backlog(self):
+        """Number of events still waiting to be replayed"""
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM events WHERE replayed_at IS NULL").fetchone()[0]
+
+    def purge_replayed(self):
+        """Delete events that have already been replayed; returns the number removed"""
+        with self._lock:
+            return self._conn.execute("DELETE FROM events WHERE replayed_at IS NOT NULL").rowcount
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def build_replay_operations(events):
+    """Build idempotent bulk operations for a list of journal events.
+
+    Each session gets one header upsert, then one conditional ``$push`` per
+    message that only matches while no message with the same
+    ``message_index`` is stored, so replaying an event twice is a no-op.
+    """
+    sessions = OrderedDict()
+    for event in events:
+        key = (event["session_key"], event["conversation_type"])
+        if key not in sessions:
+            sessions[key] = {"header": event["header"], "messages": []}
+        sessions[key]["messages"].append(event["message"])
+
+    now = datetime.utcnow()
+    operations = []
+    for (session_key, conversation_type), session in sessions.items():
+        session_filter = {"session_key": session_key, "conversation_type": conversation_type}
+        set_on_insert = {k: v for k, v in session["header"].items() if k not in ("session_key", "conversation_type")}
+        set_on_insert["timestamp"] = session["messages"][0]["timestamp"]
+        set_on_insert["messages"] = []
+        set_on_insert["message_count"] = 0
+        operations.append(UpdateOne(
+            session_filter,
+            {"$set": {"last_updated": now}, "$setOnInsert": set_on_insert},
+            upsert=True
+        ))
+        for message in session["messages"]:
+            message_filter = dict(session_filter)
+            if message.get("message_index") is not None:
+                message_filter["messages.message_index"] = {"$ne": message["message_index"]}
+            # Usage totals ride on the conditional push, so a replayed reply is only counted once
+            operations.append(UpdateOne(
+                message_filter,
+                {"$push": {"messages": message},
+                 "$inc": {"message_count": 1, **usage_increments(message.get("usage"))}}
+            ))
+    return operations
+
+def replay_events(connection_string, events):
+    """Write journal events to MongoDB using the configured transcript layout"""
+    if not events:
+        return
+    if TRANSCRIPT_LAYOUT == "bucketed":
+        replay_bucketed_events(connection_string, events)
+        return
+    collection = get_mongo_client(connection_string).rabbitbot.transcripts
+    collection.bulk_write(build_replay_operations(events), ordered=True)
+
+def drain_journal(connection_string, journal, batch_size=500, on_replayed=None):
+    """Replay every pending journal event into MongoDB; returns the number replayed.
+
+    ``on_replayed`` is called with each batch of events once it is stored.
+    """
+    replayed = 0
+    while True:
+        events = journal.pending(batch_size)
+        if not events:
+            return replayed
+        replay_events(connection_string, events)
+        journal.mark_replayed([event["journal_id"] for event in events])
+        if on_replayed is not None:
+            on_replayed(events)
+        replayed += len(events)
+        if len(events) < batch_size:
+            return replayed
+
+
+_journals = {}
+_journals_lock = threading.Lock()
+
+def get_journal(path=JOURNAL_PATH):
+    """Return the process-wide journal for this path, opening it on first use"""
+    journal = _journals.get(path)
+    if journal is None:
+        with _journals_lock:
+            journal = _journals.get(path)
+            if journal is None:
+                journal = TranscriptJournal(path)
+                _journals[path] = journal
+    return journal
@@ -0,0 +1,241 @@
+import logging
+import os
+import sys
+import threading
+import weakref
+
+logger = logging.getLogger(__name__)
+
+# Newest messages each session keeps in memory; older ones are dropped once
+# stored and reloaded from the transcript on demand (0 keeps everything)
+CHAT_HISTORY_IN_MEMORY = int(os.getenv("CHAT_HISTORY_IN_MEMORY", "200"))
+
+
+class ChatMessage:
+    """One chat message without a per-instance dict; supports ``message["role"]`` like the dicts it replaces.
+
+    ``message_index`` is the transcript index the message was stored under,
+    or None until it has been handed to the transcript writer.
+    """
+    __slots__ = ("role", "content", "message_index")
+    # The fields it exposes as a dict, and stores in the transcript
+    _fields = ("role", "content")
+
+    def __init__(self, role, content, message_index=None):
+        # A handful of role strings shared by every message in the process
+        self.role = sys.intern(role)
+        self.content = content
+        self.message_index = message_index
+
+    @classmethod
+    def from_dict(cls, message):
+        if isinstance(message, cls):
+            return message
+        return cls(message["role"], message["content"])
+
+    def __getitem__(self, key):
+        if key not in self._fields:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def get(self, key, default=None):
+        return getattr(self, key) if key in self._fields else default
+
+    def keys(self):
+        return self._fields
+
+    def to_dict(self):
+        return {"role": self.role, "content": self.content}
+
+    def __eq__(self, other):
+        if isinstance(other, (ChatMessage, dict)):
+            return self.role == other["role"] and self.content == other["content"]
+        return NotImplemented
+
+    __hash__ = None
+
+    def __repr__(self):
+        return f"ChatMessage(role={self.role!r}, content={self.content!r})"
+
+
+_histories = weakref.WeakSet()
+_histories_lock = threading.Lock()
+
+
+class ChatHistory:
+    """A session's chat history, holding only the newest messages in memory.
+
+    Behaves like the list of messages it replaces: ``len()``, ``append()``,
+    indexing, slicing and iteration all cover the whole conversation. After
+    ``spill()`` the oldest messages live only in the transcript store; reading
+    them reloads them from there every time, without keeping them in memory,
+    so the chat path should stick to the in-memory tail and ``token_estimate``.
+    """
+
+    def __init__(self, messages=()):
+        from utils.context_window import estimate_tokens
+
+        self._messages = [ChatMessage.from_dict(m) for m in messages]
+        # Transcript indexes of the spilled messages, oldest first
+        self._spilled_indexes = []
+        self._source = None
+        # Running estimate over every message, spilled ones included
+        self._tokens = sum(estimate_tokens(m.content) for m in self._messages)
+        with _histories_lock:
+            _histories.add(self)
+
+    @classmethod
+    def from_transcript(cls, transcript):
+        """History rebuilt from a stored transcript document, in message order"""
+        stored = sorted((transcript or {}).get("messages", []), key=lambda m: m.get("message_index") or 0)
+        return cls(ChatMessage(m["message"]["role"], m["message"]["content"], m.get("message_index")) for m in stored)
+
+    @property
+    def in_memory(self):
+        return len(self._messages)
+
+    @property
+    def spilled(self):
+        return len(self._spilled_indexes)
+
+    def recent(self):
+        """The messages still in memory, newest last; never reloads spilled ones"""
+        return list(self._messages)
+
+    @property
+    def token_estimate(self):
+        """Rough token count of the whole conversation, without reloading spilled messages"""
+        return self._tokens
+
+    def __len__(self):
+        return len(self._spilled_indexes) + len(self._messages)
+
+    def __bool__(self):
+        return len(self) > 0
+
+    def append(self, message):
+        """Add a message; returns the stored ChatMessage so its message_index can be set once it is saved"""
+        from utils.context_window import estimate_tokens
+
+        message = ChatMessage.from_dict(message)
+        self._messages.append(message)
+        self._tokens += estimate_tokens(message.content)
+        return message
+
+    def __iter__(self):
+        if self._spilled_indexes:
+            yield from self._load_spilled()
+        yield from self._messages
+
+    def __getitem__(self, index):
+        spilled = len(self._spilled_indexes)
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            if step == 1 and start >= spilled:
+                return self._messages[start - spilled:max(start, stop) - spilled]
+            return list(self)[index]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("chat history index out of range")
+        if index >= spilled:
+            return self._messages[index - spilled]
+        return self._load_spilled()[index]
+
+    def spill(self, connection_string, session_key, keep=CHAT_HISTORY_IN_MEMORY):
+        """Drop all but the newest ``keep`` messages from memory; returns how many were dropped.
+
+        Only messages with a message_index the transcript writer has confirmed
+        as stored for this session are dropped, so everything dropped can be
+        reloaded by its index. A message that was never stored stays in
+        memory, along with everything after it.
+        """
+        from utils.transcript_writer import get_transcript_writer
+
+        excess = len(self._messages) - keep
+        if not keep or excess <= 0:
+            return 0
+        acked = get_transcript_writer(connection_string).acked_index(session_key)
+        if acked is None:
+            return 0
+        dropped = 0
+        for message in self._messages[:excess]:
+            if message.message_index is None or message.message_index > acked:
+                break
+            dropped += 1
+        if not dropped:
+            return 0
+        self._source = (connection_string, session_key)
+        self._spilled_indexes.extend(m.message_index for m in self._messages[:dropped])
+        del self._messages[:dropped]
+        return dropped
+
+    def _load_spilled(self):
+        # Not cached: a reloaded copy would put the whole conversation back in memory
+        from utils.mongodb import load_transcript
+
+        transcript = load_transcript(*self._source)
+        stored = {m.get("message_index"): m["message"] for m in (transcript or {}).get("messages", [])}
+        reloaded, missing = [], 0
+        for index in self._spilled_indexes:
+            message = stored.get(index)
+            if message is None:
+                # Keep positions aligned with the messages still in memory
+                missing += 1
+                reloaded.append(ChatMessage("assistant", "", index))
+            else:
+                reloaded.append(ChatMessage(message["role"], message["content"], index))
+        if missing:
+            logger.warning(f"{missing} of {len(reloaded)} spilled messages not found in the transcript")
+        return reloaded
+
+    def memory_bytes(self):
+        """Approximate bytes held by this history's messages"""
+        size = sys.getsizeof(self._messages) + sys.getsizeof(self._spilled_indexes)
+        size += sum(sys.getsizeof(m) + sys.getsizeof(m.content) for m in self._messages)
+        return size
+
+
+def estimate_size(value, _seen=None):
+    """Approximate deep size in bytes of a session state value"""
+    if _seen is None:
+        _seen = set()
+    if id(value) in _seen:
+        return 0
+    _seen.add(id(value))
+    if isinstance(value, ChatHistory):
+        return value.memory_bytes()
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        size += sum(estimate_size(k, _seen) + estimate_size(v, _seen) for k, v in value.items())
+    elif isinstance(value, (list, tuple, set, frozenset)):
+        size += sum(estimate_size(item, _seen) for item in value)
+    elif isinstance(value, ChatMessage):
+        size += estimate_size(value.content, _seen)
+    elif type(value).__module__.startswith("utils.") and hasattr(value, "__dict__"):
+        # Only this app's own objects; others may reference process-wide clients
+        size += estimate_size(vars(value), _seen)
+    return size
+
+def session_memory_report(state):
+    """Approximate bytes per session state entry, largest first, plus the total"""
+    report = {}
+    for key in list(state.keys()):
+        try:
+            report[str(key)] = estimate_size(state[key])
+        except Exception:
+            continue
+    report = dict(sorted(report.items(), key=lambda item: item[1], reverse=True))
+    report["total"] = sum(report.values())
+    return report
+
+def get_history_stats():
+    """Live histories in this process with their in-memory and spilled message counts"""
+    with _histories_lock:
+        histories = list(_histories)
+    return {
+        "sessions": len(histories),
+        "messages_in_memory": sum(h.in_memory for h in histories),
+        "messages_spilled": sum(h.spilled for h in histories),
+        "bytes_in_memory": sum(h.memory_bytes() for h in histories),
+    }
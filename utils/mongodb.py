@@ -1,180 +1,362 @@
-from pymongo import MongoClient
+from pymongo import MongoClient, ReturnDocument
 from pymongo.server_api import ServerApi
 from bson.objectid import ObjectId
 from datetime import datetime
+import atexit
+import os
+import threading
 import streamlit as st
 
+from utils.tracing import traced
+from utils.usage import usage_increments
+
+# Connection pool settings, overridable through the environment
+MONGO_MAX_POOL_SIZE = int(os.getenv("MONGODB_MAX_POOL_SIZE", "50"))
+MONGO_MIN_POOL_SIZE = int(os.getenv("MONGODB_MIN_POOL_SIZE", "0"))
+MONGO_MAX_IDLE_TIME_MS = int(os.getenv("MONGODB_MAX_IDLE_TIME_MS", "300000"))
+MONGO_CONNECT_TIMEOUT_MS = int(os.getenv("MONGODB_CONNECT_TIMEOUT_MS", "5000"))
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.getenv("MONGODB_SERVER_SELECTION_TIMEOUT_MS", "5000"))
+MONGO_SOCKET_TIMEOUT_MS = int(os.getenv("MONGODB_SOCKET_TIMEOUT_MS", "10000"))
+MONGO_COMPRESSORS = os.getenv("MONGODB_COMPRESSORS", "zlib")
+
+# Transcript storage layout: "document" keeps one document per session with
+# every message in it, "bucketed" keeps a header in sessions plus fixed-size
+# message buckets in transcript_buckets (see utils/transcript_buckets.py)
+TRANSCRIPT_LAYOUT = os.getenv("TRANSCRIPT_LAYOUT", "document")
+
+# One client per connection string, shared by every Streamlit session and rerun
+_clients = {}
+_clients_lock = threading.Lock()
+# Builds clients as factory(connection_string, **options); replaceable for benchmarks
+_client_factory = MongoClient
+# Per-process overrides merged over the defaults below; see set_mongo_client_options()
+_client_overrides = {}
+
+def set_mongo_client_factory(factory=None):
+    """Build future clients with ``factory`` (None restores MongoClient) and drop cached ones"""
+    global _client_factory
+    close_mongo_clients()
+    _client_factory = factory or MongoClient
+
+def set_mongo_client_options(**overrides):
+    """Override client options for this process (e.g. socketTimeoutMS=None) and drop cached clients
+
+    The defaults are tuned for the app's request path; offline scripts that run
+    long aggregations, migrations or index builds lift the socket timeout here.
+    """
+    close_mongo_clients()
+    _client_overrides.update(overrides)
+
 def get_mongo_client(connection_string):
-    return MongoClient(connection_string, server_api=ServerApi('1'))
+    """Return the process-wide pooled client for this connection string, creating it on first use"""
+    client = _clients.get(connection_string)
+    if client is not None:
+        return client
+    with _clients_lock:
+        client = _clients.get(connection_string)
+        if client is None:
+            options = {
+                "server_api": ServerApi('1'),
+                "maxPoolSize": MONGO_MAX_POOL_SIZE,
+                "minPoolSize": MONGO_MIN_POOL_SIZE,
+                "maxIdleTimeMS": MONGO_MAX_IDLE_TIME_MS,
+                "connectTimeoutMS": MONGO_CONNECT_TIMEOUT_MS,
+                "serverSelectionTimeoutMS": MONGO_SERVER_SELECTION_TIMEOUT_MS,
+                "socketTimeoutMS": MONGO_SOCKET_TIMEOUT_MS,
+                "retryWrites": True,
+            }
+            if MONGO_COMPRESSORS:
+                options["compressors"] = MONGO_COMPRESSORS
+            options.update(_client_overrides)
+            client = _client_factory(connection_string, **options)
+            _clients[connection_string] = client
+    return client
 
+def close_mongo_clients():
+    """Close every pooled client; registered to run at interpreter shutdown"""
+    with _clients_lock:
+        clients = list(_clients.values())
+        _clients.clear()
+    for client in clients:
+        try:
+            client.close()
+        except Exception:
+            pass
+
+atexit.register(close_mongo_clients)
+
+@traced("mongodb.check_identifier")
 def check_identifier(connection_string, identifier):
     """Check if the identifier exists in the valid_identifiers collection."""
     client = get_mongo_client(connection_string)
     db = client.rabbitbot
-    try:
-        result = db.valid_identifiers.find_one({"identifier": identifier})
-        return bool(result)
-    finally:
-        client.close()
+    result = db.valid_identifiers.find_one({"identifier": identifier})
+    return bool(result)
 
-def log_message(connection_string, conversation_type, message, message_index=None):
-    """Append a single message to the transcript document in real-time"""
+def make_session_key(user_identifier, session_id):
+    """Transcript key for a session; fixed when the session is created and never renamed"""
+    return f"{user_identifier}_{session_id}"
+
+def get_session_key():
+    """Return the transcript session key for the current Streamlit session"""
+    session_key = st.session_state.get("session_key")
+    if session_key:
+        return session_key
+    user_identifier = st.session_state.get("user_identifier", "anonymous")
+    session_id = st.session_state.get("session_id", "unknown_session")
+    return make_session_key(user_identifier, session_id)
+
+def get_session_header(conversation_type="rabbit_study"):
+    """Fields written once when a transcript document is first created"""
+    return {
+        "identifier": st.session_state.get("user_identifier", "anonymous"),
+        "session_id": st.session_state.get("session_id"),
+        "openai_conversation_id": st.session_state.get("openai_conversation_id"),
+        "conversation_type": conversation_type,
+        "prompt_version": st.session_state.get("current_prompt", "rabbit_v1"),
+        "prompt_hash": st.session_state.get("prompt_hash"),
+    }
+
+@traced("mongodb.set_conversation_id")
+def set_conversation_id(connection_string, session_key, conversation_id, header=None, conversation_type="rabbit_study"):
+    """Record the OpenAI conversation ID on a session's transcript with a single $set"""
+    db = get_mongo_client(connection_string).rabbitbot
+    collection = db.sessions if TRANSCRIPT_LAYOUT == "bucketed" else db.transcripts
+    now = datetime.utcnow()
+
+    # The transcript may not exist yet, so carry the header fields for the insert case
+    set_on_insert = {k: v for k, v in (header or {}).items()
+                     if k not in ("session_key", "conversation_type", "openai_conversation_id")}
+    set_on_insert["timestamp"] = now
+
+    collection.update_one(
+        {"session_key": session_key, "conversation_type": conversation_type},
+        {
+            "$set": {"openai_conversation_id": conversation_id, "last_updated": now},
+            "$setOnInsert": set_on_insert
+        },
+        upsert=True
+    )
+
+@traced("mongodb.append_message")
+def append_message(connection_string, session_key, message, message_index=None, header=None, conversation_type="rabbit_study",
+                   usage=None):
+    """Append a message to a transcript with a single atomic upsert and return the document id"""
     client = get_mongo_client(connection_string)
-    db = client.rabbitbot
-    collection = db.transcripts
+    collection = client.rabbitbot.transcripts
 
-    try:
-        if conversation_type == "rabbit_study":
-            user_identifier = st.session_state.get("user_identifier", "anonymous")
-            openai_conversation_id = st.session_state.get("openai_conversation_id")
-            
-            # Create a unique session key based on user identifier and OpenAI conversation ID
-            # Use session_id as fallback if openai_conversation_id is not available yet
-            session_id = st.session_state.get("session_id", "unknown_session")
-            session_key = f"{user_identifier}_{openai_conversation_id}" if openai_conversation_id else f"{user_identifier}_{session_id}"
-            
-            # Prepare the message with timestamp
-            message_with_timestamp = {
-                "message": message,
-                "timestamp": datetime.utcnow(),
-                "message_index": message_index
-            }
-            
-            # Try to find existing transcript for this session
-            existing_transcript = collection.find_one({
-                "session_key": session_key,
-                "conversation_type": "rabbit_study"
-            })
-            
-            if existing_transcript:
-                # Append message to existing transcript
-                result = collection.update_one(
-                    {"session_key": session_key, "conversation_type": "rabbit_study"},
-                    {
-                        "$push": {"messages": message_with_timestamp},
-                        "$set": {
-                            "last_updated": datetime.utcnow(),
-                            "message_count": existing_transcript.get("message_count", 0) + 1
-                        }
-                    }
-                )
-                return str(existing_transcript["_id"])
-            else:
-                # Create new transcript document
-                document = {
-                    "session_key": session_key,
-                    "timestamp": datetime.utcnow(),
-                    "last_updated": datetime.utcnow(),
-                    "messages": [message_with_timestamp],
-                    "identifier": user_identifier,
-                    "openai_conversation_id": openai_conversation_id,
-                    "conversation_type": "rabbit_study",
-                    "prompt_version": st.session_state.get("current_prompt", "rabbit_v1"),
-                    "message_count": 1
-                }
-                result = collection.insert_one(document)
-                return str(result.inserted_id)
-    finally:
-        client.close()
+    now = datetime.utcnow()
+    message_with_timestamp = {
+        "message": message,
+        "timestamp": now,
+        "message_index": message_index
+    }
+    if usage:
+        message_with_timestamp["usage"] = usage
+
+    if TRANSCRIPT_LAYOUT == "bucketed":
+        from utils.transcript_buckets import get_session_summary, replay_bucketed_events
+        replay_bucketed_events(connection_string, [{
+            "session_key": session_key,
+            "conversation_type": conversation_type,
+            "header": header or {},
+            "message": message_with_timestamp
+        }])
+        return str(get_session_summary(connection_string, session_key, conversation_type)["_id"])
+
+    # session_key and conversation_type are copied from the filter on insert
+    set_on_insert = {k: v for k, v in (header or {}).items() if k not in ("session_key", "conversation_type")}
+    set_on_insert["timestamp"] = now
 
-def log_transcript(connection_string, conversation_type, messages):
-    """Mark the conversation as completed - messages are already saved in real-time"""
+    document = collection.find_one_and_update(
+        {"session_key": session_key, "conversation_type": conversation_type},
+        {
+            "$push": {"messages": message_with_timestamp},
+            "$inc": {"message_count": 1, **usage_increments(usage)},
+            "$set": {"last_updated": now},
+            "$setOnInsert": set_on_insert
+        },
+        projection={"_id": 1},
+        upsert=True,
+        return_document=ReturnDocument.AFTER
+    )
+    return str(document["_id"])
+
+@traced("mongodb.log_message")
+def log_message(connection_string, conversation_type, message, message_index=None, usage=None):
+    """Append a single message to the transcript document in real-time"""
+    if conversation_type == "rabbit_study":
+        return append_message(
+            connection_string,
+            get_session_key(),
+            message,
+            message_index,
+            header=get_session_header(conversation_type),
+            conversation_type=conversation_type,
+            usage=usage
+        )
+
+@traced("mongodb.log_transcript")
+def log_transcript(connection_string, conversation_type, messages, flushed=True):
+    """Mark the conversation as completed - messages are already saved in real-time.
+
+    Pass ``flushed=False`` when queued messages may still be waiting in the
+    transcript journal: the transcript is then only marked complete, with an
+    idempotent upsert, and never rebuilt from ``messages``, since the journal
+    replay will add them.
+    """
     client = get_mongo_client(connection_string)
     db = client.rabbitbot
     collection = db.transcripts
 
-    try:
-        if conversation_type == "rabbit_study":
-            user_identifier = st.session_state.get("user_identifier", "anonymous")
-            openai_conversation_id = st.session_state.get("openai_conversation_id")
-            
-            # Create a unique session key based on user identifier and OpenAI conversation ID
-            # Use session_id as fallback if openai_conversation_id is not available yet
-            session_id = st.session_state.get("session_id", "unknown_session")
-            session_key = f"{user_identifier}_{openai_conversation_id}" if openai_conversation_id else f"{user_identifier}_{session_id}"
-            
-            # Find the existing transcript and mark it as completed
-            existing_transcript = collection.find_one({
-                "session_key": session_key,
-                "conversation_type": "rabbit_study"
-            })
-            
-            if existing_transcript:
-                # Mark conversation as completed
-                result = collection.update_one(
-                    {"session_key": session_key, "conversation_type": "rabbit_study"},
+    if conversation_type == "rabbit_study":
+        user_identifier = st.session_state.get("user_identifier", "anonymous")
+        openai_conversation_id = st.session_state.get("openai_conversation_id")
+        session_key = get_session_key()
+
+        if TRANSCRIPT_LAYOUT == "bucketed":
+            collection = db.sessions
+
+        if not flushed:
+            now = datetime.utcnow()
+            set_on_insert = {k: v for k, v in get_session_header(conversation_type).items()
+                             if k not in ("session_key", "conversation_type")}
+            set_on_insert["timestamp"] = now
+            result = collection.find_one_and_update(
+                {"session_key": session_key, "conversation_type": "rabbit_study"},
+                {"$set": {"conversation_completed": True, "completed_at": now, "last_updated": now},
+                 "$setOnInsert": set_on_insert},
+                projection={"_id": 1},
+                upsert=True,
+                return_document=ReturnDocument.AFTER
+            )
+            return str(result["_id"])
+
+        # Find the existing transcript and mark it as completed
+        existing_transcript = collection.find_one({
+            "session_key": session_key,
+            "conversation_type": "rabbit_study"
+        })
+        
+        if existing_transcript:
+            # Mark conversation as completed
+            result = collection.update_one(
+                {"session_key": session_key, "conversation_type": "rabbit_study"},
+                {
+                    "$set": {
+                        "conversation_completed": True,
+                        "completed_at": datetime.utcnow(),
+                        "last_updated": datetime.utcnow()
+                    }
+                }
+            )
+            return str(existing_transcript["_id"])
+        else:
+            if TRANSCRIPT_LAYOUT == "bucketed":
+                # Fallback: write the session header and buckets from the in-memory history
+                from utils.transcript_buckets import replay_bucketed_events
+                replay_bucketed_events(connection_string, [
                     {
-                        "$set": {
-                            "conversation_completed": True,
-                            "completed_at": datetime.utcnow(),
-                            "last_updated": datetime.utcnow()
-                        }
+                        "session_key": session_key,
+                        "conversation_type": "rabbit_study",
+                        "header": get_session_header(conversation_type),
+                        "message": {"message": dict(msg), "timestamp": datetime.utcnow(), "message_index": i}
                     }
+                    for i, msg in enumerate(messages)
+                ])
+                result = collection.find_one_and_update(
+                    {"session_key": session_key, "conversation_type": "rabbit_study"},
+                    {"$set": {"conversation_completed": True, "completed_at": datetime.utcnow()}},
+                    projection={"_id": 1},
+                    upsert=True,
+                    return_document=ReturnDocument.AFTER
                 )
-                return str(existing_transcript["_id"])
-            else:
-                # Fallback: create a new document if somehow no transcript exists
-                document = {
-                    "session_key": session_key,
-                    "timestamp": datetime.utcnow(),
-                    "last_updated": datetime.utcnow(),
-                    "messages": [{"message": msg, "timestamp": datetime.utcnow(), "message_index": i} for i, msg in enumerate(messages)],
-                    "identifier": user_identifier,
-                    "openai_conversation_id": openai_conversation_id,
-                    "conversation_type": "rabbit_study",
-                    "prompt_version": st.session_state.get("current_prompt", "rabbit_v1"),
-                    "message_count": len(messages),
-                    "conversation_completed": True,
-                    "completed_at": datetime.utcnow()
-                }
-                result = collection.insert_one(document)
-                return str(result.inserted_id)
-    finally:
-        client.close()
+                return str(result["_id"])
 
+            # Fallback: create a new document if somehow no transcript exists
+            document = {
+                "session_key": session_key,
+                "timestamp": datetime.utcnow(),
+                "last_updated": datetime.utcnow(),
+                "messages": [{"message": dict(msg), "timestamp": datetime.utcnow(), "message_index": i} for i, msg in enumerate(messages)],
+                "identifier": user_identifier,
+                "openai_conversation_id": openai_conversation_id,
+                "conversation_type": "rabbit_study",
+                "prompt_version": st.session_state.get("current_prompt", "rabbit_v1"),
+                "message_count": len(messages),
+                "conversation_completed": True,
+                "completed_at": datetime.utcnow()
+            }
+            result = collection.insert_one(document)
+            return str(result.inserted_id)
+
+@traced("mongodb.update_session_key")
 def update_session_key(connection_string, old_session_key, new_session_key, conversation_type="rabbit_study"):
-    """Update session key when OpenAI conversation ID becomes available"""
+    """Move a transcript to a new session key, merging into any existing transcript.
+
+    No longer used by the app, whose session keys never change; kept for
+    offline maintenance of transcripts written under the old key scheme.
+    """
+    if TRANSCRIPT_LAYOUT == "bucketed":
+        from utils.transcript_buckets import rename_bucketed_session
+        return rename_bucketed_session(connection_string, old_session_key, new_session_key, conversation_type)
+
     client = get_mongo_client(connection_string)
     db = client.rabbitbot
     collection = db.transcripts
 
-    try:
-        # Find transcript with old session key
-        old_transcript = collection.find_one({
-            "session_key": old_session_key,
+    # Find transcript with old session key
+    old_transcript = collection.find_one({
+        "session_key": old_session_key,
+        "conversation_type": conversation_type
+    })
+    
+    if old_transcript:
+        # Check if transcript with new session key already exists
+        new_transcript = collection.find_one({
+            "session_key": new_session_key,
             "conversation_type": conversation_type
         })
         
-        if old_transcript:
-            # Check if transcript with new session key already exists
-            new_transcript = collection.find_one({
-                "session_key": new_session_key,
-                "conversation_type": conversation_type
-            })
-            
-            if new_transcript:
-                # Merge messages from old transcript to new transcript
-                result = collection.update_one(
-                    {"session_key": new_session_key, "conversation_type": conversation_type},
-                    {
-                        "$push": {"messages": {"$each": old_transcript.get("messages", [])}},
-                        "$set": {
-                            "last_updated": datetime.utcnow(),
-                            "message_count": new_transcript.get("message_count", 0) + len(old_transcript.get("messages", []))
-                        }
+        if new_transcript:
+            # Merge messages from old transcript to new transcript
+            result = collection.update_one(
+                {"session_key": new_session_key, "conversation_type": conversation_type},
+                {
+                    "$push": {"messages": {"$each": old_transcript.get("messages", [])}},
+                    "$set": {
+                        "last_updated": datetime.utcnow(),
+                        "message_count": new_transcript.get("message_count", 0) + len(old_transcript.get("messages", []))
                     }
-                )
-                # Delete old transcript
-                collection.delete_one({"_id": old_transcript["_id"]})
-                return str(new_transcript["_id"])
-            else:
-                # Update session key in existing transcript
-                result = collection.update_one(
-                    {"_id": old_transcript["_id"]},
-                    {"$set": {"session_key": new_session_key}}
-                )
-                return str(old_transcript["_id"])
-        
-        return None
-    finally:
-        client.close()
\ No newline at end of file
+                }
+            )
+            # Delete old transcript
+            collection.delete_one({"_id": old_transcript["_id"]})
+            return str(new_transcript["_id"])
+        else:
+            # Update session key in existing transcript
+            result = collection.update_one(
+                {"_id": old_transcript["_id"]},
+                {"$set": {"session_key": new_session_key}}
+            )
+            return str(old_transcript["_id"])
+    
+    return None
+
+@traced("mongodb.get_transcript_summary")
+def get_transcript_summary(connection_string, session_key, conversation_type="rabbit_study"):
+    """Return a session's transcript metadata without its messages, for either layout"""
+    if TRANSCRIPT_LAYOUT == "bucketed":
+        from utils.transcript_buckets import get_session_summary
+        return get_session_summary(connection_string, session_key, conversation_type)
+    collection = get_mongo_client(connection_string).rabbitbot.transcripts
+    return collection.find_one({"session_key": session_key, "conversation_type": conversation_type}, {"messages": 0})
+
+@traced("mongodb.load_transcript")
+def load_transcript(connection_string, session_key, conversation_type="rabbit_study"):
+    """Return a session's full transcript, including messages in order, for either layout"""
+    if TRANSCRIPT_LAYOUT == "bucketed":
+        from utils.transcript_buckets import load_bucketed_transcript
+        return load_bucketed_transcript(connection_string, session_key, conversation_type)
+    collection = get_mongo_client(connection_string).rabbitbot.transcripts
+    return collection.find_one({"session_key": session_key, "conversation_type": conversation_type})
@@ -0,0 +1,98 @@
+from openai import DefaultHttpxClient, OpenAI
+import httpx
+import importlib.util
+import os
+import threading
+
+# HTTP client settings, overridable through the environment
+OPENAI_MAX_CONNECTIONS = int(os.getenv("OPENAI_MAX_CONNECTIONS", "100"))
+OPENAI_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("OPENAI_MAX_KEEPALIVE_CONNECTIONS", "20"))
+OPENAI_KEEPALIVE_EXPIRY = float(os.getenv("OPENAI_KEEPALIVE_EXPIRY", "120"))
+OPENAI_CONNECT_TIMEOUT = float(os.getenv("OPENAI_CONNECT_TIMEOUT", "5"))
+OPENAI_READ_TIMEOUT = float(os.getenv("OPENAI_READ_TIMEOUT", "60"))
+OPENAI_MAX_RETRIES = int(os.getenv("OPENAI_MAX_RETRIES", "2"))
+# HTTP/2 needs the optional h2 package (pip install "httpx[http2]")
+OPENAI_HTTP2 = os.getenv("OPENAI_HTTP2", "auto").lower()
+
+
+class ConnectionStats:
+    """Counts requests against new TCP connections and TLS handshakes via httpx tracing"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.tcp_connects = 0
+        self.tls_handshakes = 0
+        self.http2_requests = 0
+
+    def on_request(self, request):
+        with self._lock:
+            self.requests += 1
+        request.extensions["trace"] = self._trace
+
+    def _trace(self, event_name, info):
+        if event_name == "connection.connect_tcp.complete":
+            with self._lock:
+                self.tcp_connects += 1
+        elif event_name == "connection.start_tls.complete":
+            with self._lock:
+                self.tls_handshakes += 1
+        elif event_name == "http2.send_request_headers.started":
+            with self._lock:
+                self.http2_requests += 1
+
+    def snapshot(self):
+        with self._lock:
+            requests, connects = self.requests, self.tcp_connects
+            return {
+                "requests": requests,
+                "tcp_connects": connects,
+                "tls_handshakes": self.tls_handshakes,
+                "http2_requests": self.http2_requests,
+                # Share of requests that went out on an already-open connection
+                "connection_reuse_rate": (requests - connects) / requests if requests else 0.0,
+            }
+
+
+_stats = ConnectionStats()
+_clients = {}
+_clients_lock = threading.Lock()
+
+def _http2_enabled():
+    if OPENAI_HTTP2 in ("1", "true", "yes"):
+        return True
+    if OPENAI_HTTP2 in ("0", "false", "no"):
+        return False
+    return importlib.util.find_spec("h2") is not None
+
+def get_openai_client(api_key, base_url=None):
+    """Return the process-wide OpenAI client for this key, shared across sessions and reruns"""
+    key = (api_key, base_url)
+    client = _clients.get(key)
+    if client is not None:
+        return client
+    with _clients_lock:
+        client = _clients.get(key)
+        if client is None:
+            http_client = DefaultHttpxClient(
+                http2=_http2_enabled(),
+                limits=httpx.Limits(
+                    max_connections=OPENAI_MAX_CONNECTIONS,
+                    max_keepalive_connections=OPENAI_MAX_KEEPALIVE_CONNECTIONS,
+                    keepalive_expiry=OPENAI_KEEPALIVE_EXPIRY,
+                ),
+                timeout=httpx.Timeout(OPENAI_READ_TIMEOUT, connect=OPENAI_CONNECT_TIMEOUT),
+                event_hooks={"request": [_stats.on_request]},
+            )
+            client = OpenAI(
+                api_key=api_key,
+                base_url=base_url,
+                http_client=http_client,
+                max_retries=OPENAI_MAX_RETRIES,
+            )
+            _clients[key] = client
+    return client
+
+def get_connection_stats():
+    """Process-wide request, connection and handshake counters for the OpenAI clients"""
+    return _stats.snapshot()
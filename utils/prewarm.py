@@ -0,0 +1,61 @@
+from concurrent.futures import ThreadPoolExecutor
+import logging
+import os
+
+from utils.mongodb import make_session_key, set_conversation_id
+from utils.rate_limit import limited_call
+
+logger = logging.getLogger(__name__)
+
+# Prewarm settings, overridable through the environment
+PREWARM_WORKERS = int(os.getenv("PREWARM_WORKERS", "4"))
+PREWARM_WAIT = float(os.getenv("PREWARM_WAIT", "15"))
+
+GREETING = "Hi, I am Rabbit! What is your name?"
+
+_executor = ThreadPoolExecutor(max_workers=PREWARM_WORKERS, thread_name_prefix="session-prewarm")
+
+
+def create_conversation(client, identifier, session_id):
+    """Create the OpenAI conversation for a study session, seeded with Rabbit's greeting"""
+    return limited_call(session_id, 0, lambda: client.conversations.create(
+        items=[
+            {
+                "type": "message",
+                "role": "assistant",
+                "content": GREETING
+            }
+        ],
+        metadata={
+            "user_identifier": identifier or "unknown",
+            "session_type": "economics_study"
+        }
+    ))
+
+def prewarm_session(client, connection_string, identifier, session_id, header):
+    """Create the conversation and transcript header for a session.
+
+    Returns the conversation ID and whether it was saved with the header.
+    Both calls also open the pooled OpenAI and MongoDB connections, so the
+    first chat turn does not pay for connection setup either.
+    """
+    conversation = create_conversation(client, identifier, session_id)
+    try:
+        set_conversation_id(connection_string, make_session_key(identifier, session_id), conversation.id, header=header)
+    except Exception as e:
+        # The caller saves the conversation ID again when it adopts this session
+        logger.warning(f"Prewarm could not write the transcript header for {session_id}: {e}")
+        return conversation.id, False
+    return conversation.id, True
+
+def start_prewarm(client, connection_string, identifier, session_id, header):
+    """Run prewarm_session in the background and return its Future"""
+    return _executor.submit(prewarm_session, client, connection_string, identifier, session_id, header)
+
+def adopt_prewarm(future, timeout=PREWARM_WAIT):
+    """(conversation ID, saved) from a prewarm; the ID is None if it failed or did not finish in time"""
+    try:
+        return future.result(timeout)
+    except Exception as e:
+        logger.warning(f"Prewarmed conversation unavailable, creating one now: {e!r}")
+        return None, False
@@ -0,0 +1,175 @@
+from dataclasses import dataclass
+import glob
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+
+from utils.hints import HintIndex, parse_hints
+
+PROMPTS_DIR = "prompts"
+DEFAULT_PROMPT_VERSION = "rabbit_v5"
+DEFAULT_PROBLEM_ID = "tax_in_a_perfectly_competitive_industry"
+
+# How often cached entries re-check their source files for changes
+PROMPT_RELOAD_CHECK_INTERVAL = float(os.getenv("PROMPT_RELOAD_CHECK_INTERVAL", "2"))
+
+_VERSION_PATTERN = re.compile(r"^rabbit(_v\d+)?$")
+
+
+@dataclass(frozen=True)
+class ProblemBundle:
+    """A problem statement with its worked solution and supporting files"""
+    problem_id: str
+    title: str
+    problem: str
+    solution: str
+    figure: str = None
+    hints: str = None
+
+
+@dataclass(frozen=True)
+class Instructions:
+    """Prebuilt model instructions for one prompt version and problem"""
+    version: str
+    problem_id: str
+    text: str
+    sha256: str
+
+
+def _signature(paths):
+    signature = []
+    for path in paths:
+        try:
+            stat = os.stat(path)
+            signature.append((path, stat.st_mtime_ns, stat.st_size))
+        except FileNotFoundError:
+            signature.append((path, None, None))
+    return tuple(signature)
+
+def _read(path):
+    with open(path, 'r') as file:
+        return file.read()
+
+
+class PromptRegistry:
+    """Process-wide registry of Rabbit persona prompts and problem bundles.
+
+    Persona prompts are the ``prompts/rabbit*.md`` files, keyed by file
+    name (``rabbit_v5``). Problem bundles live in ``prompts/problems/<id>/``
+    as ``problem.md``, ``solution.md`` and ``bundle.json``, which can name a
+    hint file. Everything is read
+    once and rebuilt only when a source file's mtime or size changes, so
+    every session shares the same immutable instruction strings.
+    """
+
+    def __init__(self, prompts_dir=PROMPTS_DIR, check_interval=PROMPT_RELOAD_CHECK_INTERVAL):
+        self.prompts_dir = prompts_dir
+        self.check_interval = check_interval
+        # Re-entrant because building instructions loads the persona and problem entries
+        self._lock = threading.RLock()
+        self._cache = {}
+
+    def versions(self):
+        """All available persona prompt versions, e.g. ['rabbit', 'rabbit_v1', ...]"""
+        names = [os.path.splitext(os.path.basename(p))[0] for p in glob.glob(os.path.join(self.prompts_dir, "rabbit*.md"))]
+        return sorted(n for n in names if _VERSION_PATTERN.match(n))
+
+    def problem_ids(self):
+        """All problem bundles under prompts/problems"""
+        return sorted(
+            os.path.basename(os.path.dirname(p))
+            for p in glob.glob(os.path.join(self.prompts_dir, "problems", "*", "problem.md"))
+        )
+
+    def persona_path(self, version):
+        if not _VERSION_PATTERN.match(version):
+            raise ValueError(f"Unknown prompt version: {version}")
+        return os.path.join(self.prompts_dir, f"{version}.md")
+
+    def problem_paths(self, problem_id):
+        directory = os.path.join(self.prompts_dir, "problems", problem_id)
+        return [os.path.join(directory, name) for name in ("problem.md", "solution.md", "bundle.json")]
+
+    def get_persona(self, version=DEFAULT_PROMPT_VERSION):
+        """Raw persona prompt text for a version"""
+        path = self.persona_path(version)
+        return self._cached(("persona", version), [path], lambda: _read(path))
+
+    def get_problem(self, problem_id=DEFAULT_PROBLEM_ID):
+        """The problem bundle for a problem id"""
+        problem_path, solution_path, meta_path = self.problem_paths(problem_id)
+
+        def build():
+            meta = json.loads(_read(meta_path)) if os.path.exists(meta_path) else {}
+            return ProblemBundle(
+                problem_id=problem_id,
+                title=meta.get("title", problem_id.replace("_", " ").title()),
+                problem=_read(problem_path),
+                solution=_read(solution_path),
+                figure=meta.get("figure"),
+                hints=meta.get("hints"),
+            )
+
+        return self._cached(("problem", problem_id), [problem_path, solution_path, meta_path], build)
+
+    def get_hints(self, problem_id=DEFAULT_PROBLEM_ID):
+        """The parsed hint index for a problem, from the hint file named in its bundle"""
+        problem = self.get_problem(problem_id)
+        if not problem.hints:
+            return HintIndex(problem_id=problem_id, source=None)
+        path = problem.hints
+        return self._cached(("hints", problem_id, path), [path], lambda: parse_hints(_read(path), problem_id, path))
+
+    def get_instructions(self, version=DEFAULT_PROMPT_VERSION, problem_id=DEFAULT_PROBLEM_ID):
+        """Persona prompt followed by the problem and its solution, with a content hash"""
+        paths = [self.persona_path(version)] + self.problem_paths(problem_id)
+
+        def build():
+            problem = self.get_problem(problem_id)
+            text = (self.get_persona(version)
+                    + "\n\n## The Economics Problem\n" + problem.problem
+                    + "\n\n## The Solution\n" + problem.solution)
+            return Instructions(
+                version=version,
+                problem_id=problem_id,
+                text=text,
+                sha256=hashlib.sha256(text.encode("utf-8")).hexdigest(),
+            )
+
+        return self._cached(("instructions", version, problem_id), paths, build)
+
+    def _cached(self, key, paths, build):
+        now = time.monotonic()
+        entry = self._cache.get(key)
+        if entry is not None and now - entry["checked_at"] < self.check_interval:
+            return entry["value"]
+
+        signature = _signature(paths)
+        if entry is not None and entry["signature"] == signature:
+            entry["checked_at"] = now
+            return entry["value"]
+
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry is not None and entry["signature"] == signature:
+                entry["checked_at"] = now
+                return entry["value"]
+            value = build()
+            self._cache[key] = {"value": value, "signature": signature, "checked_at": now}
+            return value
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+def get_prompt_registry():
+    """Return the process-wide prompt registry"""
+    global _registry
+    if _registry is None:
+        with _registry_lock:
+            if _registry is None:
+                _registry = PromptRegistry()
+    return _registry
@@ -0,0 +1,263 @@
+from collections import OrderedDict, deque
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
+import logging
+import os
+import random
+import threading
+import time
+
+from openai import RateLimitError
+
+logger = logging.getLogger(__name__)
+
+# Admission settings, overridable through the environment
+OPENAI_MAX_IN_FLIGHT = int(os.getenv("OPENAI_MAX_IN_FLIGHT", "32"))
+# Set to the organisation's tokens-per-minute limit; 0 disables the token budget
+OPENAI_TOKENS_PER_MINUTE = int(os.getenv("OPENAI_TOKENS_PER_MINUTE", "0"))
+OPENAI_ADMISSION_TIMEOUT = float(os.getenv("OPENAI_ADMISSION_TIMEOUT", "60"))
+OPENAI_RATE_LIMIT_RETRIES = int(os.getenv("OPENAI_RATE_LIMIT_RETRIES", "4"))
+OPENAI_BACKOFF_BASE = float(os.getenv("OPENAI_BACKOFF_BASE", "0.5"))
+OPENAI_BACKOFF_MAX = float(os.getenv("OPENAI_BACKOFF_MAX", "20"))
+
+
+class AdmissionTimeout(Exception):
+    """Raised when a request waited longer than the admission timeout for a slot"""
+
+
+class Permit:
+    """An admitted request; releasing it frees its slot and settles its token estimate.
+
+    Set ``actual_tokens`` before release once the real usage is known so the
+    token budget is corrected by the difference from the estimate.
+    """
+
+    def __init__(self, controller, session, tokens, waited):
+        self.controller = controller
+        self.session = session
+        self.tokens = tokens
+        self.waited = waited
+        self.actual_tokens = None
+        self._released = False
+
+    def release(self):
+        if not self._released:
+            self._released = True
+            self.controller._release(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.release()
+
+
+class AdmissionController:
+    """Process-wide gate in front of every OpenAI request.
+
+    A request is admitted once fewer than ``max_in_flight`` requests are
+    running and, when ``tokens_per_minute`` is set, the token bucket holds
+    its estimated tokens. Waiting requests are served round-robin across
+    sessions, so one session's backlog cannot starve the others. After a 429
+    ``pause()`` holds back all new admissions for the server's Retry-After.
+    """
+
+    def __init__(self, max_in_flight=OPENAI_MAX_IN_FLIGHT, tokens_per_minute=OPENAI_TOKENS_PER_MINUTE,
+                 timeout=OPENAI_ADMISSION_TIMEOUT):
+        self.max_in_flight = max_in_flight
+        self.tokens_per_minute = tokens_per_minute
+        self.timeout = timeout
+        self._cond = threading.Condition()
+        # session -> FIFO of waiting tickets; the first session's first ticket is next
+        self._queues = OrderedDict()
+        self._in_flight = 0
+        self._tokens = float(tokens_per_minute)
+        self._refilled_at = time.monotonic()
+        self._paused_until = 0.0
+        self._stats = {
+            "admitted": 0,
+            "queued": 0,
+            "timeouts": 0,
+            "rate_limited": 0,
+            "total_wait": 0.0,
+            "max_wait": 0.0,
+        }
+
+    def acquire(self, session, tokens=0, on_queued=None, timeout=None):
+        """Wait for a slot and return a Permit; ``on_queued`` is called once if the request has to wait"""
+        timeout = self.timeout if timeout is None else timeout
+        started = time.monotonic()
+        deadline = started + timeout
+        ticket = object()
+        with self._cond:
+            self._queues.setdefault(session, deque()).append(ticket)
+            wait = self._try_admit(session, ticket, tokens)
+        if wait == 0:
+            return self._permit(session, tokens, started)
+
+        with self._cond:
+            self._stats["queued"] += 1
+        if on_queued is not None:
+            try:
+                on_queued()
+            except BaseException:
+                # Never leave an abandoned ticket at the head of the queue
+                with self._cond:
+                    self._remove(session, ticket)
+                    self._cond.notify_all()
+                raise
+
+        with self._cond:
+            while True:
+                wait = self._try_admit(session, ticket, tokens)
+                if wait == 0:
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._remove(session, ticket)
+                    self._stats["timeouts"] += 1
+                    self._cond.notify_all()
+                    raise AdmissionTimeout(f"No OpenAI request slot within {timeout:g}s")
+                self._cond.wait(remaining if wait is None else min(wait, remaining))
+        return self._permit(session, tokens, started)
+
+    def pause(self, seconds):
+        """Hold back new admissions for ``seconds``, e.g. after a 429 with Retry-After"""
+        with self._cond:
+            self._stats["rate_limited"] += 1
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    def snapshot(self):
+        """In-flight and queued requests, token budget and counters for monitoring"""
+        with self._cond:
+            now = time.monotonic()
+            self._refill(now)
+            admitted = self._stats["admitted"]
+            return {
+                "in_flight": self._in_flight,
+                "waiting": sum(len(queue) for queue in self._queues.values()),
+                "sessions_waiting": len(self._queues),
+                "tokens_available": round(self._tokens) if self.tokens_per_minute else None,
+                "paused_for": max(0.0, self._paused_until - now),
+                "avg_wait": self._stats["total_wait"] / admitted if admitted else 0.0,
+                **self._stats,
+            }
+
+    def _refill(self, now):
+        if self.tokens_per_minute:
+            self._tokens = min(self.tokens_per_minute,
+                               self._tokens + (now - self._refilled_at) * self.tokens_per_minute / 60)
+        self._refilled_at = now
+
+    def _try_admit(self, session, ticket, tokens):
+        """Admit the ticket if it is next and capacity allows; returns 0, seconds to wait, or None"""
+        head = next(iter(self._queues.values()))[0]
+        if head is not ticket:
+            return None
+        now = time.monotonic()
+        if now < self._paused_until:
+            return self._paused_until - now
+        if self._in_flight >= self.max_in_flight:
+            return None
+        if self.tokens_per_minute:
+            self._refill(now)
+            # A request larger than the whole bucket goes once the bucket is full
+            needed = min(tokens, self.tokens_per_minute)
+            if self._tokens < needed:
+                return (needed - self._tokens) * 60 / self.tokens_per_minute
+            self._tokens -= tokens
+        self._in_flight += 1
+        self._remove(session, ticket)
+        if session in self._queues:
+            # Round-robin: the session's next request waits behind the other sessions
+            self._queues.move_to_end(session)
+        self._cond.notify_all()
+        return 0
+
+    def _remove(self, session, ticket):
+        queue = self._queues.get(session)
+        if queue is None:
+            return
+        queue.remove(ticket)
+        if not queue:
+            del self._queues[session]
+
+    def _permit(self, session, tokens, started):
+        waited = time.monotonic() - started
+        with self._cond:
+            self._stats["admitted"] += 1
+            self._stats["total_wait"] += waited
+            self._stats["max_wait"] = max(self._stats["max_wait"], waited)
+        return Permit(self, session, tokens, waited)
+
+    def _release(self, permit):
+        with self._cond:
+            self._in_flight -= 1
+            if self.tokens_per_minute and permit.actual_tokens is not None:
+                self._refill(time.monotonic())
+                self._tokens = min(self.tokens_per_minute, self._tokens + permit.tokens - permit.actual_tokens)
+            self._cond.notify_all()
+
+
+def retry_after_seconds(error):
+    """Seconds the server asked us to wait in a 429 response, or None"""
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+    headers = response.headers
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+        value = headers.get("retry-after")
+        if not value:
+            return None
+        try:
+            return float(value)
+        except ValueError:
+            return max(0.0, (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
+def backoff_delay(attempt, retry_after=None, base=OPENAI_BACKOFF_BASE, cap=OPENAI_BACKOFF_MAX):
+    """Full-jitter exponential backoff, never shorter than the server's Retry-After"""
+    delay = random.uniform(0, min(cap, base * 2 ** attempt))
+    if retry_after is not None:
+        # Spread the retries of everyone who got the same Retry-After
+        delay = retry_after + random.uniform(0, base)
+    return delay
+
+def call_with_backoff(fn, controller=None, retries=OPENAI_RATE_LIMIT_RETRIES):
+    """Call ``fn``, retrying 429s with jittered backoff and pausing admissions meanwhile"""
+    controller = controller or get_admission_controller()
+    attempt = 0
+    while True:
+        try:
+            return fn()
+        except RateLimitError as e:
+            # An exhausted quota will not recover by waiting
+            if attempt >= retries or getattr(e, "code", None) == "insufficient_quota":
+                raise
+            delay = backoff_delay(attempt, retry_after_seconds(e))
+            controller.pause(delay)
+            logger.info(f"OpenAI rate limited, retrying in {delay:.1f}s (attempt {attempt + 1}/{retries})")
+            time.sleep(delay)
+            attempt += 1
+
+def limited_call(session, tokens, fn, timeout=None):
+    """Run a non-streaming OpenAI call under admission control with 429 backoff"""
+    controller = get_admission_controller()
+    with controller.acquire(session, tokens, timeout=timeout):
+        return call_with_backoff(fn, controller)
+
+
+_controller = None
+_controller_lock = threading.Lock()
+
+def get_admission_controller():
+    """Return the process-wide admission controller"""
+    global _controller
+    if _controller is None:
+        with _controller_lock:
+            if _controller is None:
+                _controller = AdmissionController()
+    return _controller
@@ -0,0 +1,118 @@
+from pymongo import ASCENDING, DESCENDING
+from pymongo.errors import OperationFailure
+import logging
+import threading
+
+from utils.mongodb import get_mongo_client
+from utils.session_store import SESSION_STATE_TTL
+
+logger = logging.getLogger(__name__)
+
+# Server error raised when an index with the same keys exists with other options
+INDEX_OPTIONS_CONFLICT = 85
+
+# (collection, keys, options) for every index the app relies on
+INDEXES = [
+    ("transcripts", [("session_key", ASCENDING), ("conversation_type", ASCENDING)],
+     {"name": "session_key_conversation_type", "unique": True}),
+    ("transcripts", [("identifier", ASCENDING)], {"name": "identifier"}),
+    ("transcripts", [("timestamp", DESCENDING)], {"name": "timestamp"}),
+    ("transcripts", [("prompt_version", ASCENDING), ("timestamp", DESCENDING)], {"name": "prompt_version_timestamp"}),
+    ("valid_identifiers", [("identifier", ASCENDING)], {"name": "identifier", "unique": True}),
+    # Bucketed transcript layout
+    ("sessions", [("session_key", ASCENDING), ("conversation_type", ASCENDING)],
+     {"name": "session_key_conversation_type", "unique": True}),
+    ("sessions", [("identifier", ASCENDING)], {"name": "identifier"}),
+    ("sessions", [("prompt_version", ASCENDING), ("timestamp", DESCENDING)], {"name": "prompt_version_timestamp"}),
+    ("transcript_buckets", [("session_key", ASCENDING), ("conversation_type", ASCENDING), ("bucket", ASCENDING)],
+     {"name": "session_key_conversation_type_bucket", "unique": True}),
+    # Session snapshots are looked up by _id; this only expires stale ones
+    ("session_state", [("updated_at", ASCENDING)], {"name": "updated_at_ttl", "expireAfterSeconds": SESSION_STATE_TTL}),
+]
+
+# Queries issued on every chat turn, checked by explain_hot_queries()
+HOT_QUERIES = [
+    ("valid_identifiers", "check_identifier", {"identifier": "RABBIT00000"}),
+    ("transcripts", "append_message", {"session_key": "explain_session", "conversation_type": "rabbit_study"}),
+    ("transcripts", "replay_events", {"session_key": "explain_session", "conversation_type": "rabbit_study",
+                                      "messages.message_index": {"$ne": 0}}),
+    ("sessions", "get_session_summary", {"session_key": "explain_session", "conversation_type": "rabbit_study"}),
+    ("transcript_buckets", "replay_bucketed_events", {"session_key": "explain_session", "conversation_type": "rabbit_study",
+                                                      "bucket": 0, "messages.message_index": {"$ne": 0}}),
+]
+
+
+def ensure_indexes(connection_string):
+    """Create every index in INDEXES if it is missing; safe to run repeatedly.
+
+    If a unique index cannot be built because existing documents contain
+    duplicates, a non-unique index on the same keys is created instead so
+    queries are still served from an index, and the problem is logged.
+    A TTL index that already exists with a different ``expireAfterSeconds``
+    is updated in place with ``collMod``.
+    """
+    db = get_mongo_client(connection_string).rabbitbot
+    created = []
+    for collection_name, keys, options in INDEXES:
+        collection = db[collection_name]
+        try:
+            created.append(f"{collection_name}.{collection.create_index(keys, **options)}")
+        except OperationFailure as e:
+            if e.code == INDEX_OPTIONS_CONFLICT and "expireAfterSeconds" in options:
+                db.command("collMod", collection_name,
+                           index={"keyPattern": dict(keys), "expireAfterSeconds": options["expireAfterSeconds"]})
+                logger.info(f"Updated {collection_name} TTL index to expire after {options['expireAfterSeconds']} seconds")
+                created.append(f"{collection_name}.{options['name']}")
+                continue
+            if not options.get("unique"):
+                raise
+            logger.warning(f"Could not create unique index {options['name']} on {collection_name}, "
+                           f"falling back to non-unique: {e}")
+            fallback = dict(options, unique=False, name=f"{options['name']}_nonunique")
+            created.append(f"{collection_name}.{collection.create_index(keys, **fallback)}")
+    return created
+
+def _plan_stages(plan):
+    stages = [plan.get("stage")]
+    for child_key in ("inputStage", "queryPlan"):
+        if child_key in plan:
+            stages.extend(_plan_stages(plan[child_key]))
+    for child in plan.get("inputStages", []):
+        stages.extend(_plan_stages(child))
+    return [s for s in stages if s]
+
+def explain_hot_queries(connection_string):
+    """Return the winning plan for each of the app's hot queries"""
+    db = get_mongo_client(connection_string).rabbitbot
+    report = []
+    for collection_name, label, query in HOT_QUERIES:
+        explanation = db[collection_name].find(query).limit(1).explain()
+        winning_plan = explanation.get("queryPlanner", {}).get("winningPlan", {})
+        stages = _plan_stages(winning_plan)
+        report.append({
+            "collection": collection_name,
+            "query": label,
+            "stages": stages,
+            "uses_index": "IXSCAN" in stages or "IDHACK" in stages or "EXPRESS_IXSCAN" in stages,
+            "collection_scan": "COLLSCAN" in stages,
+        })
+    return report
+
+
+_bootstrapped = set()
+_bootstrap_lock = threading.Lock()
+
+def bootstrap_indexes_once(connection_string):
+    """Run ensure_indexes() in the background the first time a process sees this connection string"""
+    with _bootstrap_lock:
+        if connection_string in _bootstrapped:
+            return
+        _bootstrapped.add(connection_string)
+
+    def run():
+        try:
+            ensure_indexes(connection_string)
+        except Exception as e:
+            logger.warning(f"Index bootstrap failed: {e}")
+
+    threading.Thread(target=run, name="index-bootstrap", daemon=True).start()
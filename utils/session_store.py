@@ -0,0 +1,153 @@
+from datetime import datetime
+import copy
+import os
+import threading
+
+import streamlit as st
+
+from utils.message_store import ChatHistory
+from utils.mongodb import get_mongo_client, load_transcript, make_session_key
+
+# "mongo" shares snapshots across replicas, "memory" keeps them in this
+# process (tests, single replica), "off" disables snapshots
+SESSION_STORE = os.getenv("SESSION_STORE", "mongo")
+# Seconds an untouched snapshot is kept before MongoDB's TTL monitor removes it
+SESSION_STATE_TTL = int(os.getenv("SESSION_STATE_TTL", str(7 * 24 * 3600)))
+
+# st.session_state entries saved in a snapshot; chat_history is not saved
+# because it is rebuilt from the transcript on resume. The access code and
+# login flag are left out, so a session ID alone never logs anyone in.
+SNAPSHOT_KEYS = (
+    "session_id",
+    "session_key",
+    "openai_conversation_id",
+    "message_counter",
+    "response_counter",
+    "hint_index",
+    "recent_hints",
+    "conversation_finished",
+    "current_prompt",
+    "prompt_version",
+    "problem_id",
+    "model",
+)
+
+
+class InMemorySessionStore:
+    """Session snapshots in a process-local dict; for tests and single-replica deployments"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._snapshots = {}
+
+    def save(self, session_id, snapshot):
+        with self._lock:
+            self._snapshots[session_id] = copy.deepcopy(snapshot)
+
+    def load(self, session_id):
+        with self._lock:
+            snapshot = self._snapshots.get(session_id)
+            return copy.deepcopy(snapshot) if snapshot is not None else None
+
+    def delete(self, session_id):
+        with self._lock:
+            self._snapshots.pop(session_id, None)
+
+
+class MongoSessionStore:
+    """Session snapshots in the ``session_state`` collection, keyed by session ID and shared by every replica"""
+
+    def __init__(self, connection_string):
+        self.connection_string = connection_string
+
+    @property
+    def collection(self):
+        return get_mongo_client(self.connection_string).rabbitbot.session_state
+
+    def save(self, session_id, snapshot):
+        self.collection.update_one(
+            {"_id": session_id},
+            {"$set": {"snapshot": snapshot, "updated_at": datetime.utcnow()}},
+            upsert=True
+        )
+
+    def load(self, session_id):
+        document = self.collection.find_one({"_id": session_id}, {"snapshot": 1})
+        return document["snapshot"] if document else None
+
+    def delete(self, session_id):
+        self.collection.delete_one({"_id": session_id})
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+def get_session_store(connection_string, kind=SESSION_STORE):
+    """Return the process-wide snapshot store, or None when snapshots are off"""
+    if kind == "off":
+        return None
+    key = (kind, connection_string if kind == "mongo" else None)
+    store = _stores.get(key)
+    if store is None:
+        with _stores_lock:
+            store = _stores.get(key)
+            if store is None:
+                store = MongoSessionStore(connection_string) if kind == "mongo" else InMemorySessionStore()
+                _stores[key] = store
+    return store
+
+def take_snapshot(state):
+    """Compact snapshot of a session's progress"""
+    snapshot = {key: copy.copy(state[key]) for key in SNAPSHOT_KEYS if key in state}
+    context = state.get("bounded_context")
+    if context is not None:
+        snapshot["bounded_context"] = {"summary": context.summary, "summarised_upto": context.summarised_upto}
+    return snapshot
+
+def persist_session(connection_string):
+    """Save the current session's snapshot if it changed since the last save"""
+    store = get_session_store(connection_string)
+    if store is None or not st.session_state.get("session_id"):
+        return False
+    snapshot = take_snapshot(st.session_state)
+    if st.session_state.get("_persisted_snapshot") == snapshot:
+        return False
+    store.save(snapshot["session_id"], snapshot)
+    st.session_state["_persisted_snapshot"] = snapshot
+    return True
+
+def rehydrate_session(connection_string, session_id, identifier):
+    """Restore a saved session, with its chat history from the transcript.
+
+    ``identifier`` is the access code the student just entered; the session
+    is only restored if it was started with that code. Returns True if it was.
+    """
+    from utils.context_window import BoundedContext
+
+    store = get_session_store(connection_string)
+    snapshot = store.load(session_id) if store is not None else None
+    if not snapshot or not snapshot.get("session_key"):
+        return False
+    if snapshot["session_key"] != make_session_key(identifier, snapshot.get("session_id")):
+        return False
+
+    transcript = load_transcript(connection_string, snapshot["session_key"]) or {}
+    stored = sorted(transcript.get("messages", []), key=lambda m: m.get("message_index") or 0)
+    for key in SNAPSHOT_KEYS:
+        if key in snapshot:
+            st.session_state[key] = snapshot[key]
+    st.session_state["user_identifier"] = identifier
+    st.session_state["show_chat"] = True
+    st.session_state["chat_history"] = ChatHistory.from_transcript(transcript)
+    # Messages still queued on another replica are not in the transcript yet;
+    # never reuse their indexes
+    next_index = max((m["message_index"] + 1 for m in stored if m.get("message_index") is not None), default=0)
+    st.session_state["message_counter"] = max(snapshot.get("message_counter", 0), next_index)
+
+    context = BoundedContext()
+    saved_context = snapshot.get("bounded_context") or {}
+    context.summary = saved_context.get("summary", "")
+    context.summarised_upto = min(saved_context.get("summarised_upto", 0), len(stored))
+    st.session_state["bounded_context"] = context
+    st.session_state["_persisted_snapshot"] = take_snapshot(st.session_state)
+    return True
@@ -0,0 +1,92 @@
+import os
+import threading
+import time
+
+# Render cadence, overridable through the environment
+STREAM_RENDER_INTERVAL = float(os.getenv("STREAM_RENDER_INTERVAL", "0.1"))
+STREAM_RENDER_MIN_CHARS = int(os.getenv("STREAM_RENDER_MIN_CHARS", "80"))
+
+_stats_lock = threading.Lock()
+_stats = {"streams": 0, "deltas_received": 0, "renders_emitted": 0}
+
+
+class StreamError(Exception):
+    """A stream that ended with a failure event instead of a complete reply"""
+
+
+class StreamRenderer:
+    """Buffers streamed text deltas and re-renders a Streamlit placeholder at a bounded rate.
+
+    The first delta is rendered immediately so time-to-first-token is not
+    delayed. After that the placeholder is updated only once
+    ``min_interval`` seconds have passed or ``min_chars`` new characters
+    are buffered, whichever happens first, and ``finish()`` always renders
+    the complete text. Pass ``started_at`` (a ``time.perf_counter()`` value
+    taken before the request was sent) so time-to-first-token includes
+    connecting and waiting for the response to start.
+    """
+
+    def __init__(self, container, min_interval=STREAM_RENDER_INTERVAL, min_chars=STREAM_RENDER_MIN_CHARS, started_at=None):
+        self.container = container
+        self.min_interval = min_interval
+        self.min_chars = min_chars
+        self.deltas = 0
+        self.renders = 0
+        self.started_at = started_at if started_at is not None else time.perf_counter()
+        self.first_delta_at = None
+        self._parts = []
+        self._length = 0
+        self._rendered_length = 0
+        self._last_render = 0.0
+
+    @property
+    def text(self):
+        if len(self._parts) > 1:
+            self._parts = ["".join(self._parts)]
+        return self._parts[0] if self._parts else ""
+
+    def append(self, delta):
+        """Add a delta and render if a flush threshold has been reached"""
+        if not delta:
+            return
+        now = time.perf_counter()
+        if self.first_delta_at is None:
+            self.first_delta_at = now
+        self._parts.append(delta)
+        self._length += len(delta)
+        self.deltas += 1
+
+        pending = self._length - self._rendered_length
+        if (self.renders == 0
+                or now - self._last_render >= self.min_interval
+                or (self.min_chars and pending >= self.min_chars)):
+            self._render(now)
+
+    def finish(self):
+        """Render any buffered text and return the full response"""
+        if self._length != self._rendered_length:
+            self._render(time.perf_counter())
+        with _stats_lock:
+            _stats["streams"] += 1
+            _stats["deltas_received"] += self.deltas
+            _stats["renders_emitted"] += self.renders
+        return self.text
+
+    @property
+    def time_to_first_delta(self):
+        """Seconds from ``started_at`` to the first delta, or None"""
+        if self.first_delta_at is None:
+            return None
+        return self.first_delta_at - self.started_at
+
+    def _render(self, now):
+        self.container.markdown(self.text)
+        self.renders += 1
+        self._rendered_length = self._length
+        self._last_render = now
+
+
+def get_stream_stats():
+    """Process-wide totals of deltas received vs. renders emitted"""
+    with _stats_lock:
+        return dict(_stats)
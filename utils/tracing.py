@@ -0,0 +1,249 @@
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import bisect
+import contextvars
+import functools
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Port for the Prometheus metrics endpoint; 0 disables it
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+# Store each turn's span timings with the assistant message in the transcript
+TRACE_TRANSCRIPTS = os.getenv("TRACE_TRANSCRIPTS", "false").lower() in ("1", "true", "yes")
+
+# Histogram bucket upper bounds in seconds, from a fast MongoDB write to a slow reply
+SPAN_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+class Histogram:
+    """Cumulative-bucket histogram in the Prometheus sense"""
+
+    def __init__(self, buckets=SPAN_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        """(upper bound, observations at or below it) pairs, ending with +Inf"""
+        total, pairs = 0, []
+        for bound, count in zip(self.buckets + (float("inf"),), self.counts):
+            total += count
+            pairs.append((bound, total))
+        return pairs
+
+
+class MetricsRegistry:
+    """Process-wide span histograms and error counters, keyed by span name"""
+
+    def __init__(self, buckets=SPAN_BUCKETS):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._histograms = {}
+        self._errors = {}
+
+    def observe(self, span, seconds, error=False):
+        with self._lock:
+            histogram = self._histograms.get(span)
+            if histogram is None:
+                histogram = self._histograms[span] = Histogram(self.buckets)
+            histogram.observe(seconds)
+            if error:
+                self._errors[span] = self._errors.get(span, 0) + 1
+
+    def snapshot(self):
+        """Count, sum and bucket counts for every span"""
+        with self._lock:
+            return {
+                span: {"count": h.count, "sum": h.sum, "buckets": h.cumulative(), "errors": self._errors.get(span, 0)}
+                for span, h in self._histograms.items()
+            }
+
+    def render(self):
+        """Span histograms plus the other modules' gauges in Prometheus text format"""
+        lines = [
+            "# HELP rabbit_span_seconds Time spent in each stage of a chat turn",
+            "# TYPE rabbit_span_seconds histogram",
+        ]
+        snapshot = self.snapshot()
+        for span, data in sorted(snapshot.items()):
+            for bound, count in data["buckets"]:
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f'rabbit_span_seconds_bucket{{span="{span}",le="{le}"}} {count}')
+            lines.append(f'rabbit_span_seconds_sum{{span="{span}"}} {data["sum"]:.6f}')
+            lines.append(f'rabbit_span_seconds_count{{span="{span}"}} {data["count"]}')
+        lines += ["# HELP rabbit_span_errors_total Spans that ended with an exception",
+                  "# TYPE rabbit_span_errors_total counter"]
+        for span, data in sorted(snapshot.items()):
+            lines.append(f'rabbit_span_errors_total{{span="{span}"}} {data["errors"]}')
+
+        for name, labels, value in collect_gauges():
+            label_text = ",".join(f'{k}="{v}"' for k, v in labels.items())
+            lines.append(f"{name}{{{label_text}}} {value}" if label_text else f"{name} {value}")
+        return "\n".join(lines) + "\n"
+
+
+class TurnTrace:
+    """Span timings for one chat turn, in the order the spans finished.
+
+    Set ``aborted`` when the turn ends without a reply, so it is recorded
+    as ``turn.aborted`` rather than skewing the ``turn`` histogram.
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.spans = []
+        self.aborted = False
+
+    def record(self, name, started, seconds):
+        self.spans.append((name, round((started - self.started) * 1000, 1), round(seconds * 1000, 1)))
+
+    def as_dict(self):
+        """Milliseconds per span name, summed when a span ran more than once"""
+        timings = {}
+        for name, _, duration_ms in self.spans:
+            timings[name] = round(timings.get(name, 0.0) + duration_ms, 1)
+        return timings
+
+
+_registry = MetricsRegistry()
+_current_trace = contextvars.ContextVar("turn_trace", default=None)
+
+def get_metrics_registry():
+    return _registry
+
+def record_span(name, seconds, started=None, error=False):
+    """Add a duration measured elsewhere (e.g. time to first token) to the histograms and current turn"""
+    _registry.observe(name, seconds, error)
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.record(name, started if started is not None else time.perf_counter() - seconds, seconds)
+
+@contextmanager
+def span(name):
+    """Time a block into the ``name`` histogram and the current turn's trace"""
+    started = time.perf_counter()
+    error = False
+    try:
+        yield
+    except BaseException:
+        error = True
+        raise
+    finally:
+        record_span(name, time.perf_counter() - started, started, error)
+
+def traced(name):
+    """Decorator form of ``span``"""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+@contextmanager
+def turn_trace():
+    """Collect the spans of one chat turn in this thread; the whole turn is recorded as ``turn`` or ``turn.aborted``"""
+    trace = TurnTrace()
+    token = _current_trace.set(trace)
+    error = False
+    try:
+        yield trace
+    except BaseException:
+        error = True
+        raise
+    finally:
+        _current_trace.reset(token)
+        _registry.observe("turn.aborted" if trace.aborted or error else "turn",
+                          time.perf_counter() - trace.started, error)
+
+def _numeric(value):
+    if isinstance(value, bool):
+        return int(value)
+    if isinstance(value, (int, float)):
+        return value
+    return None
+
+def _gauges(prefix, snapshot, **labels):
+    for key, value in snapshot.items():
+        value = _numeric(value)
+        if value is not None:
+            yield f"rabbit_{prefix}_{key}", labels, value
+
+def collect_gauges():
+    """Current counters from the writer, breakers, OpenAI client, admission control, streaming and chat histories"""
+    from utils.circuit_breaker import get_breaker_states
+    from utils.message_store import get_history_stats
+    from utils.openai_client import get_connection_stats
+    from utils.rate_limit import get_admission_controller
+    from utils.streaming import get_stream_stats
+    from utils.transcript_writer import get_writer_metrics
+
+    gauges = []
+    for index, metrics in enumerate(get_writer_metrics()):
+        gauges.extend(_gauges("transcript_writer", metrics, writer=index))
+    for name, state in get_breaker_states().items():
+        gauges.extend(_gauges("breaker", state, backend=name))
+        gauges.append(("rabbit_breaker_open", {"backend": name}, int(state.get("state") == "open")))
+    gauges.extend(_gauges("openai_client", get_connection_stats()))
+    gauges.extend(_gauges("admission", get_admission_controller().snapshot()))
+    gauges.extend(_gauges("stream", get_stream_stats()))
+    gauges.extend(_gauges("chat_history", get_history_stats()))
+    return gauges
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.split("?")[0] not in ("/metrics", "/"):
+            self.send_error(404)
+            return
+        try:
+            body = _registry.render().encode("utf-8")
+        except Exception as e:
+            logger.warning(f"Rendering metrics failed: {e}")
+            self.send_error(500)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+_server = None
+_server_attempted = False
+_server_lock = threading.Lock()
+
+def start_metrics_server(port=METRICS_PORT, host=METRICS_HOST):
+    """Serve /metrics from a daemon thread, once per process; does nothing when port is 0"""
+    global _server, _server_attempted
+    if not port or _server_attempted:
+        return _server
+    with _server_lock:
+        if not _server_attempted:
+            _server_attempted = True
+            try:
+                server = ThreadingHTTPServer((host, port), _MetricsHandler)
+            except OSError as e:
+                # Another process (e.g. a second replica on this host) holds the port
+                logger.warning(f"Metrics endpoint not started on {host}:{port}: {e}")
+                return None
+            server.daemon_threads = True
+            threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+            _server = server
+            logger.info(f"Serving metrics on http://{host}:{server.server_address[1]}/metrics")
+    return _server
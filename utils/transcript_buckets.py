@@ -0,0 +1,134 @@
+from collections import OrderedDict
+from datetime import datetime
+from pymongo import UpdateOne
+
+from utils.mongodb import get_mongo_client
+from utils.usage import usage_increments
+
+# Messages stored per bucket document; part of the storage format, so only
+# change it for a fresh database
+BUCKET_SIZE = 50
+
+# Bucket used for messages logged without a message_index
+UNINDEXED_BUCKET = -1
+
+
+def bucket_for(message_index):
+    """Bucket number that holds the message with this index"""
+    if message_index is None:
+        return UNINDEXED_BUCKET
+    return message_index // BUCKET_SIZE
+
+def build_bucket_operations(events):
+    """Build idempotent bulk operations for the bucketed layout.
+
+    Returns ``(session_operations, bucket_operations)``: one header upsert per
+    session for the ``sessions`` collection, and for ``transcript_buckets`` one
+    upsert per touched bucket followed by a conditional ``$push`` per message
+    that skips messages whose ``message_index`` is already stored.
+    """
+    sessions = OrderedDict()
+    for event in events:
+        key = (event["session_key"], event["conversation_type"])
+        if key not in sessions:
+            sessions[key] = {"header": event["header"], "messages": []}
+        sessions[key]["messages"].append(event["message"])
+
+    now = datetime.utcnow()
+    session_operations, bucket_operations = [], []
+    for (session_key, conversation_type), session in sessions.items():
+        session_filter = {"session_key": session_key, "conversation_type": conversation_type}
+        set_on_insert = {k: v for k, v in session["header"].items() if k not in ("session_key", "conversation_type")}
+        set_on_insert["timestamp"] = session["messages"][0]["timestamp"]
+        update = {"$set": {"last_updated": now}, "$setOnInsert": set_on_insert}
+        indexes = [m["message_index"] for m in session["messages"] if m.get("message_index") is not None]
+        if indexes:
+            # message_count tracks the highest index seen, which keeps replays idempotent
+            update["$max"] = {"message_count": max(indexes) + 1}
+        session_operations.append(UpdateOne(session_filter, update, upsert=True))
+
+        seen_buckets = set()
+        for message in session["messages"]:
+            bucket = bucket_for(message.get("message_index"))
+            bucket_filter = dict(session_filter, bucket=bucket)
+            if bucket not in seen_buckets:
+                seen_buckets.add(bucket)
+                bucket_operations.append(UpdateOne(
+                    bucket_filter,
+                    {"$setOnInsert": {"messages": [], "count": 0, "created_at": now}},
+                    upsert=True
+                ))
+            message_filter = dict(bucket_filter)
+            if message.get("message_index") is not None:
+                message_filter["messages.message_index"] = {"$ne": message["message_index"]}
+            bucket_operations.append(UpdateOne(
+                message_filter,
+                {"$push": {"messages": message},
+                 "$inc": {"count": 1, **usage_increments(message.get("usage"))},
+                 "$set": {"last_updated": now}}
+            ))
+    return session_operations, bucket_operations
+
+def replay_bucketed_events(connection_string, events):
+    """Write journal events into the sessions and transcript_buckets collections"""
+    if not events:
+        return
+    db = get_mongo_client(connection_string).rabbitbot
+    session_operations, bucket_operations = build_bucket_operations(events)
+    db.sessions.bulk_write(session_operations, ordered=True)
+    db.transcript_buckets.bulk_write(bucket_operations, ordered=True)
+
+def get_session_summary(connection_string, session_key, conversation_type="rabbit_study"):
+    """Return the session header document without loading any messages"""
+    db = get_mongo_client(connection_string).rabbitbot
+    return db.sessions.find_one({"session_key": session_key, "conversation_type": conversation_type})
+
+def iter_session_messages(connection_string, session_key, conversation_type="rabbit_study", start_bucket=0):
+    """Yield the session's messages in order, reading one bucket at a time"""
+    db = get_mongo_client(connection_string).rabbitbot
+    cursor = db.transcript_buckets.find(
+        {"session_key": session_key, "conversation_type": conversation_type, "bucket": {"$gte": start_bucket}},
+        {"messages": 1, "bucket": 1, "_id": 0}
+    ).sort("bucket", 1)
+    for bucket in cursor:
+        for message in sorted(bucket.get("messages", []), key=lambda m: m.get("message_index") or 0):
+            yield message
+    unindexed = db.transcript_buckets.find_one(
+        {"session_key": session_key, "conversation_type": conversation_type, "bucket": UNINDEXED_BUCKET},
+        {"messages": 1, "_id": 0}
+    )
+    if unindexed and start_bucket <= 0:
+        for message in unindexed.get("messages", []):
+            yield message
+
+def load_bucketed_transcript(connection_string, session_key, conversation_type="rabbit_study"):
+    """Reassemble a transcript in the same shape as a single-document transcript"""
+    summary = get_session_summary(connection_string, session_key, conversation_type)
+    if summary is None:
+        return None
+    summary["messages"] = list(iter_session_messages(connection_string, session_key, conversation_type))
+    return summary
+
+def rename_bucketed_session(connection_string, old_session_key, new_session_key, conversation_type="rabbit_study"):
+    """Move a session and its buckets to a new key, merging into any existing session"""
+    old = load_bucketed_transcript(connection_string, old_session_key, conversation_type)
+    if old is None:
+        return None
+    db = get_mongo_client(connection_string).rabbitbot
+    if not old["messages"]:
+        # Nothing to move; keep whichever header already owns the new key
+        if get_session_summary(connection_string, new_session_key, conversation_type) is None:
+            db.sessions.update_one({"_id": old["_id"]}, {"$set": {"session_key": new_session_key}})
+            return str(old["_id"])
+        db.sessions.delete_one({"_id": old["_id"]})
+    else:
+        header = {k: v for k, v in old.items() if k not in ("_id", "messages", "session_key", "message_count", "last_updated")}
+        events = [
+            {"session_key": new_session_key, "conversation_type": conversation_type, "header": header, "message": message}
+            for message in old["messages"]
+        ]
+        replay_bucketed_events(connection_string, events)
+        db.transcript_buckets.delete_many({"session_key": old_session_key, "conversation_type": conversation_type})
+        db.sessions.delete_one({"_id": old["_id"]})
+    new = get_session_summary(connection_string, new_session_key, conversation_type)
+    return str(new["_id"]) if new else None
@@ -0,0 +1,324 @@
+from collections import OrderedDict
+from datetime import datetime
+import atexit
+import logging
+import os
+import queue
+import threading
+import time
+
+from utils.journal import drain_journal, get_journal, replay_events
+from utils.mongodb import get_session_header, get_session_key
+
+logger = logging.getLogger(__name__)
+
+# Writer settings, overridable through the environment
+WRITER_MAX_QUEUE = int(os.getenv("TRANSCRIPT_WRITER_MAX_QUEUE", "10000"))
+WRITER_MAX_BATCH = int(os.getenv("TRANSCRIPT_WRITER_MAX_BATCH", "200"))
+WRITER_FLUSH_INTERVAL = float(os.getenv("TRANSCRIPT_WRITER_FLUSH_INTERVAL", "0.5"))
+WRITER_DRAIN_INTERVAL = float(os.getenv("TRANSCRIPT_WRITER_DRAIN_INTERVAL", "5"))
+WRITER_MAX_DRAIN_INTERVAL = float(os.getenv("TRANSCRIPT_WRITER_MAX_DRAIN_INTERVAL", "60"))
+WRITER_PURGE_INTERVAL = float(os.getenv("TRANSCRIPT_WRITER_PURGE_INTERVAL", "300"))
+# Sessions whose highest stored message index is remembered, most recent first
+WRITER_ACK_SESSIONS = 10000
+
+
+class _FlushRequest:
+    """Queue marker that is acknowledged once everything queued before it is written"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.ok = True
+
+
+class TranscriptWriter:
+    """Background thread that batches transcript messages into bulk writes.
+
+    Every message is first appended to the local journal, then queued for
+    the writer thread, which coalesces events per session key into one
+    ordered bulk write. Batches are flushed when they reach ``max_batch``
+    events, when ``flush_interval`` seconds have passed since the first
+    queued event, or when ``flush()`` is called. Events whose write fails
+    stay in the journal and are replayed once MongoDB is reachable again;
+    until that replay succeeds, newer batches are held in the journal too so
+    messages always reach MongoDB in the order they were sent. Because of
+    that ordering, ``acked_index()`` tells how far each session's messages
+    are known to be stored.
+    """
+
+    def __init__(self, connection_string, journal=None, max_queue=WRITER_MAX_QUEUE, max_batch=WRITER_MAX_BATCH,
+                 flush_interval=WRITER_FLUSH_INTERVAL):
+        self.connection_string = connection_string
+        self.journal = journal or get_journal()
+        self.max_batch = max_batch
+        self.flush_interval = flush_interval
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._thread = None
+        self._stopping = threading.Event()
+        self._lock = threading.Lock()
+        # Replay whatever a previous process left behind as soon as the thread starts
+        self._drain_due = 0.0
+        self._drain_interval = WRITER_DRAIN_INTERVAL
+        # Unknown until the first replay, so hold batches until then
+        self._backlog_pending = True
+        # Bumped by submit() for events that only reached the journal
+        self._deferrals = 0
+        self._purge_due = 0.0
+        self._acked = OrderedDict()
+        self._metrics = {
+            "events_submitted": 0,
+            "events_written": 0,
+            "events_failed": 0,
+            "events_deferred": 0,
+            "events_held": 0,
+            "events_replayed": 0,
+            "batches_flushed": 0,
+            "flush_failures": 0,
+            "max_queue_depth": 0,
+            "last_flush_ms": 0.0,
+            "max_flush_ms": 0.0,
+            "total_flush_ms": 0.0,
+        }
+
+    def start(self):
+        """Start the writer thread if it is not already running"""
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._stopping.clear()
+                self._thread = threading.Thread(target=self._run, name="transcript-writer", daemon=True)
+                self._thread.start()
+
+    def submit(self, session_key, message, message_index=None, header=None, conversation_type="rabbit_study", usage=None):
+        """Journal a message and queue it for writing; returns False if it was left for journal replay"""
+        event = {
+            "session_key": session_key,
+            "conversation_type": conversation_type,
+            "header": header or {},
+            "message": {
+                "message": message,
+                "timestamp": datetime.utcnow(),
+                "message_index": message_index
+            }
+        }
+        if usage:
+            event["message"]["usage"] = usage
+        # The local fsync is the only write the chat path waits for
+        event["journal_id"] = self.journal.append(event)
+        self.start()
+        try:
+            self._queue.put_nowait(event)
+        except queue.Full:
+            # Already durable in the journal; hold later batches behind it until a drain replays it
+            with self._lock:
+                self._metrics["events_deferred"] += 1
+                self._deferrals += 1
+                self._backlog_pending = True
+                self._drain_due = time.monotonic()
+            return False
+        self._bump("events_submitted")
+        depth = self._queue.qsize()
+        with self._lock:
+            if depth > self._metrics["max_queue_depth"]:
+                self._metrics["max_queue_depth"] = depth
+        return True
+
+    def flush(self, timeout=5.0):
+        """Block until every message queued before this call has been written"""
+        if self._thread is None or not self._thread.is_alive():
+            return self._queue.empty()
+        request = _FlushRequest()
+        try:
+            self._queue.put(request, timeout=timeout)
+        except queue.Full:
+            return False
+        return request.done.wait(timeout) and request.ok
+
+    def stop(self, timeout=5.0):
+        """Flush outstanding messages and stop the writer thread"""
+        self.flush(timeout)
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def metrics(self):
+        """Snapshot of queue depth, throughput and flush latency counters"""
+        with self._lock:
+            snapshot = dict(self._metrics)
+        snapshot["queue_depth"] = self._queue.qsize()
+        snapshot["journal_backlog"] = self.journal.backlog()
+        batches = snapshot["batches_flushed"]
+        snapshot["avg_flush_ms"] = snapshot["total_flush_ms"] / batches if batches else 0.0
+        return snapshot
+
+    def acked_index(self, session_key):
+        """Highest message_index of this session that is stored in MongoDB, or None if unknown"""
+        with self._lock:
+            return self._acked.get(session_key)
+
+    def _ack(self, events):
+        with self._lock:
+            for event in events:
+                index = event["message"].get("message_index")
+                if index is None:
+                    continue
+                key = event["session_key"]
+                if index > self._acked.get(key, -1):
+                    self._acked[key] = index
+                self._acked.move_to_end(key)
+            while len(self._acked) > WRITER_ACK_SESSIONS:
+                self._acked.popitem(last=False)
+
+    def _bump(self, name, amount=1):
+        with self._lock:
+            self._metrics[name] += amount
+
+    def _run(self):
+        while not self._stopping.is_set():
+            if time.monotonic() >= self._drain_due:
+                self._drain()
+            try:
+                item = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                continue
+
+            batch, flush_requests = [], []
+            deadline = time.monotonic() + self.flush_interval
+            while True:
+                if isinstance(item, _FlushRequest):
+                    flush_requests.append(item)
+                    break
+                batch.append(item)
+                if len(batch) >= self.max_batch:
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+
+            ok = self._write_batch(batch) if batch else True
+            for request in flush_requests:
+                request.ok = ok
+                request.done.set()
+
+    def _write_batch(self, batch):
+        if self._backlog_pending:
+            # Writing now would put these messages ahead of older journaled ones;
+            # they are already in the journal, so the next replay covers them
+            self._bump("events_held", len(batch))
+            if time.monotonic() >= self._drain_due:
+                self._drain()
+            return not self._backlog_pending
+        started = time.perf_counter()
+        try:
+            replay_events(self.connection_string, batch)
+        except Exception as e:
+            # Events remain pending in the journal and are retried by _drain()
+            self._bump("flush_failures")
+            self._bump("events_failed", len(batch))
+            self._backlog_pending = True
+            self._schedule_drain(failed=True)
+            logger.warning(f"Transcript flush of {len(batch)} messages failed, left in journal: {e}")
+            return False
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        self.journal.mark_replayed([event["journal_id"] for event in batch])
+        self._ack(batch)
+        with self._lock:
+            self._metrics["events_written"] += len(batch)
+            self._metrics["batches_flushed"] += 1
+            self._metrics["last_flush_ms"] = elapsed_ms
+            self._metrics["total_flush_ms"] += elapsed_ms
+            self._metrics["max_flush_ms"] = max(self._metrics["max_flush_ms"], elapsed_ms)
+        return True
+
+    def _drain(self):
+        with self._lock:
+            deferrals = self._deferrals
+        try:
+            replayed = drain_journal(self.connection_string, self.journal, on_replayed=self._ack)
+        except Exception as e:
+            self._backlog_pending = True
+            self._schedule_drain(failed=True)
+            logger.warning(f"Transcript journal replay failed, {self.journal.backlog()} events pending: {e}")
+            return
+        with self._lock:
+            # An event deferred while draining may have missed this replay
+            self._backlog_pending = self._deferrals != deferrals
+        if replayed:
+            self._bump("events_replayed", replayed)
+            logger.info(f"Replayed {replayed} transcript events from the journal")
+        self._schedule_drain(failed=False)
+        if self._backlog_pending:
+            self._drain_due = time.monotonic()
+        self._purge()
+
+    def _purge(self):
+        # Replayed rows are only kept for inspection; drop them now and then so the journal stays small
+        if time.monotonic() < self._purge_due:
+            return
+        self._purge_due = time.monotonic() + WRITER_PURGE_INTERVAL
+        try:
+            removed = self.journal.purge_replayed()
+        except Exception as e:
+            logger.warning(f"Purging replayed journal events failed: {e}")
+            return
+        if removed:
+            logger.info(f"Purged {removed} replayed events from the transcript journal")
+
+    def _schedule_drain(self, failed):
+        # Back off while MongoDB is unavailable, reset once a replay succeeds
+        if failed:
+            self._drain_interval = min(self._drain_interval * 2, WRITER_MAX_DRAIN_INTERVAL)
+        else:
+            self._drain_interval = WRITER_DRAIN_INTERVAL
+        self._drain_due = time.monotonic() + self._drain_interval
+
+
+_writers = {}
+_writers_lock = threading.Lock()
+
+def get_transcript_writer(connection_string):
+    """Return the process-wide writer for this connection string, starting it on first use"""
+    writer = _writers.get(connection_string)
+    if writer is None:
+        with _writers_lock:
+            writer = _writers.get(connection_string)
+            if writer is None:
+                writer = TranscriptWriter(connection_string)
+                writer.start()
+                _writers[connection_string] = writer
+    return writer
+
+def stop_transcript_writers(timeout=5.0):
+    """Flush and stop every writer; registered to run at interpreter shutdown"""
+    with _writers_lock:
+        writers = list(_writers.values())
+        _writers.clear()
+    for writer in writers:
+        writer.stop(timeout)
+
+atexit.register(stop_transcript_writers)
+
+def get_writer_metrics():
+    """Metrics of every running writer"""
+    with _writers_lock:
+        writers = list(_writers.values())
+    return [writer.metrics() for writer in writers]
+
+def enqueue_message(connection_string, conversation_type, message, message_index=None, usage=None):
+    """Queue a message for the current Streamlit session; same arguments as log_message"""
+    if conversation_type == "rabbit_study":
+        return get_transcript_writer(connection_string).submit(
+            get_session_key(),
+            message,
+            message_index,
+            header=get_session_header(conversation_type),
+            conversation_type=conversation_type,
+            usage=usage
+        )
+
+def flush_transcripts(connection_string, timeout=5.0):
+    """Wait until all queued messages have been written to MongoDB"""
+    return get_transcript_writer(connection_string).flush(timeout)
@@ -0,0 +1,63 @@
+import os
+
+# Token counts recorded for every model reply
+TOKEN_FIELDS = ("input_tokens", "cached_tokens", "output_tokens", "reasoning_tokens")
+
+# USD per million tokens, used only for cost reports; defaults are gpt-5 list prices
+USAGE_PRICE_INPUT = float(os.getenv("USAGE_PRICE_INPUT", "1.25"))
+USAGE_PRICE_CACHED_INPUT = float(os.getenv("USAGE_PRICE_CACHED_INPUT", "0.125"))
+USAGE_PRICE_OUTPUT = float(os.getenv("USAGE_PRICE_OUTPUT", "10"))
+
+
+def _detail(details, name):
+    return (getattr(details, name, None) or 0) if details is not None else 0
+
+def from_responses_usage(usage):
+    """Token counts from a Responses API ``response.usage`` object"""
+    if usage is None:
+        return None
+    return {
+        "input_tokens": usage.input_tokens or 0,
+        "cached_tokens": _detail(usage.input_tokens_details, "cached_tokens"),
+        "output_tokens": usage.output_tokens or 0,
+        "reasoning_tokens": _detail(usage.output_tokens_details, "reasoning_tokens"),
+    }
+
+def from_chat_usage(usage):
+    """Token counts from a Chat Completions ``usage`` object"""
+    if usage is None:
+        return None
+    return {
+        "input_tokens": usage.prompt_tokens or 0,
+        "cached_tokens": _detail(usage.prompt_tokens_details, "cached_tokens"),
+        "output_tokens": usage.completion_tokens or 0,
+        "reasoning_tokens": _detail(usage.completion_tokens_details, "reasoning_tokens"),
+    }
+
+def prompt_cache_key(instructions):
+    """Cache routing key shared by every request that starts with the same instructions"""
+    return f"{instructions.version}:{instructions.sha256[:16]}"
+
+def usage_increments(usage, prefix="usage_totals"):
+    """``$inc`` fields that add one reply's usage to a document's running totals"""
+    if not usage or set(usage) <= {"trace"}:
+        # No reply was generated; a turn that only carries its trace adds nothing
+        return {}
+    increments = {f"{prefix}.{field}": usage.get(field) or 0 for field in TOKEN_FIELDS}
+    increments[f"{prefix}.turns"] = 1
+    if usage.get("latency_ms") is not None:
+        increments[f"{prefix}.latency_ms"] = usage["latency_ms"]
+    return increments
+
+def estimate_cost(usage):
+    """Approximate USD cost of a usage record or usage totals"""
+    cached = usage.get("cached_tokens") or 0
+    uncached = (usage.get("input_tokens") or 0) - cached
+    return (uncached * USAGE_PRICE_INPUT
+            + cached * USAGE_PRICE_CACHED_INPUT
+            + (usage.get("output_tokens") or 0) * USAGE_PRICE_OUTPUT) / 1_000_000
+
+def cache_hit_rate(usage):
+    """Share of input tokens served from the provider's prompt cache"""
+    input_tokens = usage.get("input_tokens") or 0
+    return (usage.get("cached_tokens") or 0) / input_tokens if input_tokens else 0.0